@@ -0,0 +1,102 @@
+"""Algèbre d'audiences : union, intersection et différence de listes et de segments.
+
+Une combinaison (``schemas.AudienceCombination``) assemble des opérandes :
+
+- ``liste`` : membres d'une liste de diffusion (``mailinglist_contact``) ;
+- ``segment`` : contacts d'un segment simple (``SegmentationCriteria``) ;
+- ``requete`` : contacts d'un segment avancé (``SegmentQuery``, segment_query.py) ;
+- ``combinaison`` : une autre combinaison, imbriquée.
+
+Chaque opérande devient un ``SELECT`` d'identifiants de contacts, et la
+combinaison une requête composée ``UNION`` / ``INTERSECT`` / ``EXCEPT`` exécutée
+par la base : la différence est le premier opérande moins l'union des suivants.
+Les résultats ne transitent jamais par Python : le total est un ``COUNT`` sur la
+requête composée, et l'enregistrement (nouvelle liste, audience de campagne) un
+``INSERT ... SELECT``.
+
+Les combinaisons imbriquées sont relues via une sous-requête, ce qui les rend
+valides aussi sous SQLite (pas de requête composée entre parenthèses).
+"""
+from typing import List, Set
+
+from sqlalchemy import except_, func, intersect, select, union
+from sqlalchemy.orm import Session
+
+import crud
+import segment_query
+from models import Contact, MailingList, mailinglist_contact
+from schemas import AudienceCombination, AudienceList, AudienceQuery, AudienceSegment
+
+MAX_OPERANDS = 50
+MAX_DEPTH = 8
+
+_OPERATIONS = {"union": union, "intersection": intersect}
+
+
+# ==================== VALIDATION ====================
+def _walk(combination: AudienceCombination, depth: int = 0) -> List:
+    """Opérandes terminaux de la combinaison (ValueError si trop profonde)"""
+    if depth > MAX_DEPTH:
+        raise ValueError(f"Combinaison trop profonde (au plus {MAX_DEPTH} niveaux)")
+    leaves = []
+    for operand in combination.operandes:
+        if isinstance(operand, AudienceCombination):
+            leaves.extend(_walk(operand, depth + 1))
+        else:
+            leaves.append(operand)
+    return leaves
+
+
+def validate(db: Session, combination: AudienceCombination) -> None:
+    """Vérifier la taille de la combinaison et l'existence des listes (une requête)"""
+    leaves = _walk(combination)
+    if len(leaves) > MAX_OPERANDS:
+        raise ValueError(f"Combinaison trop volumineuse (au plus {MAX_OPERANDS} opérandes)")
+    list_ids: Set[int] = {leaf.liste_id for leaf in leaves if isinstance(leaf, AudienceList)}
+    if list_ids:
+        found = {row[0] for row in db.query(MailingList.id_liste).filter(MailingList.id_liste.in_(list_ids))}
+        missing = sorted(list_ids - found)
+        if missing:
+            raise ValueError(f"Listes de diffusion introuvables: {missing}")
+
+
+# ==================== COMPILATION ====================
+def _operand_select(db: Session, operand):
+    """SELECT des identifiants de contacts d'un opérande (colonne ``contact_id``)"""
+    if isinstance(operand, AudienceList):
+        return select(mailinglist_contact.c.contact_id.label("contact_id")).where(
+            mailinglist_contact.c.mailinglist_id == operand.liste_id
+        )
+    if isinstance(operand, AudienceSegment):
+        query = crud.build_segmentation_query(db, operand.criteres)
+    elif isinstance(operand, AudienceQuery):
+        query = segment_query.build_query(db, operand.requete)
+    else:
+        return select(compile_combination(db, operand).subquery().c.contact_id)
+    return query.with_entities(Contact.id_contact.label("contact_id")).statement
+
+
+def compile_combination(db: Session, combination: AudienceCombination):
+    """Requête composée (non exécutée) des identifiants de contacts de la combinaison"""
+    selects = [_operand_select(db, operand) for operand in combination.operandes]
+    if len(selects) == 1:
+        return selects[0]
+    if combination.operation == "difference":
+        rest = selects[1] if len(selects) == 2 else select(union(*selects[1:]).subquery().c.contact_id)
+        return except_(selects[0], rest)
+    return _OPERATIONS[combination.operation](*selects)
+
+
+# ==================== REQUETES ====================
+def build_query(db: Session, combination: AudienceCombination):
+    """Requête des contacts de la combinaison (filtrable, projetable comme un segment)"""
+    validate(db, combination)
+    ids = compile_combination(db, combination).subquery()
+    return db.query(Contact).filter(Contact.id_contact.in_(select(ids.c.contact_id)))
+
+
+def count(db: Session, combination: AudienceCombination) -> int:
+    """Taille de la combinaison, sans rien matérialiser"""
+    validate(db, combination)
+    ids = compile_combination(db, combination).subquery()
+    return db.execute(select(func.count()).select_from(ids)).scalar() or 0
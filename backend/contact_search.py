@@ -0,0 +1,308 @@
+"""Recherche indexée des contacts (prénom, nom, email, téléphone).
+
+- Requête numérique (chiffres et séparateurs « + . - ( ) espace ») : les chiffres
+  saisis, et leur forme sans « 00 » ni « 0 » national (si elle garde au moins
+  ``MIN_PHONE_DIGITS`` chiffres), sont cherchés en fin de numéro sur
+  ``Contact.telephone_inverse`` (chiffres inversés, index B-tree), en début de
+  numéro sur ``Contact.telephone_chiffres`` (index B-tree) et, comme avant, au
+  milieu du numéro (index GIN ``pg_trgm`` sur ``telephone_chiffres`` lorsqu'il
+  existe). « 06 12 34 56 78 » retrouve ainsi « +33612345678 », et « 0005 »
+  retrouve « +33612340005 ».
+- Texte sur Postgres : index GIN ``pg_trgm`` sur ``SEARCH_EXPRESSION`` (prénom,
+  nom et email en minuscules) ; correspondance par sous-chaîne (LIKE) ou
+  approchée (``<%``), classée par ``word_similarity``.
+- Texte ailleurs (SQLite, tests) ou sans ``pg_trgm`` : index de trigrammes en
+  mémoire, chargé à la première recherche puis tenu à jour par les événements
+  ORM sur ``Contact``. Les identifiants trouvés sont relus en base, un index en
+  retard ne renvoie donc jamais de contact supprimé.
+
+Les résultats sont classés (début de mot, sous-chaîne, puis approchés) et limités.
+"""
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import case, event, func, literal_column, or_, text
+from sqlalchemy.orm import Session
+
+from models import Contact, chiffres_telephone, inverser_telephone
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MIN_PHONE_DIGITS = 3
+FUZZY_THRESHOLD = 0.3
+LOAD_BATCH_SIZE = 10000
+
+SEARCH_EXPRESSION = "lower(coalesce(prenom, '') || ' ' || coalesce(nom, '') || ' ' || coalesce(email, ''))"
+TRGM_INDEX_NAME = "ix_contacts_recherche_trgm"
+PHONE_TRGM_INDEX_NAME = "ix_contacts_telephone_trgm"
+
+_PHONE_QUERY = re.compile(r"[\d\s+().-]+")
+
+# None tant que la disponibilité de pg_trgm n'a pas été vérifiée
+_trgm_available: Optional[bool] = None
+
+
+def detect_search_indexes(engine) -> bool:
+    """Vérifier (lecture seule) si l'index pg_trgm est prêt ; retourne True s'il est utilisé"""
+    global _trgm_available
+    if engine.dialect.name != "postgresql":
+        _trgm_available = False
+        return False
+    with engine.connect() as connection:
+        valid = connection.execute(
+            text(
+                "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = :name"
+            ),
+            {"name": TRGM_INDEX_NAME},
+        ).scalar()
+    _trgm_available = bool(valid)
+    if not _trgm_available:
+        print("⚠️ Recherche: index pg_trgm absent (lancer migrate_schema.py), index en mémoire utilisé")
+    return _trgm_available
+
+
+def ensure_search_indexes(engine) -> bool:
+    """Préparer les index de recherche (opération longue, lancée par migrate_schema.py) ;
+    retourne True si pg_trgm est utilisé"""
+    global _trgm_available
+    _backfill_phone_index(engine)
+    if engine.dialect.name != "postgresql":
+        _trgm_available = False
+        return False
+    try:
+        # CONCURRENTLY : la table reste accessible en écriture pendant la construction
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            connection.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {TRGM_INDEX_NAME} "
+                f"ON contacts USING gin (({SEARCH_EXPRESSION}) gin_trgm_ops)"
+            ))
+            connection.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {PHONE_TRGM_INDEX_NAME} "
+                f"ON contacts USING gin (telephone_chiffres gin_trgm_ops)"
+            ))
+        _trgm_available = True
+    except Exception as e:
+        print(f"⚠️ Recherche: pg_trgm indisponible, index en mémoire utilisé - {e}")
+        _trgm_available = False
+    return _trgm_available
+
+
+def _backfill_phone_index(engine) -> None:
+    """Renseigner ``telephone_chiffres`` et ``telephone_inverse`` pour les contacts créés
+    avant leur introduction"""
+    with Session(engine) as db:
+        last_id = 0
+        while True:
+            rows = (
+                db.query(Contact.id_contact, Contact.numero_telephone)
+                .filter(Contact.id_contact > last_id, Contact.telephone_chiffres.is_(None),
+                        Contact.numero_telephone.isnot(None))
+                .order_by(Contact.id_contact)
+                .limit(LOAD_BATCH_SIZE)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = [
+                {"id_contact": contact_id, "telephone_chiffres": chiffres_telephone(numero),
+                 "telephone_inverse": inverser_telephone(numero)}
+                for contact_id, numero in rows if chiffres_telephone(numero)
+            ]
+            if updates:
+                db.bulk_update_mappings(Contact, updates)
+                db.commit()
+
+
+# ==================== RECHERCHE ====================
+def search_contacts(db: Session, query: str, limit: int = DEFAULT_LIMIT) -> List[Contact]:
+    """Contacts correspondant à ``query``, du plus pertinent au moins pertinent"""
+    query = query.strip()
+    limit = max(1, min(limit, MAX_LIMIT))
+    if not query:
+        return []
+
+    forms = _phone_digits(query)
+    if forms:
+        return _search_phone(db, forms, limit)
+
+    if _trgm_available is None:
+        detect_search_indexes(db.get_bind())
+    if _trgm_available:
+        return _search_trigram_index(db, query.lower(), limit)
+    return _search_memory_index(db, query.lower(), limit)
+
+
+def _phone_digits(query: str) -> Optional[List[str]]:
+    """Formes à chercher d'une requête numérique : chiffres saisis, puis sans préfixe
+    00 ou 0 national si au moins ``MIN_PHONE_DIGITS`` chiffres restent"""
+    if not _PHONE_QUERY.fullmatch(query):
+        return None
+    digits = "".join(c for c in query if c.isdigit())
+    if len(digits) < MIN_PHONE_DIGITS:
+        return None
+    forms = [digits]
+    stripped = digits[2:] if digits.startswith("00") else digits[1:] if digits.startswith("0") else digits
+    if stripped != digits and len(stripped) >= MIN_PHONE_DIGITS:
+        forms.append(stripped)
+    return forms
+
+
+def _digit_range(column, digits: str):
+    # Préfixe de la colonne : intervalle sur l'index B-tree (":" suit "9")
+    return (column >= digits) & (column < digits + ":")
+
+
+def _search_phone(db: Session, forms: List[str], limit: int) -> List[Contact]:
+    exact = [Contact.telephone_chiffres == digits for digits in forms]
+    suffix = [_digit_range(Contact.telephone_inverse, digits[::-1]) for digits in forms]
+    prefix = [_digit_range(Contact.telephone_chiffres, digits) for digits in forms]
+    # La forme la plus courte couvre toutes les autres ; pg_trgm sert ce LIKE sur Postgres
+    contains = Contact.telephone_chiffres.like(f"%{forms[-1]}%")
+    return (
+        db.query(Contact)
+        .filter(or_(*suffix, *prefix, contains))
+        .order_by(
+            case((or_(*exact), 0), (or_(*suffix), 1), (or_(*prefix), 2), else_=3),
+            Contact.id_contact,
+        )
+        .limit(limit)
+        .all()
+    )
+
+
+def _search_trigram_index(db: Session, query: str, limit: int) -> List[Contact]:
+    expression = literal_column(SEARCH_EXPRESSION)
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    contains = expression.like(f"%{escaped}%", escape="\\")
+    word_start = expression.like(f"{escaped}%", escape="\\") | expression.like(f"% {escaped}%", escape="\\")
+    fuzzy = text(f":recherche <% ({SEARCH_EXPRESSION})").bindparams(recherche=query)
+    return (
+        db.query(Contact)
+        .filter(contains | fuzzy)
+        .order_by(
+            case((word_start, 0), (contains, 1), else_=2),
+            func.word_similarity(query, expression).desc(),
+            Contact.id_contact,
+        )
+        .limit(limit)
+        .all()
+    )
+
+
+def _search_memory_index(db: Session, query: str, limit: int) -> List[Contact]:
+    if not _memory_index.loaded:
+        _memory_index.load(db)
+    ids = _memory_index.search(query, limit)
+    if not ids:
+        return []
+    contacts = {c.id_contact: c for c in db.query(Contact).filter(Contact.id_contact.in_(ids))}
+    return [contacts[contact_id] for contact_id in ids if contact_id in contacts]
+
+
+# ==================== INDEX EN MEMOIRE ====================
+def _search_text(prenom, nom, email) -> str:
+    return f"{prenom or ''} {nom or ''} {email or ''}".lower()
+
+
+def _trigrams(value: str) -> Set[str]:
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class NgramIndex:
+    """Index inversé trigramme -> identifiants de contacts"""
+
+    def __init__(self):
+        self.loaded = False
+        self._documents: Dict[int, str] = {}
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def load(self, db: Session) -> None:
+        with self._lock:
+            if self.loaded:
+                return
+            last_id = 0
+            while True:
+                rows = (
+                    db.query(Contact.id_contact, Contact.prenom, Contact.nom, Contact.email)
+                    .filter(Contact.id_contact > last_id)
+                    .order_by(Contact.id_contact)
+                    .limit(LOAD_BATCH_SIZE)
+                    .all()
+                )
+                if not rows:
+                    break
+                for contact_id, prenom, nom, email in rows:
+                    self._add(contact_id, _search_text(prenom, nom, email))
+                last_id = rows[-1][0]
+            self.loaded = True
+
+    def put(self, contact_id: int, document: str) -> None:
+        with self._lock:
+            self._remove(contact_id)
+            self._add(contact_id, document)
+
+    def remove(self, contact_id: int) -> None:
+        with self._lock:
+            self._remove(contact_id)
+
+    def _add(self, contact_id: int, document: str) -> None:
+        self._documents[contact_id] = document
+        for gram in _trigrams(document):
+            self._postings[gram].add(contact_id)
+
+    def _remove(self, contact_id: int) -> None:
+        document = self._documents.pop(contact_id, None)
+        if document is None:
+            return
+        for gram in _trigrams(document):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(contact_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def search(self, query: str, limit: int) -> List[int]:
+        """Identifiants classés : début de mot, sous-chaîne, puis similarité de trigrammes"""
+        with self._lock:
+            grams = _trigrams(query)
+            if grams:
+                hits = Counter()
+                for gram in grams:
+                    hits.update(self._postings.get(gram, ()))
+                candidates = ((cid, count / len(grams)) for cid, count in hits.items())
+            else:
+                # Requête de moins de 3 caractères : parcours des documents
+                candidates = ((cid, 1.0) for cid, doc in self._documents.items() if query in doc)
+
+            ranked: List[Tuple[int, float, int]] = []
+            for contact_id, similarity in candidates:
+                document = self._documents[contact_id]
+                if query in document:
+                    word_start = document.startswith(query) or f" {query}" in document
+                    ranked.append((0 if word_start else 1, -similarity, contact_id))
+                elif similarity >= FUZZY_THRESHOLD:
+                    ranked.append((2, -similarity, contact_id))
+        ranked.sort()
+        return [contact_id for _, _, contact_id in ranked[:limit]]
+
+
+_memory_index = NgramIndex()
+
+
+@event.listens_for(Contact, "after_insert")
+@event.listens_for(Contact, "after_update")
+def _index_contact(mapper, connection, contact) -> None:
+    if _memory_index.loaded:
+        _memory_index.put(contact.id_contact, _search_text(contact.prenom, contact.nom, contact.email))
+
+
+@event.listens_for(Contact, "after_delete")
+def _unindex_contact(mapper, connection, contact) -> None:
+    if _memory_index.loaded:
+        _memory_index.remove(contact.id_contact)
@@ -0,0 +1,153 @@
+"""Statistiques de segmentation des contacts, en un seul passage sur la table.
+
+Toutes les répartitions (type de client, ville, région, genre, opt-in, tranche
+d'âge) et le total sont produits par une seule requête :
+
+- Postgres : ``GROUP BY GROUPING SETS`` ; ``GROUPING()`` indique à quelle
+  répartition appartient chaque ligne ;
+- autres bases : ``GROUP BY`` sur l'ensemble des dimensions, puis les
+  combinaisons (peu nombreuses) sont sommées par dimension en Python.
+
+Le résultat est gardé ``STATS_CACHE_TTL`` secondes, tant que les contacts n'ont pas
+été modifiés par ce processus (version de segment_cache.py). Un seul calcul à la
+fois : les requêtes concurrentes attendent puis réutilisent le résultat.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, tuple_
+from sqlalchemy.orm import Session
+
+import segment_cache
+from models import Contact
+
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "30"))
+TOP_CITIES = 10
+
+# Tranches d'âge de l'histogramme : (libellé, borne basse incluse, borne haute exclue)
+AGE_BUCKETS = (
+    ("<18", None, 18),
+    ("18-24", 18, 25),
+    ("25-34", 25, 35),
+    ("35-44", 35, 45),
+    ("45-54", 45, 55),
+    ("55-64", 55, 65),
+    ("65+", 65, None),
+)
+
+DIMENSIONS = ("type_client", "ville", "region", "genre", "statut_opt_in", "tranche_age")
+
+
+def _age_bucket_expression():
+    whens = []
+    for label, low, high in AGE_BUCKETS:
+        if low is None:
+            whens.append((Contact.age < high, label))
+        elif high is None:
+            whens.append((Contact.age >= low, label))
+        else:
+            whens.append(((Contact.age >= low) & (Contact.age < high), label))
+    return case(*whens, else_=None)
+
+
+def _columns(db: Session):
+    """Colonnes des dimensions, lues dans une sous-requête (la tranche d'âge y est calculée une fois)"""
+    dimensions = db.query(
+        Contact.type_client, Contact.ville, Contact.region, Contact.genre,
+        Contact.statut_opt_in, _age_bucket_expression().label("tranche_age"),
+    ).subquery()
+    return [dimensions.c[dimension] for dimension in DIMENSIONS]
+
+
+# ==================== CALCUL ====================
+def _counts_grouping_sets(db: Session) -> Tuple[int, Dict[str, Counter]]:
+    columns = _columns(db)
+    grouping_ids = [func.grouping(column) for column in columns]
+    rows = (
+        db.query(*columns, *grouping_ids, func.count())
+        .group_by(func.grouping_sets(*[tuple_(column) for column in columns], tuple_()))
+        .all()
+    )
+    total = 0
+    counts = {dimension: Counter() for dimension in DIMENSIONS}
+    for row in rows:
+        values, flags, count = row[:len(columns)], row[len(columns):-1], row[-1]
+        grouped = [dimension for dimension, flag in zip(DIMENSIONS, flags) if flag == 0]
+        if not grouped:
+            total = count
+        else:
+            index = DIMENSIONS.index(grouped[0])
+            counts[grouped[0]][values[index]] += count
+    return total, counts
+
+
+def _counts_single_scan(db: Session) -> Tuple[int, Dict[str, Counter]]:
+    columns = _columns(db)
+    rows = db.query(*columns, func.count()).group_by(*columns).all()
+    total = 0
+    counts = {dimension: Counter() for dimension in DIMENSIONS}
+    for row in rows:
+        count = row[-1]
+        total += count
+        for dimension, value in zip(DIMENSIONS, row[:-1]):
+            counts[dimension][value] += count
+    return total, counts
+
+
+def compute_segmentation_stats(db: Session) -> dict:
+    if db.get_bind().dialect.name == "postgresql":
+        total, counts = _counts_grouping_sets(db)
+    else:
+        total, counts = _counts_single_scan(db)
+
+    def breakdown(dimension: str, key: str, limit: Optional[int] = None) -> List[dict]:
+        items = sorted(((value, count) for value, count in counts[dimension].items() if value),
+                       key=lambda item: (-item[1], item[0]))
+        return [{key: value, "count": count} for value, count in items[:limit]]
+
+    ages = counts["tranche_age"]
+    return {
+        "total_contacts": total,
+        "by_customer_type": breakdown("type_client", "type"),
+        "top_cities": breakdown("ville", "ville", TOP_CITIES),
+        "by_region": breakdown("region", "region"),
+        "by_gender": breakdown("genre", "genre"),
+        "by_opt_in_status": [{"opt_in": value, "count": counts["statut_opt_in"][value]} for value in (True, False)],
+        "age_histogram": [{"tranche": label, "count": ages.get(label, 0)} for label, _, _ in AGE_BUCKETS],
+        "age_unknown": ages.get(None, 0),
+        "generated_at": datetime.utcnow().isoformat(),
+    }
+
+
+# ==================== CACHE ====================
+_lock = threading.Lock()
+# (version des contacts, horodatage, statistiques)
+_cached: Optional[Tuple[int, float, dict]] = None
+
+
+def _fresh() -> Optional[dict]:
+    if _cached is None:
+        return None
+    cached_version, computed_at, stats = _cached
+    if cached_version != segment_cache.version() or time.monotonic() - computed_at >= STATS_CACHE_TTL:
+        return None
+    return stats
+
+
+def get_segmentation_stats(db: Session) -> dict:
+    """Statistiques de segmentation (au plus STATS_CACHE_TTL secondes d'ancienneté)"""
+    global _cached
+    stats = _fresh()
+    if stats is not None:
+        return stats
+    with _lock:
+        stats = _fresh()  # calculées par une requête concurrente pendant l'attente
+        if stats is None:
+            version = segment_cache.version()
+            stats = compute_segmentation_stats(db)
+            _cached = (version, time.monotonic(), stats)
+    return stats
@@ -1,11 +1,23 @@
 
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-from models import User, Contact, Campagne, MailingList, Message
-from schemas import UserCreate, ContactCreate, ContactUpdate, CampagneCreate, CampagneUpdate, SegmentationCriteria
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, tablesample
+from sqlalchemy.dialects import postgresql, sqlite
+from models import User, Contact, Campagne, MailingList, Message, Expediteur, campagne_contact, mailinglist_contact
+from schemas import UserCreate, ContactCreate, ContactUpdate, CampagneCreate, CampagneUpdate, SegmentationCriteria, SegmentQuery
 from security import hash_password
-from typing import List, Optional
+import contact_search
+import dashboard_counters
+import segment_cache
+import segment_index
+import segment_query
+from pagination import paginate
+from typing import List, Optional, Sequence, Tuple
 from datetime import datetime
+import json
+import numpy as np
+
+# Au-delà de n × ce facteur (estimation), l'échantillon est tiré par TABLESAMPLE
+SAMPLE_TABLESAMPLE_FACTOR = 20
 
 # ==================== USER CRUD ====================
 def get_user_by_email(db: Session, email: str):
@@ -63,11 +75,17 @@ def create_contact(db: Session, contact: ContactCreate) -> Contact:
     db.add(db_contact)
     db.commit()
     db.refresh(db_contact)
+    segment_index.apply(None, segment_index.snapshot(db_contact))
+    segment_cache.bump()
     return db_contact
 
 def get_contacts(db: Session, skip: int = 0, limit: int = 100) -> List[Contact]:
-    """Récupérer tous les contacts avec pagination"""
-    return db.query(Contact).offset(skip).limit(limit).all()
+    """Récupérer tous les contacts avec pagination par décalage (préférer get_contacts_page)"""
+    return db.query(Contact).order_by(Contact.id_contact).offset(skip).limit(limit).all()
+
+def get_contacts_page(db: Session, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Contact], Optional[str]]:
+    """Page de contacts par curseur ; retourne (contacts, curseur suivant)"""
+    return paginate(db.query(Contact), Contact.id_contact, limit, cursor)
 
 def get_contact_by_id(db: Session, contact_id: int) -> Optional[Contact]:
     """Récupérer un contact par ID"""
@@ -79,6 +97,7 @@ def update_contact(db: Session, contact_id: int, contact_update: ContactUpdate)
     if not db_contact:
         return None
     
+    before = segment_index.snapshot(db_contact)
     update_data = contact_update.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(db_contact, field, value)
@@ -86,54 +105,125 @@ def update_contact(db: Session, contact_id: int, contact_update: ContactUpdate)
     db_contact.derniere_activite = datetime.utcnow()
     db.commit()
     db.refresh(db_contact)
+    segment_index.apply(before, segment_index.snapshot(db_contact))
+    segment_cache.bump()
     return db_contact
 
 def delete_contact(db: Session, contact_id: int) -> bool:
     """Supprimer un contact"""
     db_contact = get_contact_by_id(db, contact_id)
     if db_contact:
+        before = segment_index.snapshot(db_contact)
         db.delete(db_contact)
         db.commit()
+        segment_index.apply(before, None)
+        segment_cache.bump()
         return True
     return False
 
-def search_contacts(db: Session, query: str) -> List[Contact]:
-    """Rechercher des contacts par nom, prénom ou téléphone"""
-    return db.query(Contact).filter(
-        or_(
-            Contact.nom.ilike(f"%{query}%"),
-            Contact.prenom.ilike(f"%{query}%"),
-            Contact.numero_telephone.ilike(f"%{query}%"),
-            Contact.email.ilike(f"%{query}%")
-        )
-    ).all()
+def search_contacts(db: Session, query: str, limit: int = contact_search.DEFAULT_LIMIT) -> List[Contact]:
+    """Rechercher des contacts par nom, prénom, email ou téléphone (index de recherche, résultats classés)"""
+    return contact_search.search_contacts(db, query, limit)
 
-def get_contacts_by_segmentation(db: Session, criteria: SegmentationCriteria) -> List[Contact]:
-    """Récupérer des contacts selon des critères de segmentation"""
-    query = db.query(Contact)
+def build_segmentation_query(db: Session, criteria: SegmentationCriteria, entity=Contact):
+    """Construire la requête (non exécutée) correspondant aux critères de segmentation
+
+    ``entity`` permet de viser un alias de la table contacts (ex. un échantillon TABLESAMPLE).
+    """
+    query = db.query(entity)
     
     if criteria.type_client:
-        query = query.filter(Contact.type_client.in_(criteria.type_client))
+        query = query.filter(entity.type_client.in_(criteria.type_client))
     
     if criteria.ville:
-        query = query.filter(Contact.ville.in_(criteria.ville))
+        query = query.filter(entity.ville.in_(criteria.ville))
     
     if criteria.region:
-        query = query.filter(Contact.region.in_(criteria.region))
+        query = query.filter(entity.region.in_(criteria.region))
     
     if criteria.age_min is not None:
-        query = query.filter(Contact.age >= criteria.age_min)
+        query = query.filter(entity.age >= criteria.age_min)
     
     if criteria.age_max is not None:
-        query = query.filter(Contact.age <= criteria.age_max)
+        query = query.filter(entity.age <= criteria.age_max)
     
     if criteria.genre:
-        query = query.filter(Contact.genre.in_(criteria.genre))
+        query = query.filter(entity.genre.in_(criteria.genre))
     
     if criteria.statut_opt_in is not None:
-        query = query.filter(Contact.statut_opt_in == criteria.statut_opt_in)
+        query = query.filter(entity.statut_opt_in == criteria.statut_opt_in)
     
-    return query.all()
+    return query
+
+def build_audience_query(db: Session, criteria: SegmentationCriteria, columns: Sequence[str]):
+    """Requête de segmentation limitée aux colonnes demandées (tuples légers, sans objets ORM)"""
+    return build_segmentation_query(db, criteria).with_entities(
+        *(getattr(Contact, column) for column in columns)
+    )
+
+def count_contacts_by_segmentation(db: Session, criteria: SegmentationCriteria) -> int:
+    """Compter les contacts d'un segment (index bitmap, segment en cache, sinon COUNT exécuté par la base)"""
+    indexed = segment_index.count(criteria)
+    if indexed is not None:
+        return indexed
+    cached = segment_cache.peek(criteria)
+    if cached is not None:
+        return len(cached)
+    return build_segmentation_query(db, criteria).with_entities(func.count(Contact.id_contact)).scalar() or 0
+
+def get_segment_contact_ids(db: Session, criteria: SegmentationCriteria) -> np.ndarray:
+    """Identifiants triés des contacts d'un segment, matérialisés une fois puis servis par le cache"""
+    def load():
+        indexed = segment_index.contact_ids(criteria)
+        if indexed is not None:
+            return indexed
+        return db.scalars(build_audience_query(db, criteria, ("id_contact",)).statement)
+    return segment_cache.get(criteria, load)
+
+def estimate_contacts_by_segmentation(db: Session, criteria: SegmentationCriteria) -> Optional[int]:
+    """Taille estimée d'un segment par le planificateur Postgres (EXPLAIN, sans exécuter la requête)
+
+    Retourne None si la base ne fournit pas d'estimation.
+    """
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return None
+    statement = build_segmentation_query(db, criteria).with_entities(Contact.id_contact).statement
+    # Paramètres liés (listes IN développées) : les valeurs des critères ne sont jamais inlinées dans le SQL
+    compiled = statement.compile(dialect=bind.dialect, compile_kwargs={"render_postcompile": True})
+    plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def sample_contacts_by_segmentation(db: Session, criteria: SegmentationCriteria, n: int) -> List[Contact]:
+    """Échantillon aléatoire d'au plus ``n`` contacts d'un segment
+
+    Sur Postgres, un grand segment est échantillonné par TABLESAMPLE SYSTEM (quelques
+    pages lues au lieu de la table entière) ; les autres cas trient le segment au hasard.
+    """
+    estimate = estimate_contacts_by_segmentation(db, criteria)
+    if estimate is not None and estimate > n * SAMPLE_TABLESAMPLE_FACTOR:
+        # Sur-échantillonnage : les pages tirées ne contiennent pas toutes des contacts du segment
+        percent = min(100.0, 100.0 * n * 3 / estimate)
+        sampled = aliased(Contact, tablesample(Contact, func.system(percent)))
+        contacts = build_segmentation_query(db, criteria, sampled).limit(n).all()
+        if len(contacts) >= n:
+            return contacts
+    return build_segmentation_query(db, criteria).order_by(func.random()).limit(n).all()
+
+def get_contacts_by_segmentation(db: Session, criteria: SegmentationCriteria) -> List[Contact]:
+    """Récupérer des contacts selon des critères de segmentation"""
+    return build_segmentation_query(db, criteria).all()
+
+def get_contacts_by_expression_page(db: Session, segment: SegmentQuery, limit: int = 100,
+                                    cursor: Optional[str] = None) -> Tuple[List[Contact], Optional[str]]:
+    """Page des contacts d'un segment avancé (expression ET/OU/NON compilée en une requête)"""
+    return paginate(segment_query.build_query(db, segment), Contact.id_contact, limit, cursor)
+
+def count_contacts_by_expression(db: Session, segment: SegmentQuery) -> int:
+    """Compter les contacts d'un segment avancé (COUNT exécuté par la base)"""
+    return segment_query.build_query(db, segment).with_entities(func.count(Contact.id_contact)).scalar() or 0
 
 # ==================== CAMPAIGN CRUD ====================
 def create_campaign(db: Session, campaign: CampagneCreate, created_by: Optional[int] = None) -> Campagne:
@@ -157,8 +247,12 @@ def create_campaign(db: Session, campaign: CampagneCreate, created_by: Optional[
     return db_campaign
 
 def get_campaigns(db: Session, skip: int = 0, limit: int = 100) -> List[Campagne]:
-    """Récupérer toutes les campagnes"""
-    return db.query(Campagne).offset(skip).limit(limit).all()
+    """Récupérer toutes les campagnes (pagination par décalage, préférer get_campaigns_page)"""
+    return db.query(Campagne).order_by(Campagne.id_campagne).offset(skip).limit(limit).all()
+
+def get_campaigns_page(db: Session, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Campagne], Optional[str]]:
+    """Page de campagnes par curseur ; retourne (campagnes, curseur suivant)"""
+    return paginate(db.query(Campagne), Campagne.id_campagne, limit, cursor)
 
 def get_campaign_by_id(db: Session, campaign_id: int) -> Optional[Campagne]:
     """Récupérer une campagne par ID"""
@@ -179,10 +273,238 @@ def update_campaign(db: Session, campaign_id: int, campaign_update: CampagneUpda
     db.refresh(db_campaign)
     return db_campaign
 
+def set_campaign_schedule(
+    db: Session, campaign_id: int, planifiee: bool,
+    date_debut: Optional[datetime] = None, date_fin: Optional[datetime] = None
+) -> Optional[Campagne]:
+    """Demander (ou annuler) le lancement automatique d'une campagne à sa date_debut"""
+    db_campaign = get_campaign_by_id(db, campaign_id)
+    if not db_campaign:
+        return None
+    if date_debut is not None:
+        db_campaign.date_debut = date_debut
+    if date_fin is not None:
+        db_campaign.date_fin = date_fin
+    db_campaign.planifiee = planifiee
+    db_campaign.date_modification = datetime.utcnow()
+    db.commit()
+    db.refresh(db_campaign)
+    return db_campaign
+
 def get_campaigns_by_status(db: Session, status: str) -> List[Campagne]:
     """Récupérer les campagnes par statut"""
     return db.query(Campagne).filter(Campagne.statut == status).all()
 
+def transition_campaign_status(db: Session, campaign_id: int, from_statuses: List[str], to_status: str) -> bool:
+    """Changer atomiquement le statut d'une campagne si elle est dans l'un des statuts attendus"""
+    values = {Campagne.statut: to_status}
+    if to_status == "en cours":
+        # Battement initial dans la même requête : le planificateur ne la croit pas orpheline
+        values[Campagne.battement_envoi] = datetime.utcnow()
+    updated = 0
+    for from_status in from_statuses:
+        # Un UPDATE par statut de départ : le statut quitté est connu pour les compteurs du tableau de bord
+        updated = db.query(Campagne).filter(
+            Campagne.id_campagne == campaign_id,
+            Campagne.statut == from_status
+        ).update(values, synchronize_session=False)
+        if updated:
+            dashboard_counters.adjust(db.connection(), {
+                dashboard_counters.status_key(from_status): -1,
+                dashboard_counters.status_key(to_status): 1,
+            })
+            break
+    db.commit()
+    return updated == 1
+
+# ==================== MESSAGE CRUD ====================
+def get_campaign_messages(db: Session, campaign_id: int) -> List[Message]:
+    """Tous les messages d'une campagne, dans l'ordre de création"""
+    return db.query(Message).filter(Message.campagne_id == campaign_id).order_by(Message.id_message).all()
+
+def get_campaign_messages_page(db: Session, campaign_id: int, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Message], Optional[str]]:
+    """Page des messages d'une campagne, dans l'ordre de création"""
+    query = db.query(Message).filter(Message.campagne_id == campaign_id)
+    return paginate(query, Message.id_message, limit, cursor)
+
+def get_sms_history_page(db: Session, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Message], Optional[str]]:
+    """Page de l'historique des SMS unitaires (hors campagnes), du plus récent au plus ancien"""
+    query = db.query(Message).filter(Message.campagne_id.is_(None))
+    return paginate(query, Message.id_message, limit, cursor, descending=True)
+
+# ==================== MAILING LIST CRUD ====================
+# Appartenance aux listes : opérations ensemblistes sur mailinglist_contact (INSERT ... SELECT,
+# DELETE ... WHERE), sans charger la relation MailingList.contacts
+MEMBERSHIP_CHUNK_SIZE = 10000
+
+def _insert_ignore(db: Session, table, key_column, selection) -> int:
+    """INSERT ... SELECT en ignorant les lignes déjà présentes ; retourne le nombre de lignes insérées
+
+    ``selection`` produit (clé fixe, id_contact) ; ``key_column`` est la colonne de la clé fixe.
+    """
+    columns = [key_column.name, "contact_id"]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        statement = (postgresql if dialect == "postgresql" else sqlite).insert(table)
+        statement = statement.from_select(columns, selection).on_conflict_do_nothing()
+    else:
+        key = selection.selected_columns[0]
+        already_present = select(table.c.contact_id).where(
+            key_column == key, table.c.contact_id == Contact.id_contact,
+        ).exists()
+        statement = insert(table).from_select(columns, selection.where(~already_present))
+    return db.execute(statement).rowcount or 0
+
+def _insert_memberships(db: Session, list_id: int, contacts_query) -> int:
+    """INSERT ... SELECT des contacts de ``contacts_query`` dans la liste ; retourne le nombre ajouté"""
+    selection = contacts_query.with_entities(literal(list_id), Contact.id_contact).statement
+    return _insert_ignore(db, mailinglist_contact, mailinglist_contact.c.mailinglist_id, selection)
+
+def _chunks(ids: Sequence[int]):
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), MEMBERSHIP_CHUNK_SIZE):
+        yield ids[start:start + MEMBERSHIP_CHUNK_SIZE]
+
+def count_mailing_list_contacts(db: Session, list_id: int) -> int:
+    return db.execute(
+        select(func.count()).select_from(mailinglist_contact).where(mailinglist_contact.c.mailinglist_id == list_id)
+    ).scalar() or 0
+
+def add_contacts_to_mailing_list(db: Session, list_id: int, contact_ids: Sequence[int]) -> int:
+    """Ajouter des contacts (par ID) à une liste ; les IDs inconnus et les membres existants sont ignorés"""
+    added = sum(
+        _insert_memberships(db, list_id, db.query(Contact).filter(Contact.id_contact.in_(chunk)))
+        for chunk in _chunks(contact_ids)
+    )
+    db.commit()
+    return added
+
+def add_segment_to_mailing_list(db: Session, list_id: int, criteria: SegmentationCriteria) -> int:
+    """Ajouter les contacts d'un segment à une liste, en une requête INSERT ... SELECT"""
+    added = _insert_memberships(db, list_id, build_segmentation_query(db, criteria))
+    db.commit()
+    return added
+
+def remove_contacts_from_mailing_list(db: Session, list_id: int, contact_ids: Sequence[int]) -> int:
+    """Retirer des contacts d'une liste ; retourne le nombre de contacts retirés"""
+    removed = sum(
+        db.execute(
+            delete(mailinglist_contact).where(
+                mailinglist_contact.c.mailinglist_id == list_id,
+                mailinglist_contact.c.contact_id.in_(chunk),
+            )
+        ).rowcount or 0
+        for chunk in _chunks(contact_ids)
+    )
+    db.commit()
+    return removed
+
+def replace_mailing_list_contacts(db: Session, list_id: int, contact_ids: Sequence[int]) -> Tuple[int, int]:
+    """Remplacer les membres d'une liste par ``contact_ids`` ; retourne (ajoutés, retirés)"""
+    members = np.fromiter(
+        db.scalars(select(mailinglist_contact.c.contact_id).where(mailinglist_contact.c.mailinglist_id == list_id)),
+        dtype=np.int64,
+    )
+    wanted = np.unique(np.asarray(contact_ids, dtype=np.int64))
+    removed = 0
+    for chunk in _chunks(np.setdiff1d(members, wanted, assume_unique=True).tolist()):
+        removed += db.execute(
+            delete(mailinglist_contact).where(
+                mailinglist_contact.c.mailinglist_id == list_id,
+                mailinglist_contact.c.contact_id.in_(chunk),
+            )
+        ).rowcount or 0
+    added = sum(
+        _insert_memberships(db, list_id, db.query(Contact).filter(Contact.id_contact.in_(chunk)))
+        for chunk in _chunks(np.setdiff1d(wanted, members, assume_unique=True).tolist())
+    )
+    db.commit()
+    return added, removed
+
+def clear_mailing_list(db: Session, list_id: int) -> int:
+    """Vider une liste (DELETE unique, sans charger ses contacts) ; sans commit"""
+    return db.execute(
+        delete(mailinglist_contact).where(mailinglist_contact.c.mailinglist_id == list_id)
+    ).rowcount or 0
+
+def create_mailing_list_from_query(db: Session, nom_liste: str, contacts_query,
+                                   description: Optional[str] = None) -> Tuple[MailingList, int]:
+    """Créer une liste peuplée par INSERT ... SELECT depuis ``contacts_query`` ; retourne (liste, membres)"""
+    mailing_list = MailingList(nom_liste=nom_liste, description=description)
+    db.add(mailing_list)
+    db.flush()
+    added = _insert_memberships(db, mailing_list.id_liste, contacts_query)
+    db.commit()
+    db.refresh(mailing_list)
+    return mailing_list, added
+
+# ==================== AUDIENCE EXPLICITE DE CAMPAGNE ====================
+# Campagne.audience_explicite marque une audience fixée : ses contacts (campagne_contact, éventuellement
+# aucun) remplacent alors le segment à l'envoi (les critères d'envoi, opt-in par défaut, restent appliqués)
+def set_campaign_audience(db: Session, campaign_id: int, contacts_query) -> int:
+    """Remplacer l'audience explicite d'une campagne par ``contacts_query`` ; retourne sa taille"""
+    clear_campaign_audience(db, campaign_id)
+    selection = contacts_query.with_entities(literal(campaign_id), Contact.id_contact).statement
+    total = _insert_ignore(db, campagne_contact, campagne_contact.c.campagne_id, selection)
+    db.query(Campagne).filter(Campagne.id_campagne == campaign_id).update(
+        {Campagne.audience_explicite: True}, synchronize_session=False
+    )
+    db.commit()
+    return total
+
+def clear_campaign_audience(db: Session, campaign_id: int) -> int:
+    """Supprimer l'audience explicite d'une campagne (retour au segment) ; sans commit"""
+    db.query(Campagne).filter(Campagne.id_campagne == campaign_id).update(
+        {Campagne.audience_explicite: False}, synchronize_session=False
+    )
+    return db.execute(
+        delete(campagne_contact).where(campagne_contact.c.campagne_id == campaign_id)
+    ).rowcount or 0
+
+def has_campaign_audience(db: Session, campaign_id: int) -> bool:
+    """Vrai si la campagne a une audience explicite (même vide)"""
+    return bool(db.query(Campagne.audience_explicite).filter(Campagne.id_campagne == campaign_id).scalar())
+
+def build_campaign_audience_query(db: Session, campaign_id: int, criteria: SegmentationCriteria,
+                                  columns: Sequence[str], explicit: bool):
+    """Audience d'envoi d'une campagne (non exécutée) : segment de ``criteria``, restreint à
+    l'audience explicite si ``explicit`` (voir has_campaign_audience)"""
+    query = build_audience_query(db, criteria, columns)
+    if explicit:
+        query = query.filter(
+            select(campagne_contact.c.contact_id).where(
+                campagne_contact.c.campagne_id == campaign_id,
+                campagne_contact.c.contact_id == Contact.id_contact,
+            ).exists()
+        )
+    return query
+
+def count_campaign_audience(db: Session, campaign_id: int, criteria: SegmentationCriteria, explicit: bool) -> int:
+    """Taille de l'audience d'envoi d'une campagne (COUNT, sans charger l'audience)"""
+    if not explicit:
+        return count_contacts_by_segmentation(db, criteria)
+    return build_campaign_audience_query(db, campaign_id, criteria, (), explicit).with_entities(
+        func.count(Contact.id_contact)
+    ).scalar() or 0
+
+# ==================== EXPEDITEUR CRUD ====================
+def get_expediteur_by_id(db: Session, expediteur_id: int) -> Optional[Expediteur]:
+    """Récupérer un expéditeur par ID"""
+    return db.query(Expediteur).filter(Expediteur.id_expediteur == expediteur_id).first()
+
+def get_default_expediteur(db: Session) -> Optional[Expediteur]:
+    """Expéditeur utilisé lorsqu'aucun n'est précisé (le premier configuré)"""
+    return db.query(Expediteur).order_by(Expediteur.id_expediteur).first()
+
+def resolve_expediteur(db: Session, expediteur_id: Optional[int] = None) -> Optional[Expediteur]:
+    """Expéditeur demandé, ou l'expéditeur par défaut ; ValueError si l'ID est inconnu"""
+    if expediteur_id is None:
+        return get_default_expediteur(db)
+    expediteur = get_expediteur_by_id(db, expediteur_id)
+    if not expediteur:
+        raise ValueError(f"Expéditeur {expediteur_id} non trouvé")
+    return expediteur
+
 # ==================== BULK OPERATIONS ====================
 def bulk_create_contacts(db: Session, contacts: List[ContactCreate], source: str = "Import") -> dict:
     """Créer plusieurs contacts en lot"""
@@ -0,0 +1,213 @@
+"""Compteurs du tableau de bord, maintenus de façon incrémentale.
+
+Au lieu de huit ``COUNT(*)`` à chaque rafraîchissement de ``/dashboard`` (dont un
+parcours complet de ``messages``), les totaux sont gardés dans la table
+``compteurs`` (une ligne par clé) et ajustés dans la transaction même de chaque
+écriture :
+
+- écritures ORM (``db.add``, ``db.delete``, modification d'attribut) : événement
+  ``after_flush`` de la session, qui lit les objets créés, supprimés et modifiés ;
+- insertions groupées (``db.execute(insert(Message), lignes)`` du moteur d'envoi) :
+  événement ``do_orm_execute`` ;
+- transitions de statut de campagne par ``UPDATE`` groupé : ajustées explicitement
+  par ``crud.transition_campaign_status``.
+
+Un rollback annule donc aussi l'ajustement. Les contacts récents sont comptés par
+jour d'inscription (``contacts_jour:AAAA-MM-JJ``) : les 30 derniers jours
+(aujourd'hui compris) sont la somme de 30 lignes au plus.
+
+``/dashboard`` lit alors toute la table en une requête. La table est recalculée
+au démarrage si elle est vide (un seul worker s'en charge, sous verrou
+consultatif Postgres ``COUNTERS_LOCK_KEY``), et à la demande (``rebuild``) en cas
+de dérive (écritures SQL faites hors de l'application).
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import event, func, inspect, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import Campagne, Compteur, Contact, Message, MessageTemplate, User
+
+RECENT_DAYS = 30
+COUNTERS_LOCK_KEY = int(os.getenv("COUNTERS_LOCK_KEY", "7243002"))
+
+# Totaux par table
+TOTAL_KEYS = {
+    Contact: "contacts",
+    Campagne: "campagnes",
+    Message: "messages",
+    MessageTemplate: "templates",
+    User: "utilisateurs",
+}
+OPT_IN_KEY = "contacts_opt_in"
+STATUS_PREFIX = "campagnes_statut:"
+DAY_PREFIX = "contacts_jour:"
+
+
+def status_key(statut: Optional[str]) -> str:
+    return f"{STATUS_PREFIX}{statut}"
+
+
+def day_key(moment: Optional[datetime]) -> str:
+    return f"{DAY_PREFIX}{(moment or datetime.utcnow()).date().isoformat()}"
+
+
+# ==================== AJUSTEMENTS ====================
+def adjust(connection, deltas: Dict[str, int]) -> None:
+    """Ajouter les deltas aux compteurs (créés au besoin), dans la transaction de ``connection``"""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    rows = [{"cle": key, "valeur": delta} for key, delta in sorted(deltas.items())]
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        upsert = (postgresql if dialect == "postgresql" else sqlite).insert(Compteur.__table__)
+        connection.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[Compteur.cle], set_={"valeur": Compteur.valeur + upsert.excluded.valeur}
+            ),
+            rows,
+        )
+        return
+    for row in rows:
+        updated = connection.execute(
+            update(Compteur).where(Compteur.cle == row["cle"]).values(valeur=Compteur.valeur + row["valeur"])
+        ).rowcount
+        if not updated:
+            connection.execute(insert(Compteur), row)
+
+
+def _contact_deltas(deltas: Dict[str, int], contact, sign: int) -> None:
+    if contact.statut_opt_in:
+        deltas[OPT_IN_KEY] = deltas.get(OPT_IN_KEY, 0) + sign
+    key = day_key(contact.date_inscription)
+    deltas[key] = deltas.get(key, 0) + sign
+
+
+def _changed(instance, attribute: str):
+    """(ancienne valeur, nouvelle valeur) si l'attribut a été modifié, sinon None"""
+    history = inspect(instance).attrs[attribute].history
+    if not history.has_changes():
+        return None
+    old = history.deleted[0] if history.deleted else None
+    new = history.added[0] if history.added else None
+    return old, new
+
+
+@event.listens_for(Session, "after_flush")
+def _count_flushed_objects(session, flush_context) -> None:
+    deltas: Dict[str, int] = {}
+    for instances, sign in ((session.new, 1), (session.deleted, -1)):
+        for instance in instances:
+            key = TOTAL_KEYS.get(type(instance))
+            if key is None:
+                continue
+            deltas[key] = deltas.get(key, 0) + sign
+            if isinstance(instance, Contact):
+                _contact_deltas(deltas, instance, sign)
+            elif isinstance(instance, Campagne):
+                deltas[status_key(instance.statut)] = deltas.get(status_key(instance.statut), 0) + sign
+
+    for instance in session.dirty:
+        if isinstance(instance, Contact):
+            change = _changed(instance, "statut_opt_in")
+            if change is not None and bool(change[0]) != bool(change[1]):
+                deltas[OPT_IN_KEY] = deltas.get(OPT_IN_KEY, 0) + (1 if change[1] else -1)
+        elif isinstance(instance, Campagne):
+            change = _changed(instance, "statut")
+            if change is not None and change[0] != change[1]:
+                deltas[status_key(change[0])] = deltas.get(status_key(change[0]), 0) - 1
+                deltas[status_key(change[1])] = deltas.get(status_key(change[1]), 0) + 1
+
+    if deltas:
+        adjust(session.connection(), deltas)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _count_bulk_inserts(orm_execute_state) -> None:
+    if not orm_execute_state.is_insert:
+        return
+    mapper = orm_execute_state.bind_mapper
+    model = mapper.class_ if mapper is not None else None
+    if model not in (Message, Contact):
+        return
+    parameters = orm_execute_state.parameters
+    rows = parameters if isinstance(parameters, list) else [parameters or {}]
+    deltas = {TOTAL_KEYS[model]: len(rows)}
+    if model is Contact:
+        for row in rows:
+            if row.get("statut_opt_in", True):
+                deltas[OPT_IN_KEY] = deltas.get(OPT_IN_KEY, 0) + 1
+            key = day_key(row.get("date_inscription"))
+            deltas[key] = deltas.get(key, 0) + 1
+    adjust(orm_execute_state.session.connection(), deltas)
+
+
+# ==================== LECTURE ET RECALCUL ====================
+def read(db: Session) -> dict:
+    """Compteurs du tableau de bord en une requête sur la table ``compteurs``"""
+    cutoff = day_key(datetime.utcnow() - timedelta(days=RECENT_DAYS))
+    rows = db.execute(
+        select(Compteur.cle, Compteur.valeur).where(
+            ~Compteur.cle.startswith(DAY_PREFIX, autoescape=True) | (Compteur.cle > cutoff)
+        )
+    ).all()
+    values = dict(rows)
+    total_contacts = values.get(TOTAL_KEYS[Contact], 0)
+    opt_in_contacts = values.get(OPT_IN_KEY, 0)
+    return {
+        "total_contacts": total_contacts,
+        "total_campaigns": values.get(TOTAL_KEYS[Campagne], 0),
+        "total_messages": values.get(TOTAL_KEYS[Message], 0),
+        "total_templates": values.get(TOTAL_KEYS[MessageTemplate], 0),
+        "total_users": values.get(TOTAL_KEYS[User], 0),
+        "campaigns_by_status": {
+            key[len(STATUS_PREFIX):]: value
+            for key, value in values.items() if key.startswith(STATUS_PREFIX) and value
+        },
+        "recent_contacts_30_days": sum(value for key, value in values.items() if key.startswith(DAY_PREFIX)),
+        "opt_in_contacts": opt_in_contacts,
+        "opt_out_contacts": total_contacts - opt_in_contacts,
+    }
+
+
+def rebuild(db: Session) -> None:
+    """Recalculer tous les compteurs depuis les tables (COUNT complets, à réserver aux réparations)"""
+    values: Dict[str, int] = {
+        key: db.query(func.count()).select_from(model).scalar() or 0
+        for model, key in TOTAL_KEYS.items()
+    }
+    values[OPT_IN_KEY] = db.query(func.count(Contact.id_contact)).filter(Contact.statut_opt_in == True).scalar() or 0
+    for statut, count in db.query(Campagne.statut, func.count(Campagne.id_campagne)).group_by(Campagne.statut):
+        values[status_key(statut)] = count
+    cutoff = datetime.utcnow() - timedelta(days=RECENT_DAYS + 1)
+    day = func.date(Contact.date_inscription)
+    for inscription_day, count in (
+        db.query(day, func.count(Contact.id_contact))
+        .filter(Contact.date_inscription >= cutoff)
+        .group_by(day)
+    ):
+        if inscription_day is not None:
+            values[f"{DAY_PREFIX}{str(inscription_day)[:10]}"] = count
+
+    db.query(Compteur).delete(synchronize_session=False)
+    db.execute(insert(Compteur), [{"cle": key, "valeur": value} for key, value in values.items()])
+    db.commit()
+    print(f"📊 Compteurs du tableau de bord recalculés ({len(values)} clés)")
+
+
+def ensure_counters(engine) -> None:
+    """Initialiser les compteurs au premier démarrage (table vide), une seule fois pour tous les workers"""
+    with Session(engine) as db:
+        if db.query(Compteur.cle).first() is not None:
+            return
+        if engine.dialect.name == "postgresql":
+            # Verrou de transaction : les autres workers attendent, puis trouvent la table remplie
+            db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": COUNTERS_LOCK_KEY})
+            if db.query(Compteur.cle).first() is not None:
+                db.rollback()
+                return
+        rebuild(db)  # le commit libère le verrou
@@ -0,0 +1,354 @@
+"""Moteur d'envoi asynchrone des campagnes SMS.
+
+Une campagne lancée est découpée en lots de contacts : chaque lot est transformé
+en lignes ``Message`` (insertion groupée) puis poussé dans une file asyncio bornée
+consommée par un pool de workers. Les statuts d'envoi sont réécrits par lots, et
+la campagne passe automatiquement de « créée » à « en cours » puis « terminée ».
+
+Les messages sont insérés directement à l'état « en cours d'envoi » avec un bail
+de l'outbox (voir outbox.py) : un échec d'envoi programme un réessai avec backoff
+au lieu de perdre le SMS, et un crash du processus rend les messages en vol de
+nouveau dus à l'expiration du bail.
+
+Point de reprise : l'audience est parcourue par ``id_contact`` croissant, et le
+dernier contact mis en file (``Campagne.dernier_contact_envoye``) est enregistré
+dans la même transaction que les messages du lot. Une campagne suspendue reprend
+donc exactement après ce curseur, avec les critères figés au lancement
+(``Campagne.criteres_envoi``), sans recalculer l'audience ni dédoublonner contre
+``messages``.
+
+Chaque lot est une page par clé de la requête d'audience (``id_contact > curseur
+ORDER BY id_contact LIMIT n``) : l'audience n'est jamais chargée en mémoire, et
+un contact désinscrit entre-temps est écarté. Une audience explicite
+(``campagne_contact``, fixée par combinaison de listes et de segments) restreint
+le segment ; les critères d'envoi lui restent appliqués.
+
+Les messages héritent de la file de priorité du type de campagne (priority.py) :
+les jetons du débit de l'expéditeur sont arbitrés par tourniquet pondéré entre
+cette campagne, les autres et les envois unitaires transactionnels.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, update
+
+import crud
+import database
+import outbox
+import priority
+import progress_stream
+import providers
+import rate_limit
+from models import Campagne, Contact, Expediteur, Message
+from schemas import SegmentationCriteria
+
+DEFAULT_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", "50"))
+DEFAULT_BATCH_SIZE = int(os.getenv("DISPATCH_BATCH_SIZE", "1000"))
+MAX_CONCURRENCY = 1000
+# Intervalle du battement écrit dans Campagne.battement_envoi (voir scheduler.py)
+HEARTBEAT_SECONDS = float(os.getenv("DISPATCH_HEARTBEAT_SECONDS", "30"))
+
+# (id_message, numero, contenu)
+QueueItem = Tuple[int, str, str]
+
+
+class CampaignDispatcher:
+    """Diffuse une campagne vers son audience via un pool de workers borné"""
+
+    def __init__(
+        self,
+        campaign_id: int,
+        criteria: Optional[SegmentationCriteria] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        expediteur: Optional[Expediteur] = None,
+        adapter: Optional[providers.ProviderAdapter] = None,
+    ):
+        self.campaign_id = campaign_id
+        self.criteria = criteria
+        self.concurrency = max(1, min(concurrency, MAX_CONCURRENCY))
+        self.batch_size = max(1, batch_size)
+        self.adapter = adapter or providers.get_adapter(expediteur)
+        self.sender_id = expediteur.numero_telephone if expediteur else "SYSTEM"
+        limiter = rate_limit.get_limiter_for_expediteur(expediteur)
+        self.gate = priority.get_gate(limiter) if limiter else None
+        self.lane = priority.LANE_BULK
+        self.explicit_audience = False
+
+        self.queue: "asyncio.Queue[Optional[QueueItem]]" = asyncio.Queue(maxsize=self.concurrency * 4)
+        self.state = "en attente"
+        self.queued = 0
+        self.sent = 0
+        self.retrying = 0
+        self.error: Optional[str] = None
+        self.interrupted_status: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+        self._results: List[outbox.OutboxResult] = []
+        self._results_lock = asyncio.Lock()
+
+    # ---------- Progression ----------
+    def progress(self) -> dict:
+        """Instantané de la progression (débit et profondeur de file)"""
+        elapsed = 0.0
+        if self.started_at:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        processed = self.sent + self.retrying
+        return {
+            "campagne_id": self.campaign_id,
+            "etat": self.state,
+            "concurrence": self.concurrency,
+            "file_priorite": priority.LANE_NAMES[self.lane],
+            "messages_en_file": self.queued,
+            "messages_envoyes": self.sent,
+            "messages_en_reessai": self.retrying,
+            "profondeur_file": self.queue.qsize(),
+            "envois_par_seconde": round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+            "duree_secondes": round(elapsed, 2),
+            "erreur": self.error,
+        }
+
+    def _publish_state(self) -> None:
+        """Publier l'état et la file locale aux abonnés du flux de progression"""
+        progress_stream.hub.update(
+            self.campaign_id,
+            etat=self.state,
+            profondeur_file=self.queue.qsize(),
+            messages_en_reessai=self.retrying,
+        )
+
+    def stop(self, statut: str = "suspendue") -> None:
+        """Arrêter la production : les messages déjà en file sont envoyés, puis l'envoi s'arrête"""
+        if self.interrupted_status is None:
+            self.interrupted_status = statut
+
+    # ---------- Exécution ----------
+    async def run(self) -> None:
+        self.state = "en cours"
+        self.started_at = time.monotonic()
+        self._publish_state()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            await self._produce()
+            for _ in workers:
+                await self.queue.put(None)
+            await asyncio.gather(*workers)
+            await self._flush_results(force=True)
+            if self.interrupted_status:
+                # Statut changé de l'extérieur (suspension, fin de fenêtre) : on le conserve
+                self.state = self.interrupted_status
+            else:
+                await asyncio.to_thread(self._finish, "terminée")
+                self.state = "terminée"
+        except Exception as e:
+            for w in workers:
+                w.cancel()
+            self.error = str(e)
+            self.state = "erreur"
+            await self._flush_results(force=True)
+            await asyncio.to_thread(self._finish, "suspendue")
+            print(f"❌ Campagne {self.campaign_id}: échec du dispatch - {e}")
+        finally:
+            heartbeat.cancel()
+            self.finished_at = time.monotonic()
+            self._publish_state()
+
+    async def _heartbeat(self) -> None:
+        """Signaler périodiquement que cet envoi est vivant"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(self._touch)
+            except Exception as e:
+                print(f"⚠️ Campagne {self.campaign_id}: battement non enregistré - {e}")
+
+    async def _produce(self) -> None:
+        """Parcourt l'audience par lots (pagination par clé) et alimente la file"""
+        # Un lot inséré attend dans la file : on le borne pour rester bien sous le bail
+        page_size = min(self.batch_size, self.queue.maxsize)
+        last_id = await asyncio.to_thread(self._load_checkpoint)
+        while not self.interrupted_status:
+            batch, last_id = await asyncio.to_thread(self._create_message_batch, last_id, page_size)
+            if not batch:
+                break
+            for item in batch:
+                await self.queue.put(item)
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                break
+            message_id, recipient, content = item
+            if self.gate:
+                await self.gate.acquire(self.lane)
+            try:
+                result = await self.adapter.send(recipient, content)
+            except Exception as e:
+                result = providers.ProviderResult(False, error=str(e) or e.__class__.__name__)
+            if result.ok:
+                self.sent += 1
+            else:
+                self.retrying += 1
+            self._results.append((message_id, self.campaign_id, result))
+            if len(self._results) >= self.batch_size:
+                await self._flush_results()
+
+    async def _flush_results(self, force: bool = False) -> None:
+        async with self._results_lock:
+            if not self._results or (not force and len(self._results) < self.batch_size):
+                return
+            batch, self._results = self._results, []
+        await asyncio.to_thread(self._write_results, batch)
+        self._publish_state()
+
+    # ---------- Accès base de données (exécutés hors de la boucle asyncio) ----------
+    def _load_checkpoint(self) -> int:
+        """Curseur de reprise, file de priorité, critères d'audience (figés au premier lancement), audience explicite"""
+        db = database.SessionLocal()
+        try:
+            campaign = crud.get_campaign_by_id(db, self.campaign_id)
+            self.lane = priority.lane_for_campaign_type(campaign.type_campagne)
+            if self.criteria is None and campaign.criteres_envoi:
+                self.criteria = SegmentationCriteria.model_validate_json(campaign.criteres_envoi)
+            if self.criteria is None:
+                self.criteria = SegmentationCriteria(statut_opt_in=True)
+            campaign.criteres_envoi = self.criteria.model_dump_json()
+            cursor = campaign.dernier_contact_envoye or 0
+            db.commit()
+            self.explicit_audience = crud.has_campaign_audience(db, self.campaign_id)
+            return cursor
+        finally:
+            db.close()
+
+    def _create_message_batch(self, after_id: int, limit: int) -> Tuple[List[QueueItem], int]:
+        db = database.SessionLocal()
+        try:
+            campaign = crud.get_campaign_by_id(db, self.campaign_id)
+            if campaign is None or campaign.statut != "en cours":
+                # Suspendue ou arrêtée par une autre requête / un autre réplica
+                self.stop(campaign.statut if campaign else "supprimée")
+                return [], after_id
+            # Projection : seules les colonnes lues par le modèle sont chargées, en tuples
+            columns = ("id_contact", "numero_telephone") + campaign.colonnes_personnalisation()
+            contacts = (
+                crud.build_campaign_audience_query(
+                    db, self.campaign_id, self.criteria, columns, self.explicit_audience
+                )
+                .filter(Contact.id_contact > after_id)
+                .order_by(Contact.id_contact)
+                .limit(limit)
+                .all()
+            )
+            if not contacts:
+                return [], after_id
+
+            now = datetime.utcnow()
+            lease = outbox.lease_deadline(now)
+            bodies = campaign.personnaliser_messages(contacts, columns)
+            rows = [
+                {
+                    "contenu": body,
+                    "identifiant_expediteur": self.sender_id,
+                    "statut_livraison": outbox.STATUS_CLAIMED,
+                    "tentatives": 1,
+                    "prochaine_tentative": lease,
+                    "date_creation": now,
+                    "campagne_id": self.campaign_id,
+                    "priorite": self.lane,
+                    "contact_id": contact_id,
+                    "numero_destinataire": numero,
+                }
+                for (contact_id, numero, *_), body in zip(contacts, bodies)
+            ]
+            ids = db.scalars(insert(Message).returning(Message.id_message), rows).all()
+            # Le curseur avance dans la même transaction que les messages : pas de double envoi
+            db.execute(
+                update(Campagne)
+                .where(Campagne.id_campagne == self.campaign_id)
+                .values(
+                    nombre_destinataires=Campagne.nombre_destinataires + len(rows),
+                    dernier_contact_envoye=contacts[-1][0],
+                )
+            )
+            db.commit()
+            progress_stream.hub.increment(self.campaign_id, messages_en_file=len(rows))
+
+            self.queued += len(rows)
+            items = [(mid, row["numero_destinataire"], row["contenu"]) for mid, row in zip(ids, rows)]
+            return items, contacts[-1][0]
+        finally:
+            db.close()
+
+    def _write_results(self, batch: List[outbox.OutboxResult]) -> None:
+        db = database.SessionLocal()
+        try:
+            outbox.record_results(db, batch)
+        finally:
+            db.close()
+
+    def _touch(self) -> None:
+        db = database.SessionLocal()
+        try:
+            db.execute(
+                update(Campagne)
+                .where(Campagne.id_campagne == self.campaign_id, Campagne.statut == "en cours")
+                .values(battement_envoi=datetime.utcnow())
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _finish(self, statut: str) -> None:
+        db = database.SessionLocal()
+        try:
+            crud.transition_campaign_status(db, self.campaign_id, ["en cours"], statut)
+        finally:
+            db.close()
+
+
+# ==================== REGISTRE DES ENVOIS EN COURS ====================
+_dispatchers: Dict[int, CampaignDispatcher] = {}
+_tasks: Dict[int, "asyncio.Task"] = {}
+
+
+def is_running(campaign_id: int) -> bool:
+    task = _tasks.get(campaign_id)
+    return task is not None and not task.done()
+
+
+def start_dispatch(
+    campaign_id: int,
+    criteria: Optional[SegmentationCriteria] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    expediteur: Optional[Expediteur] = None,
+    adapter: Optional[providers.ProviderAdapter] = None,
+) -> CampaignDispatcher:
+    """Démarre la diffusion d'une campagne dans la boucle asyncio courante"""
+    if is_running(campaign_id):
+        raise ValueError(f"La campagne {campaign_id} est déjà en cours d'envoi")
+
+    dispatcher = CampaignDispatcher(
+        campaign_id, criteria, concurrency=concurrency, expediteur=expediteur, adapter=adapter
+    )
+    _dispatchers[campaign_id] = dispatcher
+    _tasks[campaign_id] = asyncio.get_running_loop().create_task(dispatcher.run())
+    return dispatcher
+
+
+def stop_dispatch(campaign_id: int, statut: str = "suspendue") -> bool:
+    """Demander l'arrêt d'un envoi en cours dans ce processus"""
+    if not is_running(campaign_id):
+        return False
+    _dispatchers[campaign_id].stop(statut)
+    return True
+
+
+def get_progress(campaign_id: int) -> Optional[dict]:
+    dispatcher = _dispatchers.get(campaign_id)
+    return dispatcher.progress() if dispatcher else None
@@ -0,0 +1,176 @@
+"""Ingestion des accusés de réception (DLR) des fournisseurs SMS.
+
+Les accusés reçus par le webhook sont d'abord mis en mémoire tampon, puis
+appliqués à la table ``messages`` par UPDATE ensemblistes (un par statut final)
+toutes les ``DLR_FLUSH_INTERVAL_MS`` millisecondes ou dès que
+``DLR_FLUSH_MAX_RECEIPTS`` accusés sont en attente, au lieu d'une transaction
+par callback.
+
+Seul le premier statut final d'un message est retenu : les doublons et les
+accusés intermédiaires (« accepted », « ENROUTE »...) n'écrasent rien. Un accusé
+arrivé avant que la référence du fournisseur ne soit enregistrée est conservé
+pendant quelques vidages avant d'être abandonné.
+"""
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+
+import database
+import progress_stream
+from models import Campagne, Message
+from schemas import DeliveryReceipt
+
+FLUSH_INTERVAL_MS = int(os.getenv("DLR_FLUSH_INTERVAL_MS", "500"))
+FLUSH_MAX_RECEIPTS = int(os.getenv("DLR_FLUSH_MAX_RECEIPTS", "5000"))
+UNMATCHED_MAX_FLUSHES = 5
+
+STATUS_DELIVERED = "livré"
+STATUS_UNDELIVERED = "non livré"
+FINAL_STATUSES = [STATUS_DELIVERED, STATUS_UNDELIVERED]
+
+_PROVIDER_STATUSES = {
+    "delivered": STATUS_DELIVERED,
+    "delivrd": STATUS_DELIVERED,
+    "livré": STATUS_DELIVERED,
+    "livre": STATUS_DELIVERED,
+    "failed": STATUS_UNDELIVERED,
+    "undelivered": STATUS_UNDELIVERED,
+    "undeliv": STATUS_UNDELIVERED,
+    "expired": STATUS_UNDELIVERED,
+    "rejected": STATUS_UNDELIVERED,
+    "rejectd": STATUS_UNDELIVERED,
+    "non livré": STATUS_UNDELIVERED,
+}
+
+
+def normalize_status(provider_status: str) -> Optional[str]:
+    """Statut final interne, ou None pour un statut intermédiaire à ignorer"""
+    return _PROVIDER_STATUSES.get(provider_status.strip().lower())
+
+
+class DlrBuffer:
+    """Tampon des accusés de réception, vidé par lots en arrière-plan"""
+
+    def __init__(self, flush_interval_ms: int = FLUSH_INTERVAL_MS, max_receipts: int = FLUSH_MAX_RECEIPTS):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_receipts = max(1, max_receipts)
+        # référence -> (statut interne, nombre de vidages sans correspondance)
+        self._pending: Dict[str, Tuple[str, int]] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.stats = Counter()
+
+    def add(self, receipts: List[DeliveryReceipt]) -> int:
+        """Mettre des accusés en tampon ; retourne le nombre d'accusés retenus
+
+        À appeler depuis la boucle asyncio (le tampon et l'événement de réveil n'y sont pas protégés).
+        """
+        accepted = 0
+        for receipt in receipts:
+            statut = normalize_status(receipt.statut)
+            if statut is None:
+                self.stats["ignores"] += 1
+                continue
+            self._pending[receipt.reference] = (statut, 0)
+            accepted += 1
+        self.stats["recus"] += accepted
+        if len(self._pending) >= self.max_receipts:
+            self._wakeup.set()
+        return accepted
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ DLR: échec du vidage du tampon - {e}")
+
+    async def flush(self) -> int:
+        """Appliquer les accusés en attente ; retourne le nombre de messages mis à jour"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            try:
+                matched = await asyncio.to_thread(apply_receipts, batch)
+            except Exception:
+                # Remettre le lot en tampon sans écraser les accusés plus récents
+                for reference, receipt in batch.items():
+                    self._pending.setdefault(reference, receipt)
+                raise
+
+            for reference, (statut, misses) in batch.items():
+                if reference in matched:
+                    continue
+                if misses + 1 < UNMATCHED_MAX_FLUSHES:
+                    self._pending.setdefault(reference, (statut, misses + 1))
+                else:
+                    self.stats["sans_correspondance"] += 1
+            self.stats["appliques"] += len(matched)
+            return len(matched)
+
+
+def apply_receipts(batch: Dict[str, Tuple[str, int]]) -> set:
+    """UPDATE ensembliste par statut final ; retourne les références mises à jour"""
+    by_status: Dict[str, List[str]] = {}
+    for reference, (statut, _) in batch.items():
+        by_status.setdefault(statut, []).append(reference)
+
+    matched = set()
+    delivered_by_campaign: Counter = Counter()
+    db = database.SessionLocal()
+    try:
+        now = datetime.utcnow()
+        for statut, references in by_status.items():
+            rows = db.execute(
+                update(Message)
+                .where(
+                    Message.reference_fournisseur.in_(references),
+                    Message.statut_livraison.notin_(FINAL_STATUSES),
+                )
+                .values(statut_livraison=statut, date_livraison=now)
+                .returning(Message.reference_fournisseur, Message.campagne_id)
+            ).all()
+            for reference, campaign_id in rows:
+                matched.add(reference)
+                if statut == STATUS_DELIVERED and campaign_id is not None:
+                    delivered_by_campaign[campaign_id] += 1
+
+        for campaign_id, count in delivered_by_campaign.items():
+            db.execute(
+                update(Campagne)
+                .where(Campagne.id_campagne == campaign_id)
+                .values(nombre_livres=Campagne.nombre_livres + count)
+            )
+        db.commit()
+        for campaign_id, count in delivered_by_campaign.items():
+            progress_stream.hub.increment(campaign_id, messages_livres=count)
+        return matched
+    finally:
+        db.close()
@@ -0,0 +1,124 @@
+"""Export des contacts en flux (CSV, NDJSON, XLSX).
+
+Les contacts sont lus par un curseur côté serveur (``yield_per`` : sur Postgres,
+``stream_results`` est activé et les lignes arrivent par paquets de
+``EXPORT_BATCH_SIZE``), en tuples limités aux colonnes exportées. Chaque paquet est
+sérialisé puis envoyé au client : la mémoire reste constante quel que soit le
+nombre de lignes.
+
+Le format XLSX ne peut pas être produit au fil de l'eau (archive zip) : le
+classeur est écrit en mode ``write_only`` d'openpyxl dans un fichier temporaire,
+puis ce fichier est envoyé par morceaux.
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Iterator, Optional
+
+from openpyxl import Workbook
+
+import crud
+import database
+from models import Contact, mailinglist_contact
+from schemas import SegmentationCriteria
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+XLSX_MAX_ROWS_PER_SHEET = 1_048_575  # limite Excel, ligne d'en-tête comprise
+CHUNK_SIZE = 1024 * 1024
+
+EXPORT_COLUMNS = (
+    "id_contact", "nom", "prenom", "numero_telephone", "email", "ville", "region",
+    "code_postal", "type_client", "age", "genre", "statut_opt_in", "date_inscription", "source",
+)
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+
+def _iter_rows(criteria: Optional[SegmentationCriteria], list_id: Optional[int]) -> Iterator[tuple]:
+    """Contacts à exporter, lus par paquets sur un curseur côté serveur"""
+    db = database.SessionLocal()
+    try:
+        query = crud.build_audience_query(db, criteria or SegmentationCriteria(statut_opt_in=None), EXPORT_COLUMNS)
+        if list_id is not None:
+            query = query.join(
+                mailinglist_contact, mailinglist_contact.c.contact_id == Contact.id_contact
+            ).filter(mailinglist_contact.c.mailinglist_id == list_id)
+        query = query.order_by(Contact.id_contact).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        for row in query:
+            yield tuple(row)
+    finally:
+        db.close()
+
+
+def _cell(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def iter_csv(criteria: Optional[SegmentationCriteria] = None, list_id: Optional[int] = None) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    pending = 0
+    for row in _iter_rows(criteria, list_id):
+        writer.writerow([_cell(value) for value in row])
+        pending += 1
+        if pending >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode("utf-8")
+
+
+def iter_ndjson(criteria: Optional[SegmentationCriteria] = None, list_id: Optional[int] = None) -> Iterator[bytes]:
+    lines = []
+    for row in _iter_rows(criteria, list_id):
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, map(_cell, row))), ensure_ascii=False))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def iter_xlsx(criteria: Optional[SegmentationCriteria] = None, list_id: Optional[int] = None) -> Iterator[bytes]:
+    workbook = Workbook(write_only=True)
+    sheet, sheet_rows, sheet_count = None, XLSX_MAX_ROWS_PER_SHEET, 0
+    for row in _iter_rows(criteria, list_id):
+        if sheet_rows >= XLSX_MAX_ROWS_PER_SHEET:
+            # Au-delà d'un million de lignes, les contacts continuent sur une nouvelle feuille
+            sheet_count += 1
+            sheet = workbook.create_sheet("Contacts" if sheet_count == 1 else f"Contacts {sheet_count}")
+            sheet.append(EXPORT_COLUMNS)
+            sheet_rows = 0
+        sheet.append(row)
+        sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet("Contacts").append(EXPORT_COLUMNS)
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+_WRITERS = {"csv": iter_csv, "ndjson": iter_ndjson, "xlsx": iter_xlsx}
+
+
+def export_contacts(export_format: str, criteria: Optional[SegmentationCriteria] = None,
+                    list_id: Optional[int] = None) -> Iterator[bytes]:
+    """Flux d'octets de l'export ; ValueError si le format est inconnu"""
+    if export_format not in _WRITERS:
+        raise ValueError(f"Format d'export inconnu: '{export_format}'. Disponibles: {sorted(_WRITERS)}")
+    return _WRITERS[export_format](criteria, list_id)
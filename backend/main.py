@@ -1,19 +1,40 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, Query, Response, status, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_jwt_auth.exceptions import AuthJWTException
 from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime
+import asyncio
+import functools
 import io
+import json
+from anyio import from_thread
 
 import database, models, crud
+import audience_algebra
+import contact_search
+import contact_stats
+import dashboard_counters
 import file_import
+import file_export
+import dispatch
+import dlr
+import outbox
+import pagination
+import priority
+import progress_stream
+import providers
+import rate_limit
+import scheduler
+import segment_cache
+import segment_index
 from auth import router as auth_router, role_required, get_current_user
 from schemas import (
     UserRead, ContactCreate, ContactRead, ContactUpdate, 
-    CampagneCreate, CampagneRead, CampagneUpdate,
-    FileImportResult, SegmentationCriteria
+    CampagneCreate, CampagneRead, CampagneUpdate, CampagnePlanification,
+    FileImportResult, SegmentationCriteria, SegmentQuery, DeliveryReceipt,
+    AudienceCombination, AudienceListCreate
 )
 from database import get_db
 
@@ -32,6 +53,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER],
 )
 
 @app.exception_handler(AuthJWTException)
@@ -43,6 +65,36 @@ def authjwt_exception_handler(request, exc):
 
 app.include_router(auth_router)
 
+# Worker de l'outbox : réessais avec backoff et reprise des envois interrompus
+outbox_worker = outbox.OutboxWorker()
+
+# Tampon des accusés de réception, vidé par UPDATE groupés
+dlr_buffer = dlr.DlrBuffer()
+
+# Planificateur : démarre/suspend les campagnes selon date_debut / date_fin
+campaign_scheduler = scheduler.CampaignScheduler()
+
+@app.on_event("startup")
+async def start_background_workers():
+    if segment_index.SEGMENT_INDEX_ENABLED:
+        segment_index.require_bitmaps()  # échec du démarrage plutôt qu'un index de plusieurs Go
+    # Premier démarrage : compteurs du tableau de bord calculés avant de servir /dashboard
+    await asyncio.to_thread(dashboard_counters.ensure_counters, database.engine)
+    outbox_worker.start()
+    dlr_buffer.start()
+    if scheduler.SCHEDULER_ENABLED:
+        campaign_scheduler.start()
+    if segment_index.SEGMENT_INDEX_ENABLED:
+        # Construction en arrière-plan : COUNT SQL en attendant que l'index soit prêt
+        asyncio.get_running_loop().run_in_executor(None, segment_index.build_from_database)
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await campaign_scheduler.stop()
+    await outbox_worker.stop()
+    await dlr_buffer.stop()
+    await providers.close_all()
+
 @app.get("/", tags=["Health"])
 def root():
     return {
@@ -72,9 +124,54 @@ def create_contact(contact: ContactCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/contacts/", response_model=List[ContactRead], tags=["Contacts"])
-def get_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Récupérer tous les contacts avec pagination"""
-    return crud.get_contacts(db, skip=skip, limit=limit)
+def get_contacts(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Récupérer les contacts page par page (limit ≤ 1000, sinon 422 ; curseur de la page suivante
+    dans l'en-tête X-Next-Cursor)"""
+    if skip and not cursor:
+        # Pagination par décalage conservée pour les anciens clients
+        return crud.get_contacts(db, skip=skip, limit=limit)
+    try:
+        contacts, next_cursor = crud.get_contacts_page(db, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return contacts
+
+# ==================== EXPORT ENDPOINTS ====================
+def _export_response(export_format: str, criteria: Optional[SegmentationCriteria], list_id: Optional[int], db: Session):
+    if export_format not in file_export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format invalide. Valeurs acceptées: {sorted(file_export.EXPORT_FORMATS)}")
+    if list_id is not None and not db.query(models.MailingList.id_liste).filter(models.MailingList.id_liste == list_id).first():
+        raise HTTPException(status_code=404, detail="Liste de diffusion non trouvée")
+    media_type, extension = file_export.EXPORT_FORMATS[export_format]
+    filename = f"contacts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return StreamingResponse(
+        file_export.export_contacts(export_format, criteria, list_id),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@app.get("/contacts/export", tags=["Contacts", "Export"])
+def export_contacts(format: str = "csv", list_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """Exporter tous les contacts, ou ceux d'une liste de diffusion (CSV, NDJSON ou XLSX, en flux)"""
+    return _export_response(format, None, list_id, db)
+
+@app.post("/contacts/export", tags=["Contacts", "Export"])
+def export_contact_segment(
+    criteria: Optional[SegmentationCriteria] = None,
+    format: str = "csv",
+    list_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Exporter un segment de contacts (critères de segmentation, liste de diffusion optionnelle)"""
+    return _export_response(format, criteria, list_id, db)
 
 @app.get("/contacts/{contact_id}", response_model=ContactRead, tags=["Contacts"])
 def get_contact(contact_id: int, db: Session = Depends(get_db)):
@@ -101,9 +198,9 @@ def delete_contact(contact_id: int, db: Session = Depends(get_db)):
     return {"message": "Contact supprimé avec succès"}
 
 @app.get("/contacts/search/{query}", response_model=List[ContactRead], tags=["Contacts"])
-def search_contacts(query: str, db: Session = Depends(get_db)):
-    """Rechercher des contacts par nom, prénom, téléphone ou email"""
-    return crud.search_contacts(db, query)
+def search_contacts(query: str, limit: int = contact_search.DEFAULT_LIMIT, db: Session = Depends(get_db)):
+    """Rechercher des contacts par nom, prénom, téléphone ou email (résultats classés et limités)"""
+    return crud.search_contacts(db, query, limit)
 
 # ==================== CONTACT SEGMENTATION ====================
 @app.post("/contacts/segment", response_model=List[ContactRead], tags=["Contacts", "Segmentation"])
@@ -111,30 +208,52 @@ def segment_contacts(criteria: SegmentationCriteria, db: Session = Depends(get_d
     """Récupérer des contacts selon des critères de segmentation"""
     return crud.get_contacts_by_segmentation(db, criteria)
 
+@app.post("/contacts/segment/count", tags=["Contacts", "Segmentation"])
+def count_segment(criteria: SegmentationCriteria, estimate: bool = False, db: Session = Depends(get_db)):
+    """Taille d'un segment : COUNT exact, ou estimation du planificateur (Postgres) si estimate=true"""
+    if estimate:
+        estimated = crud.estimate_contacts_by_segmentation(db, criteria)
+        if estimated is not None:
+            return {"total": estimated, "estimation": True}
+    return {"total": crud.count_contacts_by_segmentation(db, criteria), "estimation": False}
+
+@app.post("/contacts/segment/sample", response_model=List[ContactRead], tags=["Contacts", "Segmentation"])
+def sample_segment(criteria: SegmentationCriteria, n: int = 20, db: Session = Depends(get_db)):
+    """Échantillon aléatoire de n contacts d'un segment (au plus 500)"""
+    if n < 1 or n > 500:
+        raise HTTPException(status_code=400, detail="n doit être compris entre 1 et 500")
+    return crud.sample_contacts_by_segmentation(db, criteria, n)
+
+@app.post("/contacts/segment/query", response_model=List[ContactRead], tags=["Contacts", "Segmentation"])
+def query_segment(
+    segment: SegmentQuery,
+    response: Response,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Segment avancé (expression ET/OU/NON, listes, historique de campagnes, périodes), page par page
+    (limit ≤ 1000, sinon 422 ; curseur de la page suivante dans l'en-tête X-Next-Cursor)"""
+    try:
+        contacts, next_cursor = crud.get_contacts_by_expression_page(db, segment, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return contacts
+
+@app.post("/contacts/segment/query/count", tags=["Contacts", "Segmentation"])
+def count_query_segment(segment: SegmentQuery, db: Session = Depends(get_db)):
+    """Taille d'un segment avancé"""
+    try:
+        return {"total": crud.count_contacts_by_expression(db, segment)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/contacts/stats/segmentation", tags=["Contacts", "Analytics"])
 def get_segmentation_stats(db: Session = Depends(get_db)):
-    """Statistiques de segmentation des contacts"""
-    total_contacts = db.query(models.Contact).count()
-    
-    # Statistiques par type de client
-    type_stats = db.query(models.Contact.type_client, db.func.count(models.Contact.id_contact)).group_by(models.Contact.type_client).all()
-    
-    # Statistiques par ville
-    city_stats = db.query(models.Contact.ville, db.func.count(models.Contact.id_contact)).group_by(models.Contact.ville).limit(10).all()
-    
-    # Statistiques par genre
-    gender_stats = db.query(models.Contact.genre, db.func.count(models.Contact.id_contact)).group_by(models.Contact.genre).all()
-    
-    # Statistiques par statut opt-in
-    opt_in_stats = db.query(models.Contact.statut_opt_in, db.func.count(models.Contact.id_contact)).group_by(models.Contact.statut_opt_in).all()
-    
-    return {
-        "total_contacts": total_contacts,
-        "by_customer_type": [{"type": t[0], "count": t[1]} for t in type_stats if t[0]],
-        "top_cities": [{"ville": c[0], "count": c[1]} for c in city_stats if c[0]],
-        "by_gender": [{"genre": g[0], "count": g[1]} for g in gender_stats if g[0]],
-        "by_opt_in_status": [{"opt_in": bool(o[0]), "count": o[1]} for o in opt_in_stats],
-    }
+    """Statistiques de segmentation des contacts (un seul passage sur la table, mis en cache quelques secondes)"""
+    return contact_stats.get_segmentation_stats(db)
 
 # ==================== FILE IMPORT ENDPOINTS ====================
 @app.post("/contacts/import/csv", response_model=FileImportResult, tags=["Contacts", "Import"])
@@ -220,41 +339,132 @@ async def import_contacts(
 # ==================== SMS SENDING ENDPOINTS ====================
 @app.post("/sms/send", tags=["SMS"])
 def send_sms(
+    response: Response,
     recipient: str,
     message: str,
     contact_name: Optional[str] = None,
     contact_id: Optional[int] = None,
+    expediteur_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """Envoyer un SMS à un destinataire"""
+    """Envoyer un SMS à un destinataire
+
+    ``statut`` donne l'état du message dans l'outbox : « envoyé » (200, accepté par le
+    fournisseur), « en attente » (202, échec transitoire, nouvelle tentative programmée)
+    ou « échec » (502, lettre morte, plus de tentative). ``success`` n'est vrai que
+    pour « envoyé ».
+    """
+    try:
+        expediteur = crud.resolve_expediteur(db, expediteur_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        adapter = providers.get_adapter(expediteur)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     try:
         # Validation basique du numéro
         if not recipient or len(recipient) < 10:
             raise HTTPException(status_code=400, detail="Numéro de téléphone invalide")
         
-        # Créer l'entrée du message dans la base de données
+        # Respecter le débit contractuel de l'expéditeur (partagé avec les campagnes) ;
+        # l'envoi unitaire passe en file transactionnelle, devant les campagnes promotionnelles
+        limiter = rate_limit.get_limiter_for_expediteur(expediteur)
+        if limiter:
+            from_thread.run(priority.get_gate(limiter).acquire, priority.LANE_TRANSACTIONAL)
+        
+        # Enregistrer le message dans l'outbox avant tout appel au fournisseur :
+        # en cas d'échec il est réessayé par le worker au lieu d'être perdu
         db_message = models.Message(
             contenu=message,
-            identifiant_expediteur="SYSTEM",
-            statut_livraison="envoyé",
+            identifiant_expediteur=expediteur.numero_telephone if expediteur else "SYSTEM",
+            statut_livraison=outbox.STATUS_CLAIMED,
+            numero_destinataire=recipient,
+            contact_id=contact_id,
+            priorite=priority.LANE_TRANSACTIONAL,
+            tentatives=1,
+            prochaine_tentative=outbox.lease_deadline(),
             date_creation=datetime.now()
         )
         db.add(db_message)
         db.commit()
         
-        # Simuler l'envoi SMS (en production, utiliser un vrai service SMS)
+        # Envoi via le client poolé du fournisseur, exécuté dans la boucle asyncio principale
+        try:
+            result = from_thread.run(adapter.send, recipient, message)
+        except Exception as e:
+            result = providers.ProviderResult(False, error=str(e) or e.__class__.__name__)
+        outbox.record_results(db, [(db_message.id_message, None, result)])
+        db.refresh(db_message)
+        
+        if db_message.statut_livraison == outbox.STATUS_SENT:
+            detail = f"SMS envoyé avec succès à {recipient}"
+        elif db_message.statut_livraison == outbox.STATUS_PENDING:
+            response.status_code = status.HTTP_202_ACCEPTED
+            detail = f"Envoi différé, nouvelle tentative programmée: {result.error}"
+        else:
+            response.status_code = status.HTTP_502_BAD_GATEWAY
+            detail = f"Envoi refusé par le fournisseur, message en lettre morte: {result.error}"
         return {
-            "success": True,
-            "message": f"SMS envoyé avec succès à {recipient}",
+            "success": db_message.statut_livraison == outbox.STATUS_SENT,
+            "message": detail,
             "recipient": recipient,
             "message_content": message,
             "message_id": db_message.id_message,
+            "statut": db_message.statut_livraison,
+            "tentatives": db_message.tentatives,
+            "prochaine_tentative": db_message.prochaine_tentative.isoformat()
+                                   if db_message.statut_livraison == outbox.STATUS_PENDING else None,
+            "erreur": db_message.derniere_erreur,
             "timestamp": datetime.now().isoformat()
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de l'envoi du SMS: {str(e)}")
 
+@app.get("/sms/history", tags=["SMS"])
+def get_sms_history(
+    response: Response,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Historique des SMS unitaires, du plus récent au plus ancien, page par page (limit ≤ 1000,
+    sinon 422 ; curseur de la page suivante dans l'en-tête X-Next-Cursor)"""
+    try:
+        messages, next_cursor = crud.get_sms_history_page(db, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return messages
+
+# ==================== DELIVERY RECEIPTS (DLR) ====================
+@app.post("/sms/dlr", status_code=202, tags=["SMS"])
+async def receive_delivery_receipts(receipts: List[DeliveryReceipt]):
+    """Webhook des accusés de réception fournisseur (appliqués par lots en arrière-plan)"""
+    # Route asynchrone : le tampon n'est modifié que depuis la boucle, comme le vidage
+    accepted = dlr_buffer.add(receipts)
+    return {"accepted": accepted, "ignored": len(receipts) - accepted}
+
+@app.get("/sms/dlr/stats", tags=["SMS"])
+def get_delivery_receipt_stats():
+    """Statistiques d'ingestion des accusés de réception"""
+    return {"en_tampon": dlr_buffer.pending(), **dlr_buffer.stats}
+
+# ==================== OUTBOX ENDPOINTS ====================
+@app.get("/outbox/stats", tags=["SMS"])
+def get_outbox_stats(db: Session = Depends(get_db)):
+    """État de l'outbox : messages en attente, en cours d'envoi, lettres mortes"""
+    return {**outbox.get_outbox_stats(db), "files_priorite": priority.get_stats()}
+
+@app.post("/outbox/requeue", tags=["SMS"])
+def requeue_dead_letters(campagne_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """Remettre en file les messages en échec définitif (optionnellement pour une campagne)"""
+    count = outbox.requeue_dead_letters(db, campagne_id)
+    return {"message": f"{count} messages remis en file", "requeued": count}
+
 # ==================== ENHANCED MAILING LISTS ENDPOINTS ====================
 @app.post("/mailing-lists/", tags=["Mailing Lists"])
 def create_mailing_list(nom_liste: str, db: Session = Depends(get_db)):
@@ -270,21 +480,20 @@ def get_mailing_lists(db: Session = Depends(get_db)):
     """Récupérer toutes les listes de diffusion"""
     return db.query(models.MailingList).all()
 
-@app.post("/mailing-lists/{list_id}/contacts/{contact_id}", tags=["Mailing Lists"])
-def add_contact_to_list(list_id: int, contact_id: int, db: Session = Depends(get_db)):
-    """Ajouter un contact à une liste de diffusion"""
+def _get_mailing_list_or_404(db: Session, list_id: int) -> models.MailingList:
     mailing_list = db.query(models.MailingList).filter(models.MailingList.id_liste == list_id).first()
-    contact = db.query(models.Contact).filter(models.Contact.id_contact == contact_id).first()
-    
     if not mailing_list:
         raise HTTPException(status_code=404, detail="Liste de diffusion non trouvée")
-    if not contact:
+    return mailing_list
+
+@app.post("/mailing-lists/{list_id}/contacts/{contact_id}", tags=["Mailing Lists"])
+def add_contact_to_list(list_id: int, contact_id: int, db: Session = Depends(get_db)):
+    """Ajouter un contact à une liste de diffusion"""
+    _get_mailing_list_or_404(db, list_id)
+    if not crud.get_contact_by_id(db, contact_id):
         raise HTTPException(status_code=404, detail="Contact non trouvé")
     
-    if contact not in mailing_list.contacts:
-        mailing_list.contacts.append(contact)
-        db.commit()
-    
+    crud.add_contacts_to_mailing_list(db, list_id, [contact_id])
     return {"message": "Contact ajouté à la liste avec succès"}
 
 @app.post("/mailing-lists/{list_id}/contacts", tags=["Mailing Lists"])
@@ -294,22 +503,54 @@ def add_contacts_to_list_by_segment(
     db: Session = Depends(get_db)
 ):
     """Ajouter des contacts à une liste basée sur des critères de segmentation"""
-    mailing_list = db.query(models.MailingList).filter(models.MailingList.id_liste == list_id).first()
-    if not mailing_list:
-        raise HTTPException(status_code=404, detail="Liste de diffusion non trouvée")
-    
-    contacts = crud.get_contacts_by_segmentation(db, criteria)
-    
-    added_count = 0
-    for contact in contacts:
-        if contact not in mailing_list.contacts:
-            mailing_list.contacts.append(contact)
-            added_count += 1
-    
-    db.commit()
+    mailing_list = _get_mailing_list_or_404(db, list_id)
+    added_count = crud.add_segment_to_mailing_list(db, list_id, criteria)
     return {
         "message": f"{added_count} contacts ajoutés à la liste '{mailing_list.nom_liste}'",
-        "total_contacts_in_list": len(mailing_list.contacts)
+        "contacts_ajoutes": added_count,
+        "total_contacts_in_list": crud.count_mailing_list_contacts(db, list_id)
+    }
+
+@app.post("/mailing-lists/{list_id}/add-contacts", tags=["Mailing Lists"])
+def add_contacts_to_list(list_id: int, contact_ids: List[int], db: Session = Depends(get_db)):
+    """Ajouter des contacts (par ID) à une liste ; IDs inconnus et membres existants ignorés"""
+    _get_mailing_list_or_404(db, list_id)
+    added_count = crud.add_contacts_to_mailing_list(db, list_id, contact_ids)
+    return {
+        "message": f"{added_count} contacts ajoutés à la liste",
+        "contacts_ajoutes": added_count,
+        "total_contacts_in_list": crud.count_mailing_list_contacts(db, list_id)
+    }
+
+@app.delete("/mailing-lists/{list_id}/remove-contacts", tags=["Mailing Lists"])
+def remove_contacts_from_list(list_id: int, contact_ids: List[int], db: Session = Depends(get_db)):
+    """Retirer des contacts (par ID) d'une liste de diffusion"""
+    _get_mailing_list_or_404(db, list_id)
+    removed_count = crud.remove_contacts_from_mailing_list(db, list_id, contact_ids)
+    return {
+        "message": f"{removed_count} contacts retirés de la liste",
+        "contacts_retires": removed_count,
+        "total_contacts_in_list": crud.count_mailing_list_contacts(db, list_id)
+    }
+
+@app.delete("/mailing-lists/{list_id}/contacts/{contact_id}", tags=["Mailing Lists"])
+def remove_contact_from_list(list_id: int, contact_id: int, db: Session = Depends(get_db)):
+    """Retirer un contact d'une liste de diffusion"""
+    _get_mailing_list_or_404(db, list_id)
+    if not crud.remove_contacts_from_mailing_list(db, list_id, [contact_id]):
+        raise HTTPException(status_code=404, detail="Contact absent de la liste")
+    return {"message": "Contact retiré de la liste avec succès"}
+
+@app.put("/mailing-lists/{list_id}/contacts", tags=["Mailing Lists"])
+def replace_list_contacts(list_id: int, contact_ids: List[int], db: Session = Depends(get_db)):
+    """Remplacer l'ensemble des contacts d'une liste de diffusion"""
+    _get_mailing_list_or_404(db, list_id)
+    added_count, removed_count = crud.replace_mailing_list_contacts(db, list_id, contact_ids)
+    return {
+        "message": f"Liste mise à jour : {added_count} ajoutés, {removed_count} retirés",
+        "contacts_ajoutes": added_count,
+        "contacts_retires": removed_count,
+        "total_contacts_in_list": crud.count_mailing_list_contacts(db, list_id)
     }
 
 @app.put("/mailing-lists/{list_id}", tags=["Mailing Lists"])
@@ -337,10 +578,34 @@ def delete_mailing_list(list_id: int, db: Session = Depends(get_db)):
     if not mailing_list:
         raise HTTPException(status_code=404, detail="Liste de diffusion non trouvée")
     
+    crud.clear_mailing_list(db, list_id)
     db.delete(mailing_list)
     db.commit()
     return {"message": "Liste de diffusion supprimée avec succès"}
 
+@app.post("/audiences/count", tags=["Mailing Lists", "Segmentation"])
+def count_audience(combinaison: AudienceCombination, db: Session = Depends(get_db)):
+    """Taille d'une combinaison de listes et de segments (union, intersection, différence), calculée par la base"""
+    try:
+        return {"total": audience_algebra.count(db, combinaison)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/mailing-lists/combinaison", tags=["Mailing Lists", "Segmentation"])
+def create_mailing_list_from_combination(payload: AudienceListCreate, db: Session = Depends(get_db)):
+    """Enregistrer une combinaison de listes et de segments comme nouvelle liste de diffusion"""
+    try:
+        query = audience_algebra.build_query(db, payload.combinaison)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    mailing_list, total = crud.create_mailing_list_from_query(db, payload.nom_liste, query, payload.description)
+    return {
+        "message": f"Liste '{mailing_list.nom_liste}' créée avec {total} contacts",
+        "id_liste": mailing_list.id_liste,
+        "nom_liste": mailing_list.nom_liste,
+        "total_contacts_in_list": total
+    }
+
 # ==================== ENHANCED CAMPAIGNS ENDPOINTS ====================
 @app.post("/campaigns/", response_model=CampagneRead, tags=["Campaigns"])
 def create_campaign(campaign: CampagneCreate, db: Session = Depends(get_db)):
@@ -348,9 +613,25 @@ def create_campaign(campaign: CampagneCreate, db: Session = Depends(get_db)):
     return crud.create_campaign(db, campaign)
 
 @app.get("/campaigns/", response_model=List[CampagneRead], tags=["Campaigns"])
-def get_campaigns(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Récupérer toutes les campagnes"""
-    return crud.get_campaigns(db, skip=skip, limit=limit)
+def get_campaigns(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Récupérer les campagnes page par page (limit ≤ 1000, sinon 422 ; curseur de la page suivante
+    dans l'en-tête X-Next-Cursor)"""
+    if skip and not cursor:
+        # Pagination par décalage conservée pour les anciens clients
+        return crud.get_campaigns(db, skip=skip, limit=limit)
+    try:
+        campaigns, next_cursor = crud.get_campaigns_page(db, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return campaigns
 
 @app.get("/campaigns/{campaign_id}", response_model=CampagneRead, tags=["Campaigns"])
 def get_campaign(campaign_id: int, db: Session = Depends(get_db)):
@@ -362,12 +643,65 @@ def get_campaign(campaign_id: int, db: Session = Depends(get_db)):
 
 @app.put("/campaigns/{campaign_id}", response_model=CampagneRead, tags=["Campaigns"])
 def update_campaign(campaign_id: int, campaign_update: CampagneUpdate, db: Session = Depends(get_db)):
-    """Mettre à jour une campagne"""
+    """Mettre à jour une campagne (le passage « en cours » se fait par /campaigns/{id}/launch)"""
+    if campaign_update.statut == "en cours":
+        raise HTTPException(status_code=400, detail="Utiliser /campaigns/{campaign_id}/launch pour lancer une campagne")
     campaign = crud.update_campaign(db, campaign_id, campaign_update)
     if not campaign:
         raise HTTPException(status_code=404, detail="Campagne non trouvée")
     return campaign
 
+@app.put("/campaigns/{campaign_id}/schedule", response_model=CampagneRead, tags=["Campaigns"])
+def schedule_campaign(campaign_id: int, planification: CampagnePlanification, db: Session = Depends(get_db)):
+    """Planifier le lancement automatique d'une campagne créée à sa date_debut (dates modifiables)"""
+    campaign = crud.get_campaign_by_id(db, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campagne non trouvée")
+    if campaign.statut != "créée":
+        raise HTTPException(status_code=409, detail=f"Une campagne au statut '{campaign.statut}' ne peut pas être planifiée")
+    date_debut = planification.date_debut or campaign.date_debut
+    if date_debut is None:
+        raise HTTPException(status_code=400, detail="date_debut requise pour planifier la campagne")
+    date_fin = planification.date_fin or campaign.date_fin
+    if date_fin is not None and date_fin <= date_debut:
+        raise HTTPException(status_code=400, detail="date_fin doit suivre date_debut")
+    return crud.set_campaign_schedule(db, campaign_id, True, planification.date_debut, planification.date_fin)
+
+@app.delete("/campaigns/{campaign_id}/schedule", response_model=CampagneRead, tags=["Campaigns"])
+def unschedule_campaign(campaign_id: int, db: Session = Depends(get_db)):
+    """Annuler le lancement automatique d'une campagne (lancement manuel seulement)"""
+    campaign = crud.set_campaign_schedule(db, campaign_id, False)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campagne non trouvée")
+    return campaign
+
+@app.put("/campaigns/{campaign_id}/audience", tags=["Campaigns", "Segmentation"])
+def set_campaign_audience(campaign_id: int, combinaison: AudienceCombination, db: Session = Depends(get_db)):
+    """Fixer l'audience d'une campagne non lancée à une combinaison de listes et de segments"""
+    campaign = crud.get_campaign_by_id(db, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campagne non trouvée")
+    if campaign.statut != "créée":
+        raise HTTPException(status_code=409, detail=f"L'audience d'une campagne au statut '{campaign.statut}' ne peut pas être modifiée")
+    try:
+        query = audience_algebra.build_query(db, combinaison)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    total = crud.set_campaign_audience(db, campaign_id, query)
+    return {"message": f"Audience de la campagne fixée à {total} contacts", "total": total}
+
+@app.delete("/campaigns/{campaign_id}/audience", tags=["Campaigns", "Segmentation"])
+def clear_campaign_audience(campaign_id: int, db: Session = Depends(get_db)):
+    """Retirer l'audience explicite d'une campagne non lancée (retour aux critères de segmentation)"""
+    campaign = crud.get_campaign_by_id(db, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campagne non trouvée")
+    if campaign.statut != "créée":
+        raise HTTPException(status_code=409, detail=f"L'audience d'une campagne au statut '{campaign.statut}' ne peut pas être modifiée")
+    removed = crud.clear_campaign_audience(db, campaign_id)
+    db.commit()
+    return {"message": f"Audience explicite retirée ({removed} contacts)", "contacts_retires": removed}
+
 @app.post("/campaigns/{campaign_id}/preview", tags=["Campaigns"])
 def preview_campaign_messages(
     campaign_id: int, 
@@ -379,17 +713,29 @@ def preview_campaign_messages(
     if not campaign:
         raise HTTPException(status_code=404, detail="Campagne non trouvée")
     
-    # Récupérer les contacts selon les critères ou tous les contacts opt-in
-    if criteria:
-        contacts = crud.get_contacts_by_segmentation(db, criteria)
+    # Récupérer les contacts selon les critères ou tous les contacts opt-in,
+    # en ne chargeant que les colonnes affichées et celles lues par le modèle
+    if not criteria:
+        criteria = SegmentationCriteria(statut_opt_in=True)
+    columns = ("nom", "prenom", "numero_telephone") + tuple(
+        column for column in campaign.colonnes_personnalisation() if column not in ("nom", "prenom")
+    )
+    # Échantillon (LIMIT) et total (COUNT) calculés par la base : l'audience n'est pas chargée ;
+    # si le segment est déjà en cache, l'échantillon est relu par clé primaire et le total est sa taille
+    explicit = crud.has_campaign_audience(db, campaign_id)
+    audience = crud.build_campaign_audience_query(db, campaign_id, criteria, columns, explicit)
+    cached_ids = None if explicit else segment_cache.peek(criteria)
+    if cached_ids is not None:
+        audience = audience.filter(models.Contact.id_contact.in_(cached_ids[:10].tolist()))
+    sample = audience.order_by(models.Contact.id_contact).limit(10).all()  # Limiter à 10 pour l'aperçu
+    if cached_ids is not None:
+        total = len(cached_ids)
     else:
-        default_criteria = SegmentationCriteria(statut_opt_in=True)
-        contacts = crud.get_contacts_by_segmentation(db, default_criteria)
+        total = crud.count_campaign_audience(db, campaign_id, criteria, explicit)
     
     # Générer les aperçus de messages personnalisés
     previews = []
-    for contact in contacts[:10]:  # Limiter à 10 pour l'aperçu
-        personalized_message = campaign.personnaliser_message(contact)
+    for contact, personalized_message in zip(sample, campaign.personnaliser_messages(sample, columns)):
         previews.append({
             "contact": {
                 "nom": contact.nom,
@@ -402,7 +748,7 @@ def preview_campaign_messages(
     return {
         "campagne": campaign.nom_campagne,
         "template": campaign.message_template,
-        "total_contacts_cibles": len(contacts),
+        "total_contacts_cibles": total,
         "apercu_messages": previews
     }
 
@@ -430,10 +776,124 @@ def update_campaign_status(
     if status not in valid_statuses:
         raise HTTPException(status_code=400, detail=f"Statut invalide. Valeurs acceptées: {valid_statuses}")
     
+    # Passage « en cours » : toujours par le lancement (un statut sans envoi serait repris
+    # par le planificateur) ; une campagne suspendue repart de son point de reprise
+    if status == "en cours":
+        _launch_campaign(db, campaign_id)
+        db.refresh(campaign)
+        return campaign
+    
     campaign.statut = status
     db.commit()
+    db.refresh(campaign)
+    progress_stream.hub.update(campaign_id, etat=status)
+    
+    # Suspension ou arrêt : la production de messages s'interrompt au prochain lot
+    if status in ("suspendue", "terminée"):
+        dispatch.stop_dispatch(campaign_id, status)
     return campaign
 
+def _launch_campaign(
+    db: Session,
+    campaign_id: int,
+    criteria: Optional[SegmentationCriteria] = None,
+    concurrency: int = dispatch.DEFAULT_CONCURRENCY,
+    expediteur_id: Optional[int] = None,
+) -> dict:
+    """Lancer ou reprendre l'envoi d'une campagne (appelé depuis un thread du pool, jamais depuis la boucle)"""
+    campaign = crud.get_campaign_by_id(db, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campagne non trouvée")
+    if concurrency < 1 or concurrency > dispatch.MAX_CONCURRENCY:
+        raise HTTPException(status_code=400, detail=f"La concurrence doit être comprise entre 1 et {dispatch.MAX_CONCURRENCY}")
+    if dispatch.is_running(campaign_id):
+        raise HTTPException(status_code=409, detail="La campagne est déjà en cours d'envoi")
+    resuming = campaign.statut == "suspendue"
+    if resuming and criteria is not None and campaign.criteres_envoi:
+        raise HTTPException(status_code=400, detail="L'audience d'une campagne déjà lancée ne peut pas être modifiée à la reprise")
+    try:
+        expediteur = crud.resolve_expediteur(db, expediteur_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        adapter = providers.get_adapter(expediteur)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Transition atomique : une seule requête peut lancer la campagne
+    if not crud.transition_campaign_status(db, campaign_id, ["créée", "suspendue"], "en cours"):
+        raise HTTPException(status_code=409, detail=f"Impossible de lancer une campagne au statut '{campaign.statut}'")
+    
+    # Les workers d'envoi tournent dans la boucle asyncio principale
+    dispatcher = from_thread.run_sync(functools.partial(
+        dispatch.start_dispatch, campaign_id, criteria, concurrency=concurrency, expediteur=expediteur, adapter=adapter
+    ))
+    return {
+        "message": f"Envoi de la campagne '{campaign.nom_campagne}' {'repris' if resuming else 'lancé'}",
+        "point_de_reprise": campaign.dernier_contact_envoye or 0,
+        "progression": dispatcher.progress()
+    }
+
+@app.post("/campaigns/{campaign_id}/launch", tags=["Campaigns"])
+def launch_campaign(
+    campaign_id: int,
+    criteria: Optional[SegmentationCriteria] = None,
+    concurrency: int = dispatch.DEFAULT_CONCURRENCY,
+    expediteur_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Lancer l'envoi d'une campagne (créée → en cours → terminée), ou reprendre une campagne suspendue"""
+    return _launch_campaign(db, campaign_id, criteria, concurrency, expediteur_id)
+
+@app.get("/campaigns/scheduler/status", tags=["Campaigns"])
+def get_scheduler_status():
+    """État du planificateur de campagnes (leader, dernier passage)"""
+    return campaign_scheduler.status()
+
+@app.get("/campaigns/{campaign_id}/progress", tags=["Campaigns"])
+def get_campaign_progress(campaign_id: int, db: Session = Depends(get_db)):
+    """Progression de l'envoi d'une campagne (débit, profondeur de file, compteurs)"""
+    progress = dispatch.get_progress(campaign_id)
+    if progress:
+        return progress
+    
+    campaign = crud.get_campaign_by_id(db, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campagne non trouvée")
+    return {
+        "campagne_id": campaign_id,
+        "etat": campaign.statut,
+        "messages_en_file": campaign.nombre_destinataires or 0,
+        "messages_envoyes": campaign.nombre_envoyes or 0,
+        "messages_livres": campaign.nombre_livres or 0,
+        "messages_echoues": campaign.nombre_echecs or 0,
+        "point_de_reprise": campaign.dernier_contact_envoye or 0,
+        "profondeur_file": 0,
+        "envois_par_seconde": 0.0
+    }
+
+@app.get("/campaigns/{campaign_id}/progress/stream", tags=["Campaigns"])
+async def stream_campaign_progress(campaign_id: int, max_rate: float = progress_stream.DEFAULT_MAX_RATE):
+    """Progression poussée en continu (Server-Sent Events), au plus max_rate mises à jour par seconde"""
+    if max_rate <= 0 or max_rate > progress_stream.MAX_RATE_LIMIT:
+        raise HTTPException(status_code=400, detail=f"max_rate doit être compris entre 0 et {progress_stream.MAX_RATE_LIMIT}")
+    if await asyncio.to_thread(progress_stream.load_snapshot, campaign_id) is None:
+        raise HTTPException(status_code=404, detail="Campagne non trouvée")
+
+    async def events():
+        yield "retry: 3000\n\n"
+        async for snapshot in progress_stream.hub.subscribe(campaign_id, max_rate):
+            if snapshot is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: progress\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # ==================== MESSAGES ENDPOINTS ====================
 @app.post("/messages/", tags=["Messages"])
 def create_message(
@@ -460,9 +920,27 @@ def create_message(
     return db_message
 
 @app.get("/campaigns/{campaign_id}/messages", tags=["Messages"])
-def get_campaign_messages(campaign_id: int, db: Session = Depends(get_db)):
-    """Récupérer tous les messages d'une campagne"""
-    return db.query(models.Message).filter(models.Message.campagne_id == campaign_id).all()
+def get_campaign_messages(
+    campaign_id: int,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Récupérer les messages d'une campagne : tous, ou page par page si limit/cursor (limit ≤ 1000,
+    sinon 422 ; curseur de la page suivante dans l'en-tête X-Next-Cursor)"""
+    if limit is None and cursor is None:
+        # Sans pagination demandée : liste complète, comme avant l'introduction des curseurs
+        return crud.get_campaign_messages(db, campaign_id)
+    try:
+        messages, next_cursor = crud.get_campaign_messages_page(
+            db, campaign_id, limit=limit or pagination.DEFAULT_PAGE_SIZE, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return messages
 
 # ==================== ENHANCED MESSAGE TEMPLATES ENDPOINTS ====================
 @app.post("/templates/", tags=["Templates"])
@@ -542,7 +1020,9 @@ def get_personalization_help():
         "placeholders_disponibles": [
             "{prenom} - Prénom du contact",
             "{nom} - Nom du contact", 
+            "{nom_complet} - Prénom et nom du contact",
             "{ville} - Ville du contact",
+            "{region} - Région du contact",
             "{type_client} - Type de client (VIP, Regular, etc.)",
             "{age} - Âge du contact",
             "{genre} - Genre (M/F/Other)"
@@ -562,38 +1042,19 @@ def supervise_zone():
 
 @app.get("/dashboard", tags=["Dashboard"])
 def dashboard_stats(db: Session = Depends(get_db)):
-    """Statistiques avancées du tableau de bord"""
-    total_contacts = db.query(models.Contact).count()
-    total_campaigns = db.query(models.Campagne).count()
-    total_messages = db.query(models.Message).count()
-    total_templates = db.query(models.MessageTemplate).count()
-    total_users = db.query(models.User).count()
-    
-    # Statistiques par statut de campagne
-    campaigns_by_status = db.query(models.Campagne.statut, db.func.count(models.Campagne.id_campagne)).group_by(models.Campagne.statut).all()
-    status_counts = {status: count for status, count in campaigns_by_status}
-    
-    # Contacts ajoutés dans les 30 derniers jours
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    recent_contacts = db.query(models.Contact).filter(models.Contact.date_inscription >= thirty_days_ago).count()
-    
-    # Statistiques de segmentation
-    opt_in_contacts = db.query(models.Contact).filter(models.Contact.statut_opt_in == True).count()
-    
+    """Statistiques avancées du tableau de bord (compteurs maintenus à chaque écriture, une seule lecture)"""
     return {
-        "total_contacts": total_contacts,
-        "total_campaigns": total_campaigns,
-        "total_messages": total_messages,
-        "total_templates": total_templates,
-        "total_users": total_users,
-        "campaigns_by_status": status_counts,
-        "recent_contacts_30_days": recent_contacts,
-        "opt_in_contacts": opt_in_contacts,
-        "opt_out_contacts": total_contacts - opt_in_contacts,
+        **dashboard_counters.read(db),
         "platform_status": "active",
         "last_updated": datetime.now().isoformat()
     }
 
+@app.post("/dashboard/recalculer", dependencies=[Depends(role_required("Admin"))], tags=["Dashboard"])
+def rebuild_dashboard_counters(db: Session = Depends(get_db)):
+    """Recalculer les compteurs depuis les tables (après des écritures SQL faites hors de l'application)"""
+    dashboard_counters.rebuild(db)
+    return dashboard_counters.read(db)
+
 # --- TEST ENDPOINTS FOR ALL TABLES ---
 from schemas import UserCreate, ContactCreate, CampagneCreate, MessageTemplateCreate
 
@@ -0,0 +1,88 @@
+"""Mise à niveau d'une base existante vers le schéma de models.py.
+
+``Base.metadata.create_all`` crée les tables manquantes mais ne modifie jamais une
+table existante : les colonnes ajoutées depuis (compteurs de campagne, outbox,
+priorité, débit des expéditeurs...) et leurs index manquent alors sur une base
+déjà en service. Ce script, à lancer une fois à chaque mise à jour (il est
+idempotent) :
+
+1. crée les tables manquantes ;
+2. ajoute les colonnes manquantes (``ALTER TABLE ... ADD COLUMN``), avec leur
+   valeur par défaut serveur et leur clé étrangère ;
+3. remplace les NULL des colonnes à valeur par défaut serveur (lignes créées
+   avant leur introduction, ex. ``nombre_destinataires``) ;
+4. crée les index manquants ;
+5. prépare les index de recherche des contacts (``telephone_chiffres`` et
+   ``telephone_inverse`` renseignés pour les contacts existants, index ``pg_trgm``
+   construits sans bloquer les écritures), travail trop long pour le démarrage
+   de chaque worker.
+
+Usage : ``python migrate_schema.py``
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from database import engine
+import contact_search
+import models
+
+
+def _default_sql(column) -> str:
+    """Valeur par défaut serveur rendue par le dialecte (chaînes citées, booléens natifs ou 0/1)"""
+    return engine.dialect.ddl_compiler(engine.dialect, None).get_column_default_string(column)
+
+
+def _column_ddl(column) -> str:
+    ddl = str(CreateColumn(column).compile(dialect=engine.dialect))
+    for foreign_key in column.foreign_keys:
+        ddl += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+    return ddl
+
+
+def add_missing_columns() -> int:
+    inspector = inspect(engine)
+    added = 0
+    for table in models.Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        with engine.begin() as connection:
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column)}"))
+                print(f"   ➕ {table.name}.{column.name}")
+                added += 1
+            for column in table.columns:
+                if column.server_default is not None and not column.primary_key:
+                    connection.execute(text(
+                        f"UPDATE {table.name} SET {column.name} = {_default_sql(column)} "
+                        f"WHERE {column.name} IS NULL"
+                    ))
+    return added
+
+
+def create_missing_indexes() -> int:
+    inspector = inspect(engine)
+    created = 0
+    for table in models.Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            index.create(bind=engine)
+            print(f"   🗂️ {index.name}")
+            created += 1
+    return created
+
+
+if __name__ == "__main__":
+    print("🚀 Mise à niveau du schéma de la base de données")
+    print("=" * 60)
+    try:
+        models.Base.metadata.create_all(bind=engine)
+        print(f"✅ {add_missing_columns()} colonne(s) ajoutée(s)")
+        print(f"✅ {create_missing_indexes()} index créé(s)")
+        trgm = contact_search.ensure_search_indexes(engine)
+        print(f"✅ Index de recherche prêts ({'pg_trgm' if trgm else 'index en mémoire'})")
+    except Exception as e:
+        print(f"❌ Erreur lors de la mise à niveau: {e}")
+        raise
@@ -1,9 +1,21 @@
 from datetime import datetime
 from sqlalchemy import (
-    Integer, String, Text, DateTime, ForeignKey, Table, Column, Boolean
+    BigInteger, Integer, String, Text, DateTime, ForeignKey, Table, Column, Boolean, Float, Index, false
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from database import Base
+from templating import compile_template
+
+
+def chiffres_telephone(numero):
+    """Chiffres d'un numéro, sans séparateurs (« +33 6 12 » -> « 33612 »)"""
+    return "".join(c for c in (numero or "") if c.isdigit()) or None
+
+
+def inverser_telephone(numero):
+    """Chiffres d'un numéro dans l'ordre inverse (« +33 6 12 » -> « 21633 »)"""
+    chiffres = chiffres_telephone(numero)
+    return chiffres[::-1] if chiffres else None
 
 
 # ---------- Utilisateur ----------
@@ -36,9 +48,24 @@ class Message(Base):
     date_envoi = Column(DateTime, default=datetime.utcnow)
     statut_livraison = Column(String(50))
     identifiant_expediteur = Column(String(100))
+    numero_destinataire = Column(String(50), nullable=True)
     
-    campagne_id = Column(ForeignKey("campagnes.id_campagne"))
+    campagne_id = Column(ForeignKey("campagnes.id_campagne"), index=True)
     campagne = relationship("Campagne", back_populates="messages")
+    contact_id = Column(ForeignKey("contacts.id_contact"), nullable=True, index=True)
+    
+    # Outbox : tentatives d'envoi et reprise (voir outbox.py)
+    tentatives = Column(Integer, default=0, server_default="0")
+    prochaine_tentative = Column(DateTime, nullable=True)
+    derniere_erreur = Column(Text, nullable=True)
+    reference_fournisseur = Column(String(100), nullable=True, index=True)
+    date_livraison = Column(DateTime, nullable=True)
+    # File de priorité : 0 transactionnel, 1 standard, 2 promotionnel (voir priority.py)
+    priorite = Column(Integer, nullable=False, default=2, server_default="2")
+    
+    __table_args__ = (
+        Index("ix_messages_outbox", "statut_livraison", "priorite", "prochaine_tentative"),
+    )
 
 
 # Association table for Campaign <-> Contact many-to-many
@@ -74,6 +101,10 @@ class Contact(Base):
     nom = Column(String(100))
     prenom = Column(String(100))
     numero_telephone = Column(String(50), unique=True)
+    # Chiffres du numéro, dans l'ordre puis inversés : recherche par début et par fin de
+    # numéro sur index B-tree (contact_search.py)
+    telephone_chiffres = Column(String(50), nullable=True, index=True)
+    telephone_inverse = Column(String(50), nullable=True, index=True)
     email = Column(String(100), nullable=True)
     statut_opt_in = Column(Boolean, default=True)
     
@@ -100,6 +131,12 @@ class Contact(Base):
         secondary=campagne_contact,
         back_populates="contacts"
     )
+    
+    @validates("numero_telephone")
+    def _indexer_telephone(self, key, numero):
+        self.telephone_chiffres = chiffres_telephone(numero)
+        self.telephone_inverse = inverser_telephone(numero)
+        return numero
 
 
 # ---------- Campagne ----------
@@ -118,6 +155,25 @@ class Campagne(Base):
     segment_cible = Column(String(100), nullable=True)
     statut = Column(String(50), default="draft")
     
+    # Compteurs d'exécution mis à jour par le moteur d'envoi (dispatch.py)
+    nombre_destinataires = Column(Integer, default=0, server_default="0")
+    nombre_envoyes = Column(Integer, default=0, server_default="0")
+    nombre_livres = Column(Integer, default=0, server_default="0")
+    nombre_echecs = Column(Integer, default=0, server_default="0")
+    
+    # Point de reprise : audience figée au lancement et dernier contact mis en file
+    criteres_envoi = Column(Text, nullable=True)  # SegmentationCriteria (JSON)
+    dernier_contact_envoye = Column(Integer, default=0, server_default="0")
+    # Audience fixée par combinaison de listes et de segments (contacts dans campagne_contact,
+    # éventuellement aucun) : remplace le segment à l'envoi
+    audience_explicite = Column(Boolean, nullable=False, default=False, server_default=false())
+    # Lancement automatique à date_debut, demandé par /campaigns/{id}/schedule : les
+    # campagnes créées sans planification explicite ne partent jamais seules
+    planifiee = Column(Boolean, nullable=False, default=False, server_default=false())
+    # Battement du moteur d'envoi : une campagne « en cours » sans battement récent
+    # (processus arrêté en plein envoi) est reprise par le planificateur
+    battement_envoi = Column(DateTime, nullable=True)
+    
     messages = relationship("Message", back_populates="campagne")
     contacts = relationship(
         "Contact",
@@ -125,27 +181,28 @@ class Campagne(Base):
         back_populates="campagnes"
     )
     
+    __table_args__ = (
+        # Recherche des campagnes dues par le planificateur (scheduler.py)
+        Index("ix_campagnes_planification", "statut", "date_debut"),
+    )
+    
     def personnaliser_message(self, contact):
         """Personalize message for a specific contact"""
         if not self.personnalisation_active or not self.message_template:
             return self.message_template
-        
-        message = self.message_template
-        
-        placeholders = {
-            '{prenom}': contact.prenom or '',
-            '{nom}': contact.nom or '',
-            '{nom_complet}': f"{contact.prenom or ''} {contact.nom or ''}".strip(),
-            '{ville}': contact.ville or '',
-            '{region}': contact.region or '',
-            '{type_client}': contact.type_client or '',
-            '{age}': str(contact.age) if contact.age else '',
-        }
-        
-        for placeholder, value in placeholders.items():
-            message = message.replace(placeholder, value)
-        
-        return message
+        return compile_template(self.message_template).render(contact)
+    
+    def personnaliser_messages(self, contacts, columns=None):
+        """Personnaliser en une fois les messages d'un lot de contacts (rendu vectorisé)"""
+        if not self.personnalisation_active or not self.message_template:
+            return [self.message_template] * len(contacts)
+        return compile_template(self.message_template).render_many(contacts, columns)
+    
+    def colonnes_personnalisation(self):
+        """Colonnes de contact lues par le modèle (aucune si la personnalisation est inactive)"""
+        if not self.personnalisation_active or not self.message_template:
+            return ()
+        return compile_template(self.message_template).columns
 
 
 # ---------- Statut Livraison ----------
@@ -166,6 +223,10 @@ class Expediteur(Base):
     numero_telephone = Column(String(50))
     api_key = Column(String(255), nullable=True)
     service_provider = Column(String(50), nullable=True)
+    
+    # Débit contractuel auprès du fournisseur (voir rate_limit.py)
+    debit_par_seconde = Column(Float, nullable=True)  # jetons/seconde, NULL = non limité
+    rafale = Column(Integer, nullable=True)  # taille max de rafale, défaut = 1 seconde de débit
 
 
 # ---------- Logs ----------
@@ -193,6 +254,15 @@ class MessageTemplate(Base):
     actif = Column(Boolean, default=True)
 
 
+# ---------- Compteurs du tableau de bord ----------
+class Compteur(Base):
+    """Compteur agrégé tenu à jour dans la transaction des écritures (voir dashboard_counters.py)"""
+    __tablename__ = "compteurs"
+
+    cle = Column(String(100), primary_key=True)
+    valeur = Column(BigInteger, nullable=False, default=0)
+
+
 # ---------- Campaign Report ----------
 class CampaignReport(Base):
     __tablename__ = "campaign_reports"
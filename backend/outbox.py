@@ -0,0 +1,393 @@
+"""Outbox durable des SMS, construite sur la table ``messages``.
+
+Cycle de vie d'un message :
+
+    en attente ──(réclamé par un worker)──► en cours d'envoi ──► envoyé
+        ▲                                        │
+        └────(échec transitoire, backoff)────────┤
+                                                 └──(tentatives épuisées)──► échec
+
+Un message réclamé reçoit un bail (``prochaine_tentative`` = maintenant + bail) :
+si le processus qui l'envoie disparaît, le message redevient dû à l'expiration
+du bail et un autre worker le reprend. Les workers réclament les messages dus
+par lots avec ``SELECT ... FOR UPDATE SKIP LOCKED`` (Postgres), ce qui permet de
+faire tourner plusieurs workers en parallèle sans double réclamation.
+"""
+import asyncio
+import os
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.orm import Session
+
+import database
+import priority
+import progress_stream
+import providers
+import rate_limit
+from models import Campagne, Expediteur, Message
+from providers import ProviderResult
+
+STATUS_PENDING = "en attente"
+STATUS_CLAIMED = "en cours d'envoi"
+STATUS_SENT = "envoyé"
+STATUS_DEAD = "échec"
+
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = float(os.getenv("OUTBOX_BACKOFF_BASE", "30"))
+BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "900"))
+CLAIM_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+
+# (id_message, numero, contenu, identifiant_expediteur, campagne_id, priorite)
+OutboxItem = Tuple[int, str, str, Optional[str], Optional[int], int]
+
+# (id_message, campagne_id, résultat du fournisseur)
+OutboxResult = Tuple[int, Optional[int], ProviderResult]
+
+
+def lease_deadline(now: Optional[datetime] = None) -> datetime:
+    return (now or datetime.utcnow()) + timedelta(seconds=LEASE_SECONDS)
+
+
+def backoff_delay(attempts: int) -> float:
+    """Délai avant la prochaine tentative : exponentiel, plafonné, avec gigue de ±20 %"""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+# ==================== OPERATIONS SUR L'OUTBOX ====================
+def _lane_quotas(limit: int) -> Dict[int, int]:
+    """Part de chaque file dans un lot réclamé (le reliquat va à la plus prioritaire)"""
+    total = sum(priority.LANE_WEIGHTS.values())
+    quotas = {lane: limit * weight // total for lane, weight in priority.LANE_WEIGHTS.items()}
+    quotas[min(quotas)] += limit - sum(quotas.values())
+    return quotas
+
+
+def claim_due(db: Session, limit: int = CLAIM_BATCH_SIZE) -> List[OutboxItem]:
+    """Réclamer un lot de messages dus (nouveaux, à réessayer ou dont le bail a expiré)
+
+    Le lot est partagé entre files de priorité selon leurs poids ; la part
+    inutilisée d'une file vide revient aux autres, par ordre de priorité.
+    """
+    now = datetime.utcnow()
+    suspended = select(Campagne.id_campagne).where(Campagne.statut == "suspendue")
+    due = [
+        Message.statut_livraison.in_([STATUS_PENDING, STATUS_CLAIMED]),
+        Message.prochaine_tentative <= now,
+        Message.numero_destinataire.isnot(None),
+        # Les messages d'une campagne suspendue attendent sa reprise
+        or_(Message.campagne_id.is_(None), Message.campagne_id.notin_(suspended)),
+    ]
+
+    def due_ids(lane: int, count: int, exclude: Sequence[int] = ()) -> List[int]:
+        if count <= 0:
+            return []
+        query = select(Message.id_message).where(*due, Message.priorite == lane)
+        if exclude:
+            query = query.where(Message.id_message.notin_(exclude))
+        return list(db.scalars(
+            query.order_by(Message.prochaine_tentative)
+            .limit(count)
+            .with_for_update(skip_locked=True)
+        ).all())
+
+    quotas = _lane_quotas(limit)
+    claimed = {lane: due_ids(lane, quota) for lane, quota in quotas.items()}
+    remaining = limit - sum(len(ids) for ids in claimed.values())
+    for lane in sorted(claimed):
+        if remaining <= 0:
+            break
+        if len(claimed[lane]) < quotas[lane]:
+            continue  # file épuisée
+        extra = due_ids(lane, remaining, claimed[lane])
+        claimed[lane].extend(extra)
+        remaining -= len(extra)
+
+    claimed_ids = [mid for ids in claimed.values() for mid in ids]
+    if not claimed_ids:
+        db.commit()
+        return []
+
+    db.execute(
+        update(Message)
+        .where(Message.id_message.in_(claimed_ids))
+        .values(
+            statut_livraison=STATUS_CLAIMED,
+            prochaine_tentative=lease_deadline(now),
+            tentatives=Message.tentatives + 1,
+        )
+    )
+    rows = db.execute(
+        select(
+            Message.id_message,
+            Message.numero_destinataire,
+            Message.contenu,
+            Message.identifiant_expediteur,
+            Message.campagne_id,
+            Message.priorite,
+        )
+        .where(Message.id_message.in_(claimed_ids))
+        .order_by(Message.priorite, Message.prochaine_tentative)
+    ).all()
+    db.commit()
+    return [tuple(row) for row in rows]
+
+
+def record_results(db: Session, results: Sequence[OutboxResult]) -> Dict[str, int]:
+    """Enregistrer un lot de résultats d'envoi : envoyés, réessais programmés, lettres mortes"""
+    now = datetime.utcnow()
+    sent = [(mid, cid) for mid, cid, result in results if result.ok]
+    failed = {
+        mid: (cid, result.error or "Envoi refusé par le fournisseur", result.retryable)
+        for mid, cid, result in results if not result.ok
+    }
+
+    if sent:
+        # UPDATE groupé par clé primaire (executemany) : la référence diffère par message
+        db.execute(
+            update(Message),
+            [
+                {
+                    "id_message": mid,
+                    "statut_livraison": STATUS_SENT,
+                    "date_envoi": now,
+                    "derniere_erreur": None,
+                    "reference_fournisseur": result.reference,
+                }
+                for mid, _, result in results if result.ok
+            ],
+        )
+
+    dead: List[Tuple[int, Optional[int]]] = []
+    retried = 0
+    if failed:
+        attempts = dict(
+            db.execute(
+                select(Message.id_message, Message.tentatives)
+                .where(Message.id_message.in_(list(failed)))
+            ).all()
+        )
+        for mid, (cid, error, retryable) in failed.items():
+            count = attempts.get(mid) or 1
+            if count >= MAX_ATTEMPTS or not retryable:
+                values = {"statut_livraison": STATUS_DEAD, "derniere_erreur": error}
+                dead.append((mid, cid))
+            else:
+                values = {
+                    "statut_livraison": STATUS_PENDING,
+                    "prochaine_tentative": now + timedelta(seconds=backoff_delay(count)),
+                    "derniere_erreur": error,
+                }
+                retried += 1
+            db.execute(update(Message).where(Message.id_message == mid).values(**values))
+
+    _bump_campaign_counters(db, sent, dead)
+    db.commit()
+    _publish_progress(sent, dead)
+    return {"envoyes": len(sent), "reessais": retried, "echecs": len(dead)}
+
+
+def _bump_campaign_counters(
+    db: Session, sent: List[Tuple[int, Optional[int]]], dead: List[Tuple[int, Optional[int]]]
+) -> None:
+    sent_by_campaign = Counter(cid for _, cid in sent if cid is not None)
+    dead_by_campaign = Counter(cid for _, cid in dead if cid is not None)
+    for cid in set(sent_by_campaign) | set(dead_by_campaign):
+        db.execute(
+            update(Campagne)
+            .where(Campagne.id_campagne == cid)
+            .values(
+                nombre_envoyes=Campagne.nombre_envoyes + sent_by_campaign[cid],
+                nombre_echecs=Campagne.nombre_echecs + dead_by_campaign[cid],
+            )
+        )
+
+
+def _publish_progress(sent: List[Tuple[int, Optional[int]]], dead: List[Tuple[int, Optional[int]]]) -> None:
+    sent_by_campaign = Counter(cid for _, cid in sent if cid is not None)
+    dead_by_campaign = Counter(cid for _, cid in dead if cid is not None)
+    for cid in set(sent_by_campaign) | set(dead_by_campaign):
+        progress_stream.hub.increment(
+            cid, messages_envoyes=sent_by_campaign[cid], messages_echoues=dead_by_campaign[cid]
+        )
+
+
+def requeue_dead_letters(db: Session, campaign_id: Optional[int] = None) -> int:
+    """Remettre les lettres mortes en file (après correction d'un incident fournisseur)"""
+    filters = [Message.statut_livraison == STATUS_DEAD]
+    if campaign_id is not None:
+        filters.append(Message.campagne_id == campaign_id)
+
+    dead_by_campaign = db.execute(
+        select(Message.campagne_id, func.count(Message.id_message))
+        .where(*filters)
+        .group_by(Message.campagne_id)
+    ).all()
+    count = db.execute(
+        update(Message)
+        .where(*filters)
+        .values(statut_livraison=STATUS_PENDING, tentatives=0, prochaine_tentative=datetime.utcnow())
+    ).rowcount
+    for cid, dead in dead_by_campaign:
+        if cid is not None:
+            db.execute(
+                update(Campagne)
+                .where(Campagne.id_campagne == cid)
+                .values(nombre_echecs=case(
+                    (Campagne.nombre_echecs >= dead, Campagne.nombre_echecs - dead), else_=0
+                ))
+            )
+    db.commit()
+    return count
+
+
+def get_outbox_stats(db: Session) -> dict:
+    """Etat de l'outbox : volume par statut et nombre de messages dus"""
+    now = datetime.utcnow()
+    by_status = dict(
+        db.execute(
+            select(Message.statut_livraison, func.count(Message.id_message))
+            .where(Message.statut_livraison.in_([STATUS_PENDING, STATUS_CLAIMED, STATUS_DEAD]))
+            .group_by(Message.statut_livraison)
+        ).all()
+    )
+    due = db.scalar(
+        select(func.count(Message.id_message)).where(
+            and_(
+                Message.statut_livraison.in_([STATUS_PENDING, STATUS_CLAIMED]),
+                Message.prochaine_tentative <= now,
+            )
+        )
+    )
+    return {
+        "en_attente": by_status.get(STATUS_PENDING, 0),
+        "en_cours_envoi": by_status.get(STATUS_CLAIMED, 0),
+        "lettres_mortes": by_status.get(STATUS_DEAD, 0),
+        "dus": due or 0,
+    }
+
+
+# ==================== WORKER ====================
+class OutboxWorker:
+    """Boucle de fond qui réclame les messages dus et les (ré)envoie"""
+
+    def __init__(self, concurrency: int = 20, batch_size: int = CLAIM_BATCH_SIZE):
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task:
+            await self._task
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                processed = await self.run_once()
+            except Exception as e:
+                print(f"❌ Outbox: erreur du worker - {e}")
+                processed = 0
+            if processed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self) -> int:
+        """Traiter un lot de messages dus ; retourne le nombre de messages traités"""
+        items = await asyncio.to_thread(self._claim)
+        if not items:
+            return 0
+
+        by_sender: Dict[Optional[str], List[OutboxItem]] = {}
+        for item in items:
+            by_sender.setdefault(item[3], []).append(item)
+        senders = await asyncio.to_thread(self._load_senders, set(by_sender))
+
+        groups = await asyncio.gather(
+            *(self._send_group(group, *senders[sender_id]) for sender_id, group in by_sender.items())
+        )
+        results = [result for group in groups for result in group]
+        await asyncio.to_thread(self._record, results)
+        return len(items)
+
+    async def _send_group(
+        self,
+        group: List[OutboxItem],
+        adapter: Optional[providers.ProviderAdapter],
+        limiter: Optional[rate_limit.TokenBucket],
+        error: Optional[str],
+    ) -> List[OutboxResult]:
+        if adapter is None:
+            return [(item[0], item[4], ProviderResult(False, error=error)) for item in group]
+
+        if limiter is None:
+            # Pas de débit contractuel : un seul appel groupé au fournisseur
+            replies = await adapter.send_batch([(item[1], item[2]) for item in group])
+            return [(item[0], item[4], reply) for item, reply in zip(group, replies)]
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        gate = priority.get_gate(limiter)
+
+        async def send(item: OutboxItem) -> OutboxResult:
+            message_id, recipient, content, _, campaign_id, lane = item
+            async with semaphore:
+                await gate.acquire(lane)
+                try:
+                    return message_id, campaign_id, await adapter.send(recipient, content)
+                except Exception as e:
+                    return message_id, campaign_id, ProviderResult(False, error=str(e) or e.__class__.__name__)
+
+        return await asyncio.gather(*(send(item) for item in group))
+
+    def _claim(self) -> List[OutboxItem]:
+        db = database.SessionLocal()
+        try:
+            return claim_due(db, self.batch_size)
+        finally:
+            db.close()
+
+    def _record(self, results: List[OutboxResult]) -> None:
+        db = database.SessionLocal()
+        try:
+            record_results(db, results)
+        finally:
+            db.close()
+
+    def _load_senders(self, sender_ids):
+        """Adaptateur et limiteur de chaque expéditeur (identifié par son numéro)"""
+        db = database.SessionLocal()
+        try:
+            expediteurs = {
+                e.numero_telephone: e
+                for e in db.query(Expediteur).filter(
+                    Expediteur.numero_telephone.in_([sid for sid in sender_ids if sid])
+                )
+            }
+            senders = {}
+            for sender_id in sender_ids:
+                expediteur = expediteurs.get(sender_id)
+                try:
+                    senders[sender_id] = (
+                        providers.get_adapter(expediteur),
+                        rate_limit.get_limiter_for_expediteur(expediteur),
+                        None,
+                    )
+                except ValueError as e:
+                    senders[sender_id] = (None, None, str(e))
+            return senders
+        finally:
+            db.close()
@@ -0,0 +1,48 @@
+"""Pagination par clé (keyset) sur la clé primaire.
+
+Au lieu de ``OFFSET n`` (qui relit et jette les n premières lignes à chaque page),
+chaque page reprend strictement après la dernière clé renvoyée :
+``WHERE id > :dernier ORDER BY id LIMIT :n``. Le coût d'une page est constant
+quelle que soit sa profondeur, et l'ordre est stable d'une page à l'autre.
+
+Toutes les routes paginées suivent le même contrat : le corps est la liste des
+éléments de la page, et le curseur de la page suivante, opaque (base64 d'un petit
+document JSON), est renvoyé dans l'en-tête ``X-Next-Cursor`` ; son absence signale
+la dernière page. Les routes refusent (422) un ``limit`` hors de
+``1..MAX_PAGE_SIZE`` ; ``paginate`` le borne par sécurité pour les autres appelants.
+"""
+import base64
+import binascii
+import json
+from typing import List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_key: int) -> str:
+    payload = json.dumps({"id": last_key}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Clé contenue dans un curseur ; ValueError si le curseur est invalide"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return int(json.loads(payload)["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError, UnicodeDecodeError):
+        raise ValueError("Curseur de pagination invalide")
+
+
+def paginate(query, key_column, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+             descending: bool = False) -> Tuple[List, Optional[str]]:
+    """Une page de ``query`` triée par ``key_column`` ; retourne (lignes, curseur suivant)"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        last_key = decode_cursor(cursor)
+        query = query.filter(key_column < last_key if descending else key_column > last_key)
+    rows = query.order_by(key_column.desc() if descending else key_column).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], encode_cursor(getattr(rows[limit - 1], key_column.key))
@@ -0,0 +1,158 @@
+"""Files de priorité du pipeline d'envoi.
+
+Chaque message appartient à une file déduite du type de campagne :
+
+- ``transactionnel`` (0) : notifications et envois unitaires de ``/sms/send`` ;
+- ``standard`` (1) : messages de bienvenue et rappels ;
+- ``promotionnel`` (2) : campagnes promotionnelles (et type non renseigné).
+
+Les ressources partagées sont réparties entre files par tourniquet pondéré
+(``PRIORITY_WEIGHTS``, défaut ``8,3,1``) :
+
+- les jetons du seau de débit d'un expéditeur (``PriorityGate``), pour lesquels
+  les workers d'une campagne et les envois unitaires sont en concurrence ;
+- les lots réclamés par le worker de l'outbox (quotas par file, voir outbox.py).
+
+Une notification n'attend donc jamais derrière la file d'une campagne
+promotionnelle d'un million de messages, sans pour autant affamer cette dernière.
+L'arbitrage des jetons se fait par processus ; le budget du seau reste, lui,
+partagé entre processus (rate_limit.py).
+"""
+import asyncio
+import os
+from collections import Counter, deque
+from typing import Deque, Dict, Optional
+
+import rate_limit
+
+LANE_TRANSACTIONAL = 0
+LANE_STANDARD = 1
+LANE_BULK = 2
+
+LANE_NAMES = {
+    LANE_TRANSACTIONAL: "transactionnel",
+    LANE_STANDARD: "standard",
+    LANE_BULK: "promotionnel",
+}
+
+_CAMPAIGN_TYPE_LANES = {
+    "notification": LANE_TRANSACTIONAL,
+    "welcome": LANE_STANDARD,
+    "reminder": LANE_STANDARD,
+    "promotional": LANE_BULK,
+}
+
+
+def _parse_weights(raw: str) -> Dict[int, int]:
+    values = [int(v) for v in raw.split(",") if v.strip()]
+    if len(values) != len(LANE_NAMES) or any(v < 1 for v in values):
+        raise ValueError(f"PRIORITY_WEIGHTS doit contenir {len(LANE_NAMES)} entiers positifs")
+    return dict(zip(sorted(LANE_NAMES), values))
+
+
+LANE_WEIGHTS = _parse_weights(os.getenv("PRIORITY_WEIGHTS", "8,3,1"))
+
+
+def lane_for_campaign_type(type_campagne: Optional[str]) -> int:
+    """File d'un type de campagne ; les types inconnus sont traités comme promotionnels"""
+    return _CAMPAIGN_TYPE_LANES.get((type_campagne or "").strip().lower(), LANE_BULK)
+
+
+class WeightedRoundRobin:
+    """Tourniquet pondéré lissé : choisit une file parmi celles qui ont du travail"""
+
+    def __init__(self, weights: Dict[int, int] = LANE_WEIGHTS):
+        self.weights = weights
+        self._current = {lane: 0 for lane in weights}
+
+    def next(self, active) -> int:
+        active = [lane for lane in sorted(self.weights) if lane in active]
+        total = sum(self.weights[lane] for lane in active)
+        for lane in self.weights:
+            if lane in active:
+                self._current[lane] += self.weights[lane]
+            else:
+                # Une file vide n'accumule pas de crédit
+                self._current[lane] = 0
+        chosen = max(active, key=lambda lane: self._current[lane])
+        self._current[chosen] -= total
+        return chosen
+
+
+class PriorityGate:
+    """Distribue les jetons d'un seau aux coroutines en attente, par file"""
+
+    def __init__(self, bucket: rate_limit.TokenBucket, weights: Dict[int, int] = LANE_WEIGHTS):
+        self.bucket = bucket
+        self._scheduler = WeightedRoundRobin(weights)
+        self._waiters: Dict[int, Deque[asyncio.Future]] = {lane: deque() for lane in weights}
+        self._pump_task: Optional[asyncio.Task] = None
+        self.granted = Counter()
+
+    def waiting(self) -> Dict[str, int]:
+        return {LANE_NAMES[lane]: len(queue) for lane, queue in self._waiters.items()}
+
+    async def acquire(self, lane: int = LANE_BULK) -> None:
+        """Attendre un jeton du seau pour un message de la file ``lane``"""
+        if lane not in self._waiters:
+            lane = LANE_BULK
+        if not self._has_waiters() and self.bucket.try_acquire() <= 0:
+            self.granted[lane] += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(future)
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+        await future
+
+    def _has_waiters(self) -> bool:
+        return any(self._waiters.values())
+
+    def _purge(self) -> None:
+        for queue in self._waiters.values():
+            while queue and queue[0].done():  # attente annulée
+                queue.popleft()
+
+    async def _pump(self) -> None:
+        try:
+            while True:
+                self._purge()
+                active = [lane for lane, queue in self._waiters.items() if queue]
+                if not active:
+                    return
+                wait = self.bucket.try_acquire()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                lane = self._scheduler.next(active)
+                self._waiters[lane].popleft().set_result(None)
+                self.granted[lane] += 1
+        except Exception as e:
+            for queue in self._waiters.values():
+                while queue:
+                    future = queue.popleft()
+                    if not future.done():
+                        future.set_exception(e)
+
+
+# ==================== REGISTRE DES ARBITRES ====================
+_gates: Dict[str, PriorityGate] = {}
+
+
+def get_gate(bucket: rate_limit.TokenBucket) -> PriorityGate:
+    """Arbitre (unique par seau) des jetons d'un expéditeur"""
+    gate = _gates.get(bucket.key)
+    if gate is None or gate.bucket is not bucket:
+        gate = _gates[bucket.key] = PriorityGate(bucket)
+    return gate
+
+
+def get_stats() -> dict:
+    """Jetons accordés et attentes en cours, par expéditeur et par file"""
+    return {
+        key: {
+            "en_attente": gate.waiting(),
+            "jetons_accordes": {LANE_NAMES[lane]: count for lane, count in gate.granted.items()},
+        }
+        for key, gate in _gates.items()
+    }
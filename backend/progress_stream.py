@@ -0,0 +1,171 @@
+"""Diffusion en temps réel de la progression des campagnes (pub/sub en mémoire).
+
+Le moteur d'envoi (dispatch.py, outbox.py) et l'ingestion des accusés (dlr.py)
+publient ici leurs variations de compteurs après chaque commit ; les clients
+abonnés (flux SSE ``/campaigns/{id}/progress/stream``) reçoivent l'état courant :
+
+- un sujet par campagne suivie, chargé une fois depuis la base puis tenu à jour
+  par les publications ; il est relu toutes les ``RESYNC_SECONDS`` secondes (une
+  requête par campagne, quel que soit le nombre de clients) pour corriger toute
+  dérive et suivre les écritures des autres processus ;
+- regroupement : un abonné reçoit au plus ``max_rate`` mises à jour par seconde,
+  les publications intermédiaires sont fusionnées dans l'état courant ;
+- sans abonné, une publication ne coûte qu'une recherche dans un dictionnaire.
+
+Les publications peuvent venir de threads (``asyncio.to_thread``) : l'état est
+protégé par un verrou et les abonnés sont réveillés par ``call_soon_threadsafe``.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, Optional, Set
+
+import database
+from models import Campagne
+
+DEFAULT_MAX_RATE = float(os.getenv("PROGRESS_STREAM_MAX_RATE", "2"))
+MAX_RATE_LIMIT = 10.0
+RESYNC_SECONDS = float(os.getenv("PROGRESS_STREAM_RESYNC_SECONDS", "10"))
+HEARTBEAT_SECONDS = 15.0
+THROUGHPUT_WINDOW_SECONDS = 5.0
+
+
+def load_snapshot(campaign_id: int) -> Optional[dict]:
+    """Compteurs persistés d'une campagne (None si elle n'existe pas)"""
+    db = database.SessionLocal()
+    try:
+        campaign = db.get(Campagne, campaign_id)
+        if campaign is None:
+            return None
+        return {
+            "campagne_id": campaign_id,
+            "etat": campaign.statut,
+            "messages_en_file": campaign.nombre_destinataires or 0,
+            "messages_envoyes": campaign.nombre_envoyes or 0,
+            "messages_livres": campaign.nombre_livres or 0,
+            "messages_echoues": campaign.nombre_echecs or 0,
+        }
+    finally:
+        db.close()
+
+
+class _Topic:
+    def __init__(self):
+        self.values: Optional[dict] = None
+        self.loaded_at = 0.0
+        self.version = 0
+        self.events: Set[asyncio.Event] = set()
+        self.sent_window: deque = deque()  # (horodatage, messages envoyés)
+        self.load_lock = asyncio.Lock()
+
+
+class ProgressHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics: Dict[int, _Topic] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # ---------- Publication (depuis n'importe quel thread) ----------
+    def increment(self, campaign_id: int, **deltas: int) -> None:
+        """Ajouter des variations aux compteurs d'une campagne suivie"""
+        with self._lock:
+            topic = self._topics.get(campaign_id)
+            if topic is None or topic.values is None:
+                return
+            for key, delta in deltas.items():
+                topic.values[key] = topic.values.get(key, 0) + delta
+            if deltas.get("messages_envoyes"):
+                topic.sent_window.append((time.monotonic(), deltas["messages_envoyes"]))
+            self._changed(topic)
+
+    def update(self, campaign_id: int, **values) -> None:
+        """Remplacer des valeurs (état, profondeur de file...) d'une campagne suivie"""
+        with self._lock:
+            topic = self._topics.get(campaign_id)
+            if topic is None or topic.values is None:
+                return
+            topic.values.update(values)
+            self._changed(topic)
+
+    def _changed(self, topic: _Topic) -> None:
+        topic.version += 1
+        if self._loop is not None and not self._loop.is_closed():
+            for event in topic.events:
+                self._loop.call_soon_threadsafe(event.set)
+
+    def _snapshot(self, topic: _Topic) -> dict:
+        now = time.monotonic()
+        while topic.sent_window and now - topic.sent_window[0][0] > THROUGHPUT_WINDOW_SECONDS:
+            topic.sent_window.popleft()
+        sent = sum(count for _, count in topic.sent_window)
+        return {
+            **topic.values,
+            "envois_par_seconde": round(sent / THROUGHPUT_WINDOW_SECONDS, 2),
+        }
+
+    # ---------- Abonnement (boucle asyncio) ----------
+    async def _refresh(self, campaign_id: int, topic: _Topic) -> bool:
+        """Relire la base si le sujet est vide ou ancien (un seul abonné s'en charge)"""
+        async with topic.load_lock:
+            if topic.values is not None and time.monotonic() - topic.loaded_at < RESYNC_SECONDS:
+                return True
+            values = await asyncio.to_thread(load_snapshot, campaign_id)
+            if values is None:
+                return False
+            with self._lock:
+                if topic.values is not None:
+                    # Valeurs publiées par le processus non persistées (profondeur de file...)
+                    values = {**topic.values, **values}
+                topic.loaded_at = time.monotonic()
+                if values != topic.values:
+                    topic.values = values
+                    self._changed(topic)
+            return True
+
+    async def subscribe(self, campaign_id: int, max_rate: float = DEFAULT_MAX_RATE) -> AsyncIterator[Optional[dict]]:
+        """États successifs d'une campagne (None = battement de cœur), au plus ``max_rate`` par seconde"""
+        self._loop = asyncio.get_running_loop()
+        interval = 1.0 / max(0.1, min(max_rate, MAX_RATE_LIMIT))
+        event = asyncio.Event()
+        with self._lock:
+            topic = self._topics.setdefault(campaign_id, _Topic())
+            topic.events.add(event)
+        try:
+            last_version = -1
+            last_yield = time.monotonic()
+            while True:
+                if not await self._refresh(campaign_id, topic):
+                    return
+                event.clear()
+                with self._lock:
+                    version = topic.version
+                    snapshot = self._snapshot(topic) if version != last_version else None
+                if snapshot is not None:
+                    last_version, last_yield = version, time.monotonic()
+                    yield snapshot
+                    # Regroupement : les publications pendant cette pause partent ensemble
+                    await asyncio.sleep(interval)
+                    continue
+                now = time.monotonic()
+                if now - last_yield >= HEARTBEAT_SECONDS:
+                    last_yield = now
+                    yield None
+                wake_in = min(HEARTBEAT_SECONDS - (now - last_yield), RESYNC_SECONDS - (now - topic.loaded_at))
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=max(wake_in, interval))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                topic.events.discard(event)
+                if not topic.events and self._topics.get(campaign_id) is topic:
+                    del self._topics[campaign_id]
+
+    def subscribers(self) -> Dict[int, int]:
+        with self._lock:
+            return {campaign_id: len(topic.events) for campaign_id, topic in self._topics.items()}
+
+
+hub = ProgressHub()
@@ -0,0 +1,175 @@
+"""Adaptateurs de fournisseurs SMS.
+
+Chaque fournisseur est exposé derrière la même interface (``ProviderAdapter``),
+sélectionnée par ``Expediteur.service_provider``. Les adaptateurs HTTP gardent
+un client ``httpx.AsyncClient`` persistant par expéditeur : connexions poolées,
+keep-alive, et HTTP/2 lorsque le paquet ``h2`` est installé et que le
+fournisseur le négocie. La poignée de main TLS est donc payée une fois par
+connexion, et non une fois par SMS.
+
+Pour ajouter un fournisseur : sous-classer ``ProviderAdapter`` puis appeler
+``register_provider("nom", MaClasse)``.
+"""
+import asyncio
+import importlib.util
+import os
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import httpx
+
+from models import Expediteur
+
+DEFAULT_PROVIDER = os.getenv("SMS_PROVIDER", "simulation")
+SMS_SERVER_URL = os.getenv("SMS_SERVER_URL", "http://localhost:8001")
+HTTP_MAX_CONNECTIONS = int(os.getenv("SMS_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("SMS_HTTP_TIMEOUT", "10"))
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class ProviderResult(NamedTuple):
+    ok: bool
+    reference: Optional[str] = None  # identifiant du message chez le fournisseur
+    error: Optional[str] = None
+    retryable: bool = True  # False pour un refus définitif (numéro invalide, etc.)
+
+
+class ProviderAdapter:
+    """Interface commune des fournisseurs SMS"""
+
+    name = "abstract"
+    max_batch_size = 1
+
+    def __init__(self, expediteur: Optional[Expediteur] = None):
+        pass
+
+    async def send(self, recipient: str, content: str) -> ProviderResult:
+        raise NotImplementedError
+
+    async def send_batch(self, items: Sequence[Tuple[str, str]]) -> List[ProviderResult]:
+        """Envoyer plusieurs messages ; par défaut, envois unitaires concurrents"""
+        results = await asyncio.gather(
+            *(self.send(recipient, content) for recipient, content in items),
+            return_exceptions=True,
+        )
+        return [
+            r if isinstance(r, ProviderResult) else ProviderResult(False, error=str(r) or r.__class__.__name__)
+            for r in results
+        ]
+
+    async def close(self) -> None:
+        pass
+
+
+class SimulationAdapter(ProviderAdapter):
+    """Fournisseur simulé : tous les envois réussissent (développement, démonstrations)"""
+
+    name = "simulation"
+    max_batch_size = 10000
+
+    async def send(self, recipient: str, content: str) -> ProviderResult:
+        return ProviderResult(True)
+
+
+class HttpProviderAdapter(ProviderAdapter):
+    """Base des fournisseurs HTTP : un client poolé et persistant par expéditeur"""
+
+    base_url = ""
+
+    def __init__(self, expediteur: Optional[Expediteur] = None):
+        super().__init__(expediteur)
+        headers = {}
+        if expediteur is not None and expediteur.api_key:
+            headers["Authorization"] = f"Bearer {expediteur.api_key}"
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=headers,
+            http2=HTTP2_AVAILABLE,
+            timeout=HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=60,
+            ),
+        )
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class LocalSmsServerAdapter(HttpProviderAdapter):
+    """Adaptateur de référence pour ``sms_server.py`` (routes /sms/send et /sms/send/batch)"""
+
+    name = "local"
+    base_url = SMS_SERVER_URL
+    max_batch_size = 1000
+
+    async def send(self, recipient: str, content: str) -> ProviderResult:
+        try:
+            response = await self.client.post("/sms/send", json={"recipient": recipient, "message": content})
+        except httpx.HTTPError as e:
+            return ProviderResult(False, error=f"{e.__class__.__name__}: {e}")
+        if response.status_code != 200:
+            return ProviderResult(False, error=f"HTTP {response.status_code}: {response.text[:200]}",
+                                  retryable=response.status_code >= 500 or response.status_code == 429)
+        data = response.json()
+        return ProviderResult(data.get("success", False), data.get("message_id"),
+                              None if data.get("success") else data.get("message"))
+
+    async def send_batch(self, items: Sequence[Tuple[str, str]]) -> List[ProviderResult]:
+        results: List[ProviderResult] = []
+        for start in range(0, len(items), self.max_batch_size):
+            chunk = items[start:start + self.max_batch_size]
+            payload = [{"recipient": recipient, "message": content} for recipient, content in chunk]
+            try:
+                response = await self.client.post("/sms/send/batch", json=payload)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                error = f"{e.__class__.__name__}: {e}"
+                results.extend(ProviderResult(False, error=error) for _ in chunk)
+                continue
+            for item in response.json()["results"]:
+                # Un élément rejeté dans un lot accepté est une erreur de validation : définitive
+                results.append(ProviderResult(
+                    item["success"], item.get("message_id"), None if item["success"] else item["message"],
+                    retryable=False,
+                ))
+        return results
+
+
+# ==================== REGISTRE DES FOURNISSEURS ====================
+_provider_classes: Dict[str, Callable[[Optional[Expediteur]], ProviderAdapter]] = {
+    "simulation": SimulationAdapter,
+    "local": LocalSmsServerAdapter,
+    "sms_server": LocalSmsServerAdapter,
+}
+_adapters: Dict[Tuple[str, Optional[int]], ProviderAdapter] = {}
+
+
+def register_provider(name: str, factory: Callable[[Optional[Expediteur]], ProviderAdapter]) -> None:
+    _provider_classes[name.lower()] = factory
+
+
+def provider_name(expediteur: Optional[Expediteur]) -> str:
+    if expediteur is None or not expediteur.service_provider:
+        return DEFAULT_PROVIDER.lower()
+    return expediteur.service_provider.lower().replace(" ", "_")
+
+
+def get_adapter(expediteur: Optional[Expediteur] = None) -> ProviderAdapter:
+    """Adaptateur (mis en cache) de l'expéditeur ; ValueError si le fournisseur est inconnu"""
+    name = provider_name(expediteur)
+    key = (name, expediteur.id_expediteur if expediteur is not None else None)
+    adapter = _adapters.get(key)
+    if adapter is None:
+        factory = _provider_classes.get(name)
+        if factory is None:
+            raise ValueError(f"Fournisseur SMS inconnu: '{name}'. Disponibles: {sorted(_provider_classes)}")
+        adapter = _adapters[key] = factory(expediteur)
+    return adapter
+
+
+async def close_all() -> None:
+    """Fermer les clients HTTP persistants (arrêt de l'application)"""
+    adapters = list(_adapters.values())
+    _adapters.clear()
+    await asyncio.gather(*(adapter.close() for adapter in adapters), return_exceptions=True)
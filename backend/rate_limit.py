@@ -0,0 +1,153 @@
+"""Limitation de débit par expéditeur (seau à jetons).
+
+Chaque ligne ``Expediteur`` peut définir un débit contractuel (``debit_par_seconde``)
+et une rafale maximale (``rafale``). Tous les chemins d'envoi (``/sms/send`` et le
+moteur de campagnes) passent par le même seau, identifié par l'expéditeur.
+
+Sur un même hôte, l'état du seau est conservé dans un petit fichier verrouillé
+(``fcntl.flock``) afin que plusieurs processus API partagent un budget unique.
+Si ``fcntl`` n'est pas disponible (Windows), le seau reste local au processus.
+"""
+import asyncio
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de partage inter-processus
+    fcntl = None
+
+from models import Expediteur
+
+RATE_LIMIT_DIR = os.getenv("RATE_LIMIT_DIR", os.path.join(tempfile.gettempdir(), "sms_rate_limits"))
+
+# Etat persistant : (jetons disponibles, horodatage du dernier remplissage)
+_STATE = struct.Struct("dd")
+
+
+class TokenBucket:
+    """Seau à jetons : ``rate`` jetons par seconde, au plus ``burst`` en réserve"""
+
+    def __init__(self, key: str, rate: float, burst: Optional[int] = None):
+        self.key = key
+        self.configure(rate, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def configure(self, rate: float, burst: Optional[int] = None) -> None:
+        if rate <= 0:
+            raise ValueError("Le débit doit être strictement positif")
+        self.rate = float(rate)
+        self.burst = max(1, int(burst if burst else max(1, rate)))
+
+    def _load(self):
+        return self._tokens, self._updated
+
+    def _store(self, tokens: float, updated: float) -> None:
+        self._tokens, self._updated = tokens, updated
+
+    def _lock_state(self):
+        return self._lock
+
+    def try_acquire(self, tokens: int = 1) -> float:
+        """Prélever ``tokens`` jetons ; retourne 0 si accordé, sinon l'attente conseillée (s)"""
+        if tokens > self.burst:
+            raise ValueError(f"Demande de {tokens} jetons supérieure à la rafale ({self.burst})")
+        with self._lock_state():
+            now = time.monotonic()
+            available, updated = self._load()
+            available = min(self.burst, available + max(0.0, now - updated) * self.rate)
+            if available >= tokens:
+                self._store(available - tokens, now)
+                return 0.0
+            self._store(available, now)
+            return (tokens - available) / self.rate
+
+    async def acquire(self, tokens: int = 1) -> None:
+        """Attendre (sans bloquer la boucle asyncio) que ``tokens`` jetons soient disponibles"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def acquire_blocking(self, tokens: int = 1) -> None:
+        """Variante bloquante pour les routes synchrones"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+    """Seau dont l'état est partagé entre processus via un fichier verrouillé"""
+
+    def __init__(self, key: str, rate: float, burst: Optional[int] = None):
+        super().__init__(key, rate, burst)
+        os.makedirs(RATE_LIMIT_DIR, exist_ok=True)
+        path = os.path.join(RATE_LIMIT_DIR, f"{key}.bucket")
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def _lock_state(self):
+        return _FileLock(self._fd, self._lock)
+
+    def _load(self):
+        data = os.pread(self._fd, _STATE.size, 0)
+        if len(data) < _STATE.size:
+            return float(self.burst), time.monotonic()
+        return _STATE.unpack(data)
+
+    def _store(self, tokens: float, updated: float) -> None:
+        os.pwrite(self._fd, _STATE.pack(tokens, updated), 0)
+
+
+class _FileLock:
+    """Verrou exclusif : thread local puis ``flock`` pour les autres processus"""
+
+    def __init__(self, fd: int, thread_lock: threading.Lock):
+        self._fd = fd
+        self._thread_lock = thread_lock
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+# ==================== REGISTRE DES LIMITEURS ====================
+_buckets: Dict[str, TokenBucket] = {}
+_registry_lock = threading.Lock()
+
+
+def get_limiter(key: str, rate: float, burst: Optional[int] = None) -> TokenBucket:
+    """Retourner le seau associé à ``key`` (créé au besoin, reconfiguré si le débit change)"""
+    with _registry_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket_class = SharedTokenBucket if fcntl else TokenBucket
+            bucket = _buckets[key] = bucket_class(key, rate, burst)
+        elif bucket.rate != rate or (burst and bucket.burst != burst):
+            bucket.configure(rate, burst)
+        return bucket
+
+
+def limiter_key(expediteur: Expediteur) -> str:
+    provider = (expediteur.service_provider or "default").lower().replace(" ", "_")
+    return f"{provider}-{expediteur.id_expediteur}"
+
+
+def get_limiter_for_expediteur(expediteur: Optional[Expediteur]) -> Optional[TokenBucket]:
+    """Seau de l'expéditeur, ou None si aucun débit n'est configuré (envoi non limité)"""
+    if expediteur is None or not expediteur.debit_par_seconde:
+        return None
+    return get_limiter(limiter_key(expediteur), expediteur.debit_par_seconde, expediteur.rafale)
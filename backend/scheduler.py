@@ -0,0 +1,257 @@
+"""Planificateur des campagnes (date_debut / date_fin).
+
+Une boucle de fond interroge périodiquement les campagnes dues (index sur
+``statut, date_debut``) :
+
+- « créée », planifiée (``PUT /campaigns/{id}/schedule``) et ``date_debut``
+  atteinte : la campagne passe « en cours » et son envoi démarre. Les campagnes
+  non planifiées, dont celles créées avant le planificateur (``date_debut`` a
+  toujours été obligatoire), ne partent jamais seules ;
+- « en cours » et ``date_fin`` dépassée : la campagne est « suspendue », ce qui
+  arrête la production de messages (y compris sur un autre réplica) ;
+- « en cours » dont le moteur d'envoi ne bat plus depuis ``ORPHAN_TIMEOUT_SECONDS``
+  (processus arrêté en plein envoi) : l'envoi est repris depuis son point de
+  reprise. Seules les campagnes réellement lancées (battement ou point de reprise
+  enregistré) sont reprises, jamais une campagne dont seul le statut a changé.
+
+Si l'envoi ne peut pas démarrer (fournisseur ou expéditeur invalide), le statut
+est rétabli : « créée » pour un lancement, « suspendue » pour une reprise.
+
+Avec plusieurs réplicas de l'API, un seul joue le rôle de planificateur : le
+détenteur du verrou consultatif Postgres ``SCHEDULER_LOCK_KEY``. Le lancement
+reste de toute façon protégé par la transition atomique de statut, si bien
+qu'une campagne n'est diffusée qu'une seule fois. Sur une base sans verrous
+consultatifs (SQLite), le processus est considéré comme seul planificateur.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text, update
+
+import crud
+import database
+import dispatch
+import providers
+from models import Campagne
+
+POLL_INTERVAL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS", "30"))
+SCHEDULER_LOCK_KEY = int(os.getenv("SCHEDULER_LOCK_KEY", "7243001"))
+ORPHAN_TIMEOUT_SECONDS = float(os.getenv("SCHEDULER_ORPHAN_SECONDS", "300"))
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class LeaderLock:
+    """Verrou consultatif Postgres tenu sur une connexion dédiée"""
+
+    def __init__(self, key: int = SCHEDULER_LOCK_KEY):
+        self.key = key
+        self._connection = None
+
+    @property
+    def supported(self) -> bool:
+        return database.engine.dialect.name == "postgresql"
+
+    def acquire(self) -> bool:
+        """Vrai si ce processus est (ou devient) le leader"""
+        if not self.supported:
+            return True
+        if self._connection is not None:
+            try:
+                self._connection.execute(text("SELECT 1"))
+                return True
+            except Exception:
+                self.release()
+        # AUTOCOMMIT : le verrou est de session, aucune transaction ne reste ouverte
+        # (une session « idle in transaction » bloquerait le VACUUM)
+        connection = database.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            acquired = connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}
+            ).scalar()
+        except Exception:
+            connection.close()
+            raise
+        if acquired:
+            self._connection = connection
+            return True
+        connection.close()
+        return False
+
+    def release(self) -> None:
+        if self._connection is not None:
+            try:
+                self._connection.close()  # la fin de session libère le verrou
+            except Exception:
+                pass
+            self._connection = None
+
+
+class CampaignScheduler:
+    """Démarre et arrête les campagnes selon leur fenêtre de diffusion"""
+
+    def __init__(self, poll_interval: float = POLL_INTERVAL_SECONDS):
+        self.poll_interval = poll_interval
+        self.lock = LeaderLock()
+        self.is_leader = False
+        self.last_tick: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task:
+            await self._task
+        await asyncio.to_thread(self.lock.release)
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"❌ Planificateur: erreur - {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def tick(self) -> dict:
+        """Un passage du planificateur ; retourne les campagnes démarrées et arrêtées"""
+        self.is_leader = await asyncio.to_thread(self.lock.acquire)
+        self.last_tick = datetime.utcnow()
+        if not self.is_leader:
+            return {"demarrees": [], "reprises": [], "arretees": []}
+
+        started, launches = await asyncio.to_thread(self._start_due_campaigns)
+        started = await self._dispatch(launches, "créée", started)
+
+        adopted, resumptions = await asyncio.to_thread(self._adopt_orphaned_campaigns)
+        adopted = await self._dispatch(resumptions, "suspendue", adopted)
+
+        stopped = await asyncio.to_thread(self._stop_expired_campaigns)
+        for campaign_id in stopped:
+            dispatch.stop_dispatch(campaign_id, "suspendue")
+
+        if started or adopted or stopped:
+            print(f"⏰ Planificateur: démarrées {started}, reprises {adopted}, suspendues {stopped}")
+        return {"demarrees": started, "reprises": adopted, "arretees": stopped}
+
+    async def _dispatch(self, launches: list, fallback_status: str, campaign_ids: List[int]) -> List[int]:
+        """Démarrer les envois ; une campagne qui ne démarre pas revient à ``fallback_status``"""
+        for campaign_id, expediteur in launches:
+            try:
+                dispatch.start_dispatch(
+                    campaign_id, expediteur=expediteur, adapter=providers.get_adapter(expediteur)
+                )
+            except Exception as e:
+                print(f"❌ Planificateur: campagne {campaign_id} non démarrée - {e}")
+                await asyncio.to_thread(self._revert_status, campaign_id, fallback_status)
+                campaign_ids = [cid for cid in campaign_ids if cid != campaign_id]
+        return campaign_ids
+
+    def _start_due_campaigns(self) -> Tuple[List[int], list]:
+        db = database.SessionLocal()
+        try:
+            now = datetime.utcnow()
+            due_ids = [
+                row[0] for row in db.query(Campagne.id_campagne).filter(
+                    Campagne.statut == "créée",
+                    Campagne.planifiee.is_(True),
+                    Campagne.date_debut <= now,
+                    (Campagne.date_fin.is_(None)) | (Campagne.date_fin > now),
+                ).order_by(Campagne.date_debut)
+            ]
+            if not due_ids:
+                return [], []
+            expediteur = crud.get_default_expediteur(db)
+            started = []
+            for campaign_id in due_ids:
+                # Transition atomique : un seul réplica peut gagner le lancement
+                if not dispatch.is_running(campaign_id) and crud.transition_campaign_status(
+                    db, campaign_id, ["créée"], "en cours"
+                ):
+                    started.append(campaign_id)
+            if expediteur is not None:
+                db.refresh(expediteur)
+                db.expunge(expediteur)
+            return started, [(campaign_id, expediteur) for campaign_id in started]
+        finally:
+            db.close()
+
+    def _adopt_orphaned_campaigns(self) -> Tuple[List[int], list]:
+        """Campagnes « en cours » dont l'envoi n'a plus de battement, réservées pour reprise"""
+        db = database.SessionLocal()
+        try:
+            now = datetime.utcnow()
+            cutoff = now - timedelta(seconds=ORPHAN_TIMEOUT_SECONDS)
+            stale = (Campagne.battement_envoi < cutoff) | (
+                # Envoi lancé avant l'introduction du battement : seul le point de reprise en témoigne
+                Campagne.battement_envoi.is_(None) & (Campagne.dernier_contact_envoye > 0)
+            )
+            candidate_ids = [
+                row[0] for row in db.query(Campagne.id_campagne).filter(
+                    Campagne.statut == "en cours",
+                    stale,
+                    (Campagne.date_fin.is_(None)) | (Campagne.date_fin > now),  # sinon suspendue plus bas
+                )
+            ]
+            adopted = []
+            for campaign_id in candidate_ids:
+                if dispatch.is_running(campaign_id):
+                    continue
+                # Réservation atomique : le battement rafraîchi, la campagne n'est plus orpheline
+                claimed = db.execute(
+                    update(Campagne)
+                    .where(Campagne.id_campagne == campaign_id, Campagne.statut == "en cours", stale)
+                    .values(battement_envoi=now)
+                ).rowcount
+                db.commit()
+                if claimed:
+                    adopted.append(campaign_id)
+            if not adopted:
+                return [], []
+            expediteur = crud.get_default_expediteur(db)
+            if expediteur is not None:
+                db.expunge(expediteur)
+            return adopted, [(campaign_id, expediteur) for campaign_id in adopted]
+        finally:
+            db.close()
+
+    def _revert_status(self, campaign_id: int, statut: str) -> None:
+        db = database.SessionLocal()
+        try:
+            crud.transition_campaign_status(db, campaign_id, ["en cours"], statut)
+        finally:
+            db.close()
+
+    def _stop_expired_campaigns(self) -> List[int]:
+        db = database.SessionLocal()
+        try:
+            now = datetime.utcnow()
+            expired_ids = [
+                row[0] for row in db.query(Campagne.id_campagne).filter(
+                    Campagne.statut == "en cours",
+                    Campagne.date_fin.isnot(None),
+                    Campagne.date_fin <= now,
+                )
+            ]
+            return [
+                campaign_id for campaign_id in expired_ids
+                if crud.transition_campaign_status(db, campaign_id, ["en cours"], "suspendue")
+            ]
+        finally:
+            db.close()
+
+    def status(self) -> dict:
+        return {
+            "actif": self._task is not None and not self._task.done(),
+            "leader": self.is_leader,
+            "intervalle_secondes": self.poll_interval,
+            "dernier_passage": self.last_tick.isoformat() if self.last_tick else None,
+        }
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Annotated, Optional, List
+from typing import Annotated, Any, Literal, Optional, List, Union
 from datetime import datetime
 import re
 
@@ -71,9 +71,14 @@ class CampagneUpdate(BaseModel):
     criteres_age: Optional[str] = None
     statut: Optional[str] = None
 
+class CampagnePlanification(BaseModel):
+    date_debut: Optional[datetime] = None
+    date_fin: Optional[datetime] = None
+
 class CampagneRead(CampagneBase):
     id_campagne: int
     statut: str
+    planifiee: bool = False
     nombre_destinataires: int
     nombre_envoyes: int
     nombre_livres: int
@@ -102,6 +107,98 @@ class SegmentationCriteria(BaseModel):
     genre: Optional[List[str]] = None
     statut_opt_in: Optional[bool] = True
 
+# ---- Segmentation avancée : expression booléenne (voir segment_query.py) ----
+class SegmentCondition(BaseModel):
+    """Comparaison sur une colonne du contact, ex. {"champ": "age", "operateur": "gte", "valeur": 30}"""
+    type: Literal["champ"] = "champ"
+    champ: str
+    operateur: Literal["eq", "ne", "in", "not_in", "lt", "lte", "gt", "gte", "between",
+                       "is_null", "not_null", "contains", "starts_with"] = "eq"
+    valeur: Any = None
+
+class SegmentListMembership(BaseModel):
+    """Appartenance à au moins une des listes de diffusion"""
+    type: Literal["liste"] = "liste"
+    liste_ids: List[int] = Field(..., min_length=1)
+
+class SegmentCampaignHistory(BaseModel):
+    """Au moins un message reçu (filtré par campagne, statut et date d'envoi)"""
+    type: Literal["campagne"] = "campagne"
+    campagne_ids: Optional[List[int]] = None
+    statut_livraison: Optional[List[str]] = None
+    depuis: Optional[datetime] = None
+    jusqu_a: Optional[datetime] = None
+
+class SegmentDateRange(BaseModel):
+    """Intervalle [depuis, jusqu_a[ sur une date du contact, ou les N derniers jours"""
+    type: Literal["periode"] = "periode"
+    champ: Literal["date_inscription", "derniere_activite"]
+    depuis: Optional[datetime] = None
+    jusqu_a: Optional[datetime] = None
+    derniers_jours: Optional[int] = Field(None, ge=1)
+
+class SegmentAnd(BaseModel):
+    type: Literal["et"] = "et"
+    conditions: List["SegmentExpression"]
+
+class SegmentOr(BaseModel):
+    type: Literal["ou"] = "ou"
+    conditions: List["SegmentExpression"]
+
+class SegmentNot(BaseModel):
+    type: Literal["non"] = "non"
+    condition: "SegmentExpression"
+
+SegmentExpression = Annotated[
+    Union[SegmentAnd, SegmentOr, SegmentNot, SegmentCondition,
+          SegmentListMembership, SegmentCampaignHistory, SegmentDateRange],
+    Field(discriminator="type"),
+]
+
+SegmentAnd.model_rebuild()
+SegmentOr.model_rebuild()
+SegmentNot.model_rebuild()
+
+class SegmentQuery(BaseModel):
+    expression: SegmentExpression
+    # Comme SegmentationCriteria : par défaut seuls les contacts opt-in sont retenus
+    statut_opt_in: Optional[bool] = True
+
+# ---- Algèbre d'audiences : union / intersection / différence (voir audience_algebra.py) ----
+class AudienceList(BaseModel):
+    """Membres d'une liste de diffusion"""
+    type: Literal["liste"] = "liste"
+    liste_id: int
+
+class AudienceSegment(BaseModel):
+    """Contacts d'un segment simple"""
+    type: Literal["segment"] = "segment"
+    criteres: SegmentationCriteria
+
+class AudienceQuery(BaseModel):
+    """Contacts d'un segment avancé"""
+    type: Literal["requete"] = "requete"
+    requete: SegmentQuery
+
+class AudienceCombination(BaseModel):
+    """Union, intersection ou différence (premier opérande moins tous les suivants)"""
+    type: Literal["combinaison"] = "combinaison"
+    operation: Literal["union", "intersection", "difference"]
+    operandes: List["AudienceOperand"] = Field(..., min_length=1)
+
+AudienceOperand = Annotated[
+    Union[AudienceList, AudienceSegment, AudienceQuery, AudienceCombination],
+    Field(discriminator="type"),
+]
+
+AudienceCombination.model_rebuild()
+
+class AudienceListCreate(BaseModel):
+    """Enregistrer une combinaison comme nouvelle liste de diffusion"""
+    nom_liste: str = Field(..., min_length=1, max_length=100)
+    description: Optional[str] = None
+    combinaison: AudienceCombination
+
 # ---- User ----
 class UserBase(BaseModel):
     username: str = Field(..., min_length=3, max_length=100)
@@ -149,6 +246,10 @@ class SmsResponse(BaseModel):
     sent_at: datetime
     message_id: Optional[str] = None
 
+class DeliveryReceipt(BaseModel):
+    reference: str = Field(..., description="Identifiant du message chez le fournisseur (message_id)")
+    statut: str = Field(..., description="Statut fournisseur: delivered, DELIVRD, failed, UNDELIV, expired...")
+
 # ---- Message Template Schemas ----
 class MessageTemplateCreate(BaseModel):
     nom_modele: str
@@ -0,0 +1,109 @@
+"""Cache des segments matérialisés (identifiants de contacts).
+
+Un segment matérialisé par ``crud.get_segment_contact_ids`` (identifiants triés,
+tableau numpy ``int64`` : 8 octets par contact) est gardé sous la clé des critères
+canonisés (listes triées et dédoublonnées, puis SHA-1 du JSON). Les chemins
+courants (comptage, aperçu de campagne) ne matérialisent jamais un segment : ils
+consultent seulement le cache (``peek``) comme raccourci.
+
+Invalidation : chaque entrée retient la version des contacts à laquelle elle a été
+calculée ; crud.py incrémente cette version à chaque écriture de contact
+(création, modification, suppression, donc aussi les imports). Une entrée d'une
+version antérieure n'est jamais servie. La version est propre au processus :
+``SEGMENT_CACHE_TTL`` borne l'âge d'une entrée pour les écritures faites ailleurs.
+
+Éviction LRU, bornée en nombre d'entrées et en nombre total d'identifiants.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional, Tuple
+
+import numpy as np
+
+from schemas import SegmentationCriteria
+
+SEGMENT_CACHE_MAX_ENTRIES = int(os.getenv("SEGMENT_CACHE_MAX_ENTRIES", "64"))
+SEGMENT_CACHE_MAX_IDS = int(os.getenv("SEGMENT_CACHE_MAX_IDS", "5000000"))
+SEGMENT_CACHE_TTL = float(os.getenv("SEGMENT_CACHE_TTL", "300"))
+
+_lock = threading.Lock()
+_version = 0
+# clé -> (version, horodatage, identifiants)
+_entries: "OrderedDict[str, Tuple[int, float, np.ndarray]]" = OrderedDict()
+_cached_ids = 0
+
+
+def criteria_key(criteria: SegmentationCriteria) -> str:
+    """Clé canonique : deux critères équivalents (ordre, doublons) partagent la même entrée"""
+    canonical = {
+        field: sorted(set(value)) if isinstance(value, list) else value
+        for field, value in criteria.model_dump().items()
+    }
+    for field, value in canonical.items():
+        if value == []:
+            canonical[field] = None  # liste vide = pas de filtre, comme None
+    payload = json.dumps(canonical, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def bump() -> None:
+    """Signaler une écriture sur les contacts : toutes les entrées deviennent périmées"""
+    global _version
+    with _lock:
+        _version += 1
+
+
+def version() -> int:
+    return _version
+
+
+def _fresh(entry: Tuple[int, float, np.ndarray]) -> bool:
+    entry_version, stored_at, _ = entry
+    return entry_version == _version and time.monotonic() - stored_at < SEGMENT_CACHE_TTL
+
+
+def peek(criteria: SegmentationCriteria) -> Optional[np.ndarray]:
+    """Identifiants en cache (sans calcul), ou None"""
+    key = criteria_key(criteria)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or not _fresh(entry):
+            return None
+        _entries.move_to_end(key)
+        return entry[2]
+
+
+def get(criteria: SegmentationCriteria, loader: Callable[[], Iterable[int]]) -> np.ndarray:
+    """Identifiants triés du segment : depuis le cache, sinon ``loader()`` puis mise en cache"""
+    cached = peek(criteria)
+    if cached is not None:
+        return cached
+
+    loaded_version = _version
+    ids = np.fromiter(loader(), dtype=np.int64)
+    ids.sort()
+    ids.flags.writeable = False  # partagé entre les appelants
+    _store(criteria_key(criteria), loaded_version, ids)
+    return ids
+
+
+def _store(key: str, loaded_version: int, ids: np.ndarray) -> None:
+    global _cached_ids
+    if len(ids) > SEGMENT_CACHE_MAX_IDS:
+        return
+    with _lock:
+        if loaded_version != _version:
+            return  # une écriture a eu lieu pendant le calcul
+        previous = _entries.pop(key, None)
+        if previous is not None:
+            _cached_ids -= len(previous[2])
+        _entries[key] = (loaded_version, time.monotonic(), ids)
+        _cached_ids += len(ids)
+        while len(_entries) > SEGMENT_CACHE_MAX_ENTRIES or _cached_ids > SEGMENT_CACHE_MAX_IDS:
+            _, (_, _, evicted) = _entries.popitem(last=False)
+            _cached_ids -= len(evicted)
+
@@ -0,0 +1,208 @@
+"""Index bitmap en mémoire des attributs de segmentation (optionnel).
+
+Pour chaque dimension de ``SegmentationCriteria`` (type_client, ville, region,
+genre, statut_opt_in, age), l'index garde un bitmap des ``id_contact`` par
+valeur. Un segment se calcule alors par ET / OU de bitmaps, sans requête SQL :
+taille et liste d'identifiants en quelques microsecondes.
+
+Bitmaps : ``pyroaring.BitMap`` (bitmaps compressés « roaring »), requis dès que
+l'index est activé : le démarrage échoue sans le paquet plutôt que de retomber
+sur des bitmaps non compressés de ``max(id_contact) / 8`` octets par valeur.
+
+L'index est construit au démarrage (``SEGMENT_INDEX_ENABLED=true``) puis tenu à
+jour par crud.py à chaque création, modification ou suppression de contact. Il ne
+voit que les écritures de son propre processus : à réserver aux déploiements à un
+seul processus API, ou à reconstruire périodiquement (``build``).
+"""
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import database
+from models import Contact
+from schemas import SegmentationCriteria
+
+try:
+    from pyroaring import BitMap
+except ImportError:  # paquet requis seulement si SEGMENT_INDEX_ENABLED
+    BitMap = None
+
+SEGMENT_INDEX_ENABLED = os.getenv("SEGMENT_INDEX_ENABLED", "false").lower() in ("1", "true", "yes")
+BUILD_BATCH_SIZE = 50000
+
+# Dimensions indexées, dans l'ordre des instantanés (id_contact en tête)
+DIMENSIONS = ("type_client", "ville", "region", "genre", "statut_opt_in", "age")
+
+# (id_contact, type_client, ville, region, genre, statut_opt_in, age)
+Snapshot = Tuple
+
+
+def require_bitmaps() -> None:
+    """Refuser de démarrer sans pyroaring quand l'index est activé (appelé au démarrage)"""
+    if BitMap is None:
+        raise RuntimeError(
+            "SEGMENT_INDEX_ENABLED exige le paquet pyroaring (pip install pyroaring) : "
+            "sans bitmaps compressés, l'index occuperait plusieurs Go de mémoire"
+        )
+
+
+def _bitmap(values: Iterable[int] = ()):
+    return BitMap(values)
+
+
+def snapshot(contact) -> Snapshot:
+    """Valeurs indexées d'un contact (à prendre avant modification ou suppression)"""
+    return (contact.id_contact,) + tuple(getattr(contact, dimension) for dimension in DIMENSIONS)
+
+
+class SegmentIndex:
+    """Bitmaps d'identifiants de contacts par dimension et par valeur"""
+
+    def __init__(self):
+        self.all = _bitmap()
+        self.values: Dict[str, Dict[object, object]] = {dimension: {} for dimension in DIMENSIONS}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Snapshot]) -> "SegmentIndex":
+        ids: List[int] = []
+        grouped: Dict[str, Dict[object, List[int]]] = {d: defaultdict(list) for d in DIMENSIONS}
+        for row in rows:
+            ids.append(row[0])
+            for dimension, value in zip(DIMENSIONS, row[1:]):
+                grouped[dimension][value].append(row[0])
+        index = cls()
+        index.all = _bitmap(ids)
+        for dimension, by_value in grouped.items():
+            index.values[dimension] = {value: _bitmap(members) for value, members in by_value.items()}
+        return index
+
+    def add(self, row: Snapshot) -> None:
+        contact_id = row[0]
+        self.all.add(contact_id)
+        for dimension, value in zip(DIMENSIONS, row[1:]):
+            bitmap = self.values[dimension].get(value)
+            if bitmap is None:
+                bitmap = self.values[dimension][value] = _bitmap()
+            bitmap.add(contact_id)
+
+    def remove(self, row: Snapshot) -> None:
+        contact_id = row[0]
+        self.all.discard(contact_id)
+        for dimension, value in zip(DIMENSIONS, row[1:]):
+            bitmap = self.values[dimension].get(value)
+            if bitmap is not None:
+                bitmap.discard(contact_id)
+
+    def _any_of(self, dimension: str, values: Iterable) -> object:
+        bitmaps = [self.values[dimension][value] for value in values if value in self.values[dimension]]
+        if not bitmaps:
+            return _bitmap()
+        # Union en une passe : pas de copie intermédiaire par valeur
+        return BitMap.union(*bitmaps) if len(bitmaps) > 1 else bitmaps[0]
+
+    def segment(self, criteria: SegmentationCriteria):
+        """Bitmap des contacts du segment (mêmes règles que crud.build_segmentation_query)"""
+        result = self.all
+        if criteria.type_client:
+            result = result & self._any_of("type_client", criteria.type_client)
+        if criteria.ville:
+            result = result & self._any_of("ville", criteria.ville)
+        if criteria.region:
+            result = result & self._any_of("region", criteria.region)
+        if criteria.genre:
+            result = result & self._any_of("genre", criteria.genre)
+        if criteria.statut_opt_in is not None:
+            result = result & self._any_of("statut_opt_in", [criteria.statut_opt_in])
+        if criteria.age_min is not None or criteria.age_max is not None:
+            ages = [
+                age for age in self.values["age"]
+                if age is not None
+                and (criteria.age_min is None or age >= criteria.age_min)
+                and (criteria.age_max is None or age <= criteria.age_max)
+            ]
+            result = result & self._any_of("age", ages)
+        return result
+
+
+# ==================== INDEX DU PROCESSUS ====================
+_index: Optional[SegmentIndex] = None
+_journal: Optional[List[Tuple[Optional[Snapshot], Optional[Snapshot]]]] = None
+_lock = threading.Lock()
+
+
+def is_ready() -> bool:
+    return _index is not None
+
+
+def build(db) -> None:
+    """(Re)construire l'index depuis la base ; les écritures concurrentes sont rejouées"""
+    global _index, _journal
+    with _lock:
+        _journal = []
+    try:
+        rows: List[Snapshot] = []
+        last_id = 0
+        columns = [Contact.id_contact] + [getattr(Contact, dimension) for dimension in DIMENSIONS]
+        while True:
+            batch = (
+                db.query(*columns)
+                .filter(Contact.id_contact > last_id)
+                .order_by(Contact.id_contact)
+                .limit(BUILD_BATCH_SIZE)
+                .all()
+            )
+            if not batch:
+                break
+            rows.extend(tuple(row) for row in batch)
+            last_id = batch[-1][0]
+        index = SegmentIndex.from_rows(rows)
+        with _lock:
+            for before, after in _journal:
+                _apply(index, before, after)
+            _index = index
+        print(f"🧮 Index de segmentation: {len(rows)} contacts indexés")
+    finally:
+        with _lock:
+            _journal = None
+
+
+def build_from_database() -> None:
+    """Construire l'index avec sa propre session (tâche de démarrage, hors boucle asyncio)"""
+    db = database.SessionLocal()
+    try:
+        build(db)
+    except Exception as e:
+        print(f"⚠️ Index de segmentation non construit, requêtes SQL utilisées - {e}")
+    finally:
+        db.close()
+
+
+def _apply(index: SegmentIndex, before: Optional[Snapshot], after: Optional[Snapshot]) -> None:
+    if before is not None:
+        index.remove(before)
+    if after is not None:
+        index.add(after)
+
+
+def apply(before: Optional[Snapshot], after: Optional[Snapshot]) -> None:
+    """Répercuter une écriture validée : création (None, après), modification, suppression (avant, None)"""
+    with _lock:
+        if _journal is not None:
+            _journal.append((before, after))
+        if _index is not None:
+            _apply(_index, before, after)
+
+
+def count(criteria: SegmentationCriteria) -> Optional[int]:
+    """Taille du segment, ou None si l'index n'est pas disponible"""
+    with _lock:
+        return len(_index.segment(criteria)) if _index is not None else None
+
+
+def contact_ids(criteria: SegmentationCriteria) -> Optional[List[int]]:
+    """Identifiants triés des contacts du segment, ou None si l'index n'est pas disponible"""
+    with _lock:
+        if _index is None:
+            return None
+        return sorted(_index.segment(criteria))
@@ -0,0 +1,220 @@
+"""Segmentation avancée : expression booléenne compilée en une seule requête SQL.
+
+Une expression (``schemas.SegmentExpression``) combine des groupes ``et`` / ``ou``
+/ ``non`` et des feuilles :
+
+- ``champ`` : comparaison sur une colonne du contact (``SEGMENT_FIELDS``) ;
+- ``liste`` : appartenance à une liste de diffusion (``EXISTS`` sur
+  ``mailinglist_contact``) ;
+- ``campagne`` : historique d'envoi (``EXISTS`` sur ``messages``, par campagne,
+  statut de livraison et date d'envoi) ;
+- ``periode`` : intervalle sur ``date_inscription`` ou ``derniere_activite``.
+
+Tout est traduit en une clause ``WHERE`` sur ``contacts`` : les appartenances
+deviennent des semi-jointures (``EXISTS``) ou des anti-jointures (``NOT EXISTS``),
+si bien qu'une audience complexe se résout en un aller-retour, sans fusion
+d'ensembles côté Python.
+
+Avant compilation, l'arbre est simplifié : groupes imbriqués de même nature
+aplatis, et dans un ``ou``, feuilles ``liste`` regroupées en un seul ``EXISTS`` et
+égalités sur un même champ regroupées en un seul ``IN``.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import and_, exists, false, not_, or_, select, true
+from sqlalchemy.orm import Session
+
+from models import Contact, Message, mailinglist_contact
+from schemas import (
+    SegmentAnd, SegmentCampaignHistory, SegmentCondition, SegmentDateRange,
+    SegmentListMembership, SegmentNot, SegmentOr, SegmentQuery,
+)
+
+MAX_CONDITIONS = 200
+MAX_DEPTH = 12
+
+# Colonnes du contact utilisables dans une condition « champ »
+SEGMENT_FIELDS = {
+    name: getattr(Contact, name)
+    for name in (
+        "nom", "prenom", "numero_telephone", "email", "statut_opt_in", "ville", "region",
+        "code_postal", "type_client", "age", "genre", "source", "date_inscription", "derniere_activite",
+    )
+}
+
+_LIST_OPERATORS = ("in", "not_in")
+_TEXT_OPERATORS = ("contains", "starts_with")
+
+
+# ==================== VALIDATION ====================
+def _check_size(expression, depth: int = 0) -> int:
+    if depth > MAX_DEPTH:
+        raise ValueError(f"Expression trop profonde (au plus {MAX_DEPTH} niveaux)")
+    if isinstance(expression, (SegmentAnd, SegmentOr)):
+        return 1 + sum(_check_size(child, depth + 1) for child in expression.conditions)
+    if isinstance(expression, SegmentNot):
+        return 1 + _check_size(expression.condition, depth + 1)
+    return 1
+
+
+def _coerce(column, value):
+    """Convertir une valeur JSON vers le type Python de la colonne (dates ISO, entiers...)"""
+    try:
+        return TypeAdapter(column.type.python_type).validate_python(value)
+    except ValidationError:
+        raise ValueError(f"Valeur invalide pour '{column.key}': {value!r}")
+
+
+# ==================== SIMPLIFICATION ====================
+def _simplify(expression):
+    """Aplatir les groupes imbriqués et fusionner les feuilles équivalentes d'un « ou »"""
+    if isinstance(expression, SegmentNot):
+        inner = _simplify(expression.condition)
+        if isinstance(inner, SegmentNot):
+            return inner.condition
+        return SegmentNot(condition=inner)
+    if not isinstance(expression, (SegmentAnd, SegmentOr)):
+        return expression
+
+    group_type = type(expression)
+    children = []
+    for child in map(_simplify, expression.conditions):
+        if isinstance(child, group_type):
+            children.extend(child.conditions)
+        else:
+            children.append(child)
+    if group_type is SegmentOr:
+        children = _merge_or_leaves(children)
+    if len(children) == 1:
+        return children[0]
+    return group_type(conditions=children)
+
+
+def _merge_or_leaves(children: List) -> List:
+    list_ids: List[int] = []
+    values_by_field: Dict[str, list] = {}
+    merged = []
+    for child in children:
+        if isinstance(child, SegmentListMembership):
+            list_ids.extend(child.liste_ids)
+        elif (isinstance(child, SegmentCondition) and child.operateur in ("eq", "in")
+              and child.champ in SEGMENT_FIELDS and child.valeur is not None):
+            values = child.valeur if child.operateur == "in" else [child.valeur]
+            if not isinstance(values, list):
+                merged.append(child)  # laissée telle quelle, l'erreur sera levée à la compilation
+                continue
+            values_by_field.setdefault(child.champ, []).extend(values)
+        else:
+            merged.append(child)
+    if list_ids:
+        merged.insert(0, SegmentListMembership(liste_ids=sorted(set(list_ids))))
+    for field, values in values_by_field.items():
+        merged.insert(0, SegmentCondition(champ=field, operateur="in", valeur=values))
+    return merged
+
+
+# ==================== COMPILATION ====================
+def compile_expression(expression):
+    """Clause SQL (filtrable sur ``Contact``) équivalente à l'expression ; ValueError si invalide"""
+    if isinstance(expression, SegmentAnd):
+        return and_(true(), *map(compile_expression, expression.conditions))
+    if isinstance(expression, SegmentOr):
+        return or_(false(), *map(compile_expression, expression.conditions))
+    if isinstance(expression, SegmentNot):
+        return not_(compile_expression(expression.condition))
+    if isinstance(expression, SegmentCondition):
+        return _compile_condition(expression)
+    if isinstance(expression, SegmentListMembership):
+        return exists(
+            select(1).where(
+                mailinglist_contact.c.contact_id == Contact.id_contact,
+                mailinglist_contact.c.mailinglist_id.in_(expression.liste_ids),
+            )
+        )
+    if isinstance(expression, SegmentCampaignHistory):
+        return _compile_campaign_history(expression)
+    if isinstance(expression, SegmentDateRange):
+        return _compile_date_range(expression)
+    raise ValueError(f"Expression de segmentation inconnue: {expression!r}")
+
+
+def _compile_condition(condition: SegmentCondition):
+    column = SEGMENT_FIELDS.get(condition.champ)
+    if column is None:
+        raise ValueError(f"Champ inconnu: '{condition.champ}'. Disponibles: {sorted(SEGMENT_FIELDS)}")
+    operator, value = condition.operateur, condition.valeur
+
+    if operator == "is_null":
+        return column.is_(None)
+    if operator == "not_null":
+        return column.isnot(None)
+    if operator in _LIST_OPERATORS:
+        if not isinstance(value, list):
+            raise ValueError(f"'{operator}' attend une liste de valeurs pour '{condition.champ}'")
+        values = [_coerce(column, item) for item in value]
+        return column.in_(values) if operator == "in" else column.notin_(values)
+    if operator == "between":
+        if not isinstance(value, list) or len(value) != 2:
+            raise ValueError(f"'between' attend [min, max] pour '{condition.champ}'")
+        return column.between(_coerce(column, value[0]), _coerce(column, value[1]))
+    if operator in _TEXT_OPERATORS:
+        if not isinstance(value, str):
+            raise ValueError(f"'{operator}' attend une chaîne pour '{condition.champ}'")
+        escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = f"%{escaped}%" if operator == "contains" else f"{escaped}%"
+        return column.ilike(pattern, escape="\\")
+    if value is None:
+        raise ValueError(f"'{operator}' attend une valeur pour '{condition.champ}' (utiliser is_null)")
+
+    value = _coerce(column, value)
+    return {
+        "eq": column.__eq__,
+        "ne": column.__ne__,
+        "lt": column.__lt__,
+        "lte": column.__le__,
+        "gt": column.__gt__,
+        "gte": column.__ge__,
+    }[operator](value)
+
+
+def _compile_campaign_history(history: SegmentCampaignHistory):
+    filters = [Message.contact_id == Contact.id_contact]
+    if history.campagne_ids:
+        filters.append(Message.campagne_id.in_(history.campagne_ids))
+    if history.statut_livraison:
+        filters.append(Message.statut_livraison.in_(history.statut_livraison))
+    if history.depuis is not None:
+        filters.append(Message.date_envoi >= history.depuis)
+    if history.jusqu_a is not None:
+        filters.append(Message.date_envoi < history.jusqu_a)
+    return exists(select(1).where(*filters))
+
+
+def _compile_date_range(period: SegmentDateRange):
+    column = SEGMENT_FIELDS[period.champ]
+    start = period.depuis
+    if period.derniers_jours is not None:
+        start = datetime.utcnow() - timedelta(days=period.derniers_jours)
+    if start is None and period.jusqu_a is None:
+        raise ValueError(f"Période sur '{period.champ}' sans borne (depuis, jusqu_a ou derniers_jours)")
+    filters = []
+    if start is not None:
+        filters.append(column >= start)
+    if period.jusqu_a is not None:
+        filters.append(column < period.jusqu_a)
+    return and_(*filters)
+
+
+# ==================== REQUETES ====================
+def build_query(db: Session, segment: SegmentQuery, columns: Sequence[str] = ()):
+    """Requête (non exécutée) des contacts du segment ; ``columns`` limite les colonnes lues"""
+    if _check_size(segment.expression) > MAX_CONDITIONS:
+        raise ValueError(f"Expression trop volumineuse (au plus {MAX_CONDITIONS} conditions)")
+    query = db.query(Contact).filter(compile_expression(_simplify(segment.expression)))
+    if segment.statut_opt_in is not None:
+        query = query.filter(Contact.statut_opt_in == segment.statut_opt_in)
+    if columns:
+        query = query.with_entities(*(getattr(Contact, column) for column in columns))
+    return query
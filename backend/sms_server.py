@@ -1,8 +1,10 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, List, Optional
 from datetime import datetime
+import itertools
+import json
 import uvicorn
 
 app = FastAPI(
@@ -33,6 +35,17 @@ class SmsResponse(BaseModel):
     sent_at: datetime
     message_id: Optional[str] = None
 
+class SmsBatchResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    results: List[SmsResponse]
+
+MAX_BATCH_SIZE = 10000
+
+# Monotonic counter so message ids stay unique within the same second
+_message_counter = itertools.count(1)
+
 # Sample contacts for testing
 sample_contacts = [
     {
@@ -85,31 +98,110 @@ def create_contact(contact_data: dict):
     sample_contacts.append(contact)
     return contact
 
+def deliver_sms(sms_data: SmsRequest, log: bool = True) -> SmsResponse:
+    """Validate and (simulate) sending of one SMS, raising ValueError on rejection"""
+    # Validate phone number format
+    if not sms_data.recipient or len(sms_data.recipient) < 10:
+        raise ValueError("Invalid phone number")
+    
+    # Create message ID
+    message_id = f"sms_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{sms_data.recipient[-4:]}_{next(_message_counter)}"
+    
+    if log:
+        print(f"🔥 SMS SENT: {sms_data.message} → {sms_data.recipient}")
+    
+    return SmsResponse(
+        success=True,
+        message=f"SMS sent successfully to {sms_data.contact_name or 'contact'}",
+        recipient=sms_data.recipient,
+        sent_at=datetime.now(),
+        message_id=message_id
+    )
+
+def failed_response(recipient: Any, error: str) -> SmsResponse:
+    return SmsResponse(
+        success=False,
+        message=error,
+        recipient=str(recipient or ""),
+        sent_at=datetime.now()
+    )
+
+def deliver_raw_item(item: Any) -> SmsResponse:
+    """Validate one raw batch item and send it; failures are reported, never raised"""
+    if not isinstance(item, dict):
+        return failed_response(None, "Invalid item: expected a JSON object")
+    try:
+        return deliver_sms(SmsRequest(**item), log=False)
+    except ValidationError as e:
+        errors = "; ".join(f"{'.'.join(str(l) for l in err['loc'])}: {err['msg']}" for err in e.errors())
+        return failed_response(item.get("recipient"), f"Invalid item: {errors}")
+    except Exception as e:
+        return failed_response(item.get("recipient"), f"Failed to send SMS: {str(e)}")
+
 @app.post("/sms/send", response_model=SmsResponse, tags=["SMS"])
 def send_sms(sms_data: SmsRequest):
     """Send SMS message to a contact"""
     try:
-        # Validate phone number format
-        if not sms_data.recipient or len(sms_data.recipient) < 10:
-            raise HTTPException(status_code=400, detail="Invalid phone number")
-        
-        # Create message ID
-        message_id = f"sms_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{sms_data.recipient[-4:]}"
-        
-        print(f"🔥 SMS SENT: {sms_data.message} → {sms_data.recipient}")
-        
-        # Return success response
-        return SmsResponse(
-            success=True,
-            message=f"SMS sent successfully to {sms_data.contact_name or 'contact'}",
-            recipient=sms_data.recipient,
-            sent_at=datetime.now(),
-            message_id=message_id
-        )
-        
+        return deliver_sms(sms_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to send SMS: {str(e)}")
 
+@app.post("/sms/send/batch", response_model=SmsBatchResponse, tags=["SMS"])
+async def send_sms_batch(request: Request):
+    """Send many SMS in one request.
+
+    Accepts a JSON array of SmsRequest objects, or an NDJSON stream (one
+    SmsRequest per line) when sent with ``Content-Type: application/x-ndjson``.
+    Each item gets its own SmsResponse in input order: invalid or failed items
+    are reported with ``success=false`` without failing the rest of the batch.
+    """
+    content_type = request.headers.get("content-type", "")
+    results: List[SmsResponse] = []
+    
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        
+        def handle_line(line: bytes):
+            if not line.strip():
+                return
+            if len(results) >= MAX_BATCH_SIZE:
+                raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE} messages)")
+            try:
+                item = json.loads(line)
+            except ValueError:
+                results.append(failed_response(None, "Invalid item: malformed JSON line"))
+                return
+            results.append(deliver_raw_item(item))
+        
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                handle_line(line)
+        handle_line(buffer)
+    else:
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or an NDJSON stream")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of SMS requests")
+        if len(items) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE} messages)")
+        results = [deliver_raw_item(item) for item in items]
+    
+    succeeded = sum(1 for r in results if r.success)
+    print(f"🔥 SMS BATCH: {succeeded}/{len(results)} sent")
+    
+    return SmsBatchResponse(
+        total=len(results),
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+        results=results
+    )
+
 @app.get("/sms/history", tags=["SMS"])
 def get_sms_history():
     """Get SMS message history"""
@@ -0,0 +1,150 @@
+"""Compilation des modèles de messages personnalisés.
+
+Un ``message_template`` est découpé une seule fois en segments littéraux et en
+champs (``{prenom}``, ``{ville}``...). Le rendu ne lit ensuite que les champs
+réellement présents dans le modèle, en un seul formatage, au lieu d'enchaîner un
+``str.replace`` par placeholder pour chaque contact.
+
+Pour un lot de contacts, ``render_many`` travaille sur des colonnes (DataFrame
+pandas ne contenant que les colonnes utiles) : chaque champ est préparé par une
+opération vectorisée puis les segments sont concaténés colonne par colonne.
+
+Les modèles compilés sont mis en cache par texte du modèle : modifier le modèle
+d'une campagne produit une nouvelle entrée, l'ancienne sort du cache LRU.
+Un placeholder inconnu est conservé tel quel dans le message.
+"""
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+def _text(attribute: str) -> Callable:
+    return lambda contact: getattr(contact, attribute) or ""
+
+
+# Champs disponibles (voir /templates/personalization-help)
+FIELDS: Dict[str, Callable] = {
+    "prenom": _text("prenom"),
+    "nom": _text("nom"),
+    "nom_complet": lambda contact: f"{contact.prenom or ''} {contact.nom or ''}".strip(),
+    "ville": _text("ville"),
+    "region": _text("region"),
+    "type_client": _text("type_client"),
+    "age": lambda contact: str(contact.age) if contact.age else "",
+    "genre": _text("genre"),
+}
+
+
+def _text_column(column: pd.Series) -> np.ndarray:
+    values = column.to_numpy(dtype=object)
+    return np.where(pd.isna(values), "", values)
+
+
+def _full_name_column(frame: pd.DataFrame) -> np.ndarray:
+    prenoms, noms = _text_column(frame["prenom"]), _text_column(frame["nom"])
+    return np.where((prenoms != "") & (noms != ""), prenoms + " " + noms, prenoms + noms)
+
+
+def _age_column(column: pd.Series) -> np.ndarray:
+    ages = pd.to_numeric(column, errors="coerce").to_numpy(dtype=float)
+    valid = ~np.isnan(ages) & (ages != 0)
+    values = np.full(len(ages), "", dtype=object)
+    values[valid] = ages[valid].astype(np.int64).astype(str)
+    return values
+
+
+# Version vectorisée des champs : une colonne (tableau numpy d'objets) par champ
+FRAME_FIELDS: Dict[str, Callable[[pd.DataFrame], np.ndarray]] = {
+    "prenom": lambda frame: _text_column(frame["prenom"]),
+    "nom": lambda frame: _text_column(frame["nom"]),
+    "nom_complet": _full_name_column,
+    "ville": lambda frame: _text_column(frame["ville"]),
+    "region": lambda frame: _text_column(frame["region"]),
+    "type_client": lambda frame: _text_column(frame["type_client"]),
+    "age": lambda frame: _age_column(frame["age"]),
+    "genre": lambda frame: _text_column(frame["genre"]),
+}
+
+# Colonnes de la table contacts lues par chaque champ
+FIELD_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "prenom": ("prenom",),
+    "nom": ("nom",),
+    "nom_complet": ("prenom", "nom"),
+    "ville": ("ville",),
+    "region": ("region",),
+    "type_client": ("type_client",),
+    "age": ("age",),
+    "genre": ("genre",),
+}
+
+
+class CompiledTemplate:
+    """Modèle analysé : littéraux et champs référencés, prêt pour le rendu"""
+
+    __slots__ = ("source", "fields", "columns", "_literals", "_getters", "_format")
+
+    def __init__(self, source: str):
+        self.source = source
+        literals: List[str] = []
+        fields: List[str] = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(source):
+            if match.group(1) not in FIELDS:
+                continue
+            literals.append(source[position:match.start()])
+            fields.append(match.group(1))
+            position = match.end()
+        literals.append(source[position:])
+
+        self.fields: Tuple[str, ...] = tuple(fields)
+        self.columns: Tuple[str, ...] = tuple(
+            dict.fromkeys(column for name in fields for column in FIELD_COLUMNS[name])
+        )
+        self._literals = tuple(literals)
+        self._getters = tuple(FIELDS[name] for name in fields)
+        # Littéraux échappés pour str.format : un seul passage par message
+        escaped = [literal.replace("{", "{{").replace("}", "}}") for literal in literals]
+        self._format = "{}".join(escaped).format
+
+    def render(self, contact) -> str:
+        """Message personnalisé pour un contact (objet exposant les attributs du modèle Contact)"""
+        if not self._getters:
+            return self.source
+        return self._format(*[getter(contact) for getter in self._getters])
+
+    def render_many(
+        self, contacts: Union[pd.DataFrame, Sequence], columns: Optional[Sequence[str]] = None
+    ) -> List[str]:
+        """Messages d'un lot de contacts, rendus colonne par colonne
+
+        ``contacts`` est un DataFrame, une liste d'objets contact, ou une liste de
+        tuples dont ``columns`` donne les noms de colonnes.
+        """
+        if not self.fields or len(contacts) == 0:
+            return [self.source] * len(contacts)
+        if isinstance(contacts, pd.DataFrame):
+            frame = contacts
+        elif columns is not None:
+            frame = pd.DataFrame.from_records(contacts, columns=list(columns))
+        else:
+            frame = pd.DataFrame(
+                {column: [getattr(contact, column) for contact in contacts] for column in self.columns}
+            )
+        # Concaténation sur tableaux numpy d'objets : une boucle C par segment
+        columns = {name: FRAME_FIELDS[name](frame) for name in set(self.fields)}
+        rendered = np.full(len(frame), self._literals[0], dtype=object)
+        for name, literal in zip(self.fields, self._literals[1:]):
+            rendered = rendered + columns[name]
+            if literal:
+                rendered = rendered + literal
+        return rendered.tolist()
+
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> CompiledTemplate:
+    return CompiledTemplate(source)
@@ -181,7 +181,19 @@ def test_campaign_operations():
             print_test_result("Campaign preview", success, response.json() if success else None)
         except Exception as e:
             print_test_result("Campaign preview", False, error=str(e))
-        
+
+        # Test campaign launch and progress
+        try:
+            response = requests.post(f"{BASE_URL}/campaigns/{campaign_id}/launch?concurrency=10", headers=headers)
+            success = response.status_code == 200
+            print_test_result("Launch campaign", success, response.json())
+            time.sleep(1)
+            response = requests.get(f"{BASE_URL}/campaigns/{campaign_id}/progress")
+            success = response.status_code == 200
+            print_test_result("Campaign progress", success, response.json() if success else None)
+        except Exception as e:
+            print_test_result("Launch campaign", False, error=str(e))
+
         # Test update campaign
         update_data = {
             "statut": "en cours"
@@ -27,6 +27,15 @@ def test_sms_api():
         )
         
         print("✅ SMS API Response:", sms_response.json())
+
+        # Test batch SMS endpoint (one invalid item must not fail the batch)
+        batch_response = requests.post(
+            "http://localhost:8001/sms/send/batch",
+            json=[sms_data, {"recipient": "123", "message": "Invalid number"}],
+            headers={"Content-Type": "application/json"}
+        )
+        batch = batch_response.json()
+        print("✅ SMS Batch API:", batch["succeeded"], "sent,", batch["failed"], "failed")
         print("\n🎉 ALL SMS FUNCTIONALITY IS WORKING! 🎉")
         return True
         